@@ -411,7 +411,7 @@ def check(response):
 # users is just so I can avoid autouse on toplevel users fixture b/c it (seems
 # to) break the existing local tests
 @pytest.fixture
-def make_repo(capsys, request, config, tunnel, users):
+def make_repo(capsys, request, config, tunnel, users, env):
     owner = config['github']['owner']
     github = requests.Session()
     github.headers['Authorization'] = 'token %s' % config['github']['token']
@@ -453,7 +453,7 @@ def make_repo(capsys, request, config, tunnel, users):
             if github.head(r['url']).ok:
                 break
 
-        repo = Repo(github, fullname, repos)
+        repo = Repo(github, fullname, repos, hooks=env.process_hooks)
 
         # create webhook
         check(github.post('{}/hooks'.format(repo_url), json={
@@ -498,10 +498,11 @@ def _rate_limited(req):
 
 Commit = collections.namedtuple('Commit', 'id tree message author committer parents')
 class Repo:
-    def __init__(self, session, fullname, repos):
+    def __init__(self, session, fullname, repos, hooks=None):
         self._session = session
         self.name = fullname
         self._repos = repos
+        self._hooks = hooks
         self.hook = False
         repos.append(self)
 
@@ -738,7 +739,7 @@ class Repo:
                 raise TimeoutError("No response for repo %s over 60s" % repo_name)
             time.sleep(1)
 
-        return Repo(s, repo_name, self._repos)
+        return Repo(s, repo_name, self._repos, hooks=self._hooks)
 
     def get_pr(self, number):
         # ensure PR exists before returning it
@@ -817,6 +818,8 @@ class Repo:
     def __exit__(self, *args):
         wait_for_hook(self.hook)
         self.hook = 0
+        if self._hooks:
+            self._hooks()
     class Commit:
         def __init__(self, message, *, author=None, committer=None, tree, reset=False):
             self.id = None
@@ -992,7 +995,7 @@ class PR:
         reponame = info['head']['repo']['full_name']
         if reponame != self.repo.name:
             # not sure deep copying the session object is safe / proper...
-            repo = Repo(copy.deepcopy(self.repo._session), reponame, [])
+            repo = Repo(copy.deepcopy(self.repo._session), reponame, [], hooks=self.repo._hooks)
 
         return PRBranch(repo, info['head']['ref'])
 
@@ -1078,6 +1081,14 @@ class Environment:
     def __getitem__(self, name):
         return Model(self, name)
 
+    def process_hooks(self):
+        """ Handles the webhook events received so far (they are queued by the
+        controller), without the wait of :meth:`run_crons`
+        """
+        for xid in ['runbot_merge.process_events', 'runbot_merge.process_events_worker']:
+            _, cron_id = self('ir.model.data', 'check_object_reference', *xid.split('.', 1))
+            self('ir.cron', 'method_direct_trigger', [cron_id])
+
     def run_crons(self, *xids, **kw):
         crons = xids or self._default_crons
         print('running crons', crons, file=sys.stderr)
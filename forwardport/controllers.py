@@ -1,7 +1,12 @@
+import json
 import pathlib
 
+from odoo.http import Controller, request, route
+
 from odoo.addons.runbot_merge.controllers.dashboard import MergebotDashboard
 
+QUEUES = ['forwardport.batches', 'forwardport.updates', 'forwardport.branch_remover']
+
 class Dashboard(MergebotDashboard):
     def _entries(self):
         changelog = pathlib.Path(__file__).parent / 'changelog'
@@ -13,3 +18,14 @@ class Dashboard(MergebotDashboard):
             for d in changelog.iterdir()
         ]
 
+class Queues(Controller):
+    @route('/forwardport/queues', auth='public', type='http', methods=['GET'])
+    def queues(self):
+        """ Depth and latency (age of the oldest ready item, in seconds) of
+        the forward-port queues, for monitoring.
+        """
+        env = request.env(su=True)
+        return request.make_response(
+            json.dumps({q: env[q]._queue_stats() for q in QUEUES}),
+            headers=[('Content-Type', 'application/json')],
+        )
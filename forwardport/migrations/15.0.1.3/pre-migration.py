@@ -0,0 +1,14 @@
+def migrate(cr, version):
+    """ Create & fill the next reminder date in SQL rather than have the ORM
+    compute it for every historical PR.
+    """
+    cr.execute(
+        "ALTER TABLE runbot_merge_pull_requests"
+        " ADD COLUMN reminder_next timestamp without time zone"
+    )
+    cr.execute("""
+        UPDATE runbot_merge_pull_requests
+           SET reminder_next = merge_date + interval '3 days'
+                             + interval '1 day' * 2 ^ reminder_backoff_factor
+         WHERE merge_date IS NOT NULL
+    """)
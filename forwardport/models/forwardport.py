@@ -3,13 +3,15 @@ import logging
 import pathlib
 import resource
 import subprocess
+import time
 import uuid
 from contextlib import ExitStack
 from datetime import datetime, timedelta
 
+import psycopg2
 from dateutil import relativedelta
 
-from odoo import fields, models
+from odoo import api, fields, models
 from odoo.addons.runbot_merge.github import GH
 from odoo.tools.appdirs import user_cache_dir
 
@@ -18,15 +20,74 @@ MERGE_AGE = relativedelta.relativedelta(weeks=2)
 
 _logger = logging.getLogger(__name__)
 
-class Queue:
-    __slots__ = ()
+class Queue(models.AbstractModel):
+    """ Common behaviour of the forward-port queues.
+
+    Queues may be drained by several cron workers concurrently: each item is
+    claimed with ``FOR UPDATE SKIP LOCKED`` before being processed, and items
+    sharing an :meth:`_ordering_key` are processed in creation order, if an
+    item is being handled by an other worker or is waiting for a retry its
+    successors are skipped until it's done.
+    """
+    _name = 'forwardport.queue'
+    _description = "forward-port queue"
+
     limit = 100
+    # maximum delay between retries of a failing item
+    max_retry_delay = timedelta(hours=4)
+
+    retry_after = fields.Datetime(required=True, default='1900-01-01 01:01:01', index=True)
+    attempts = fields.Integer(default=0, group_operator=None)
 
     def _process_item(self):
         raise NotImplementedError
 
+    def _ordering_key(self):
+        """ Items with the same (non-``None``) ordering key must be processed
+        in order, never concurrently.
+        """
+        return None
+
+    def _claim(self):
+        """ Locks the item for the current transaction, returns whether the
+        lock could be acquired (the item may be locked by an other worker, or
+        may have been processed since it was looked up).
+        """
+        try:
+            self.env.cr.execute(f"""
+                SELECT id FROM {self._table}
+                WHERE id = %s
+                FOR UPDATE SKIP LOCKED
+            """, [self.id])
+        except psycopg2.extensions.TransactionRollbackError:
+            # updated or deleted by a concurrent worker since the snapshot
+            self.env.cr.rollback()
+            return False
+        return bool(self.env.cr.rowcount)
+
     def _process(self):
+        t0 = time.monotonic()
+        processed = skipped = 0
+        blocked = set()
+        # first item of each key waiting for a retry, its successors wait for it
+        retrying = {}
+        for b in self.search(self._retrying_domain(), order='create_date, id'):
+            key = b._ordering_key()
+            if key is not None:
+                retrying.setdefault(key, (b.create_date, b.id))
         for b in self.search(self._search_domain(), order='create_date, id', limit=self.limit):
+            key = b._ordering_key()
+            if key is not None and (key in blocked or (key in retrying and retrying[key] < (b.create_date, b.id))):
+                skipped += 1
+                continue
+            if not b._claim():
+                # in-flight in an other worker, anything else with the same
+                # key has to wait until it's done
+                if key is not None:
+                    blocked.add(key)
+                skipped += 1
+                continue
+
             try:
                 b._process_item()
                 b.unlink()
@@ -36,18 +97,61 @@ class Queue:
                 self.env.cr.rollback()
                 b._on_failure()
                 self.env.cr.commit()
+                if key is not None:
+                    blocked.add(key)
+            processed += 1
+
+        if processed or skipped:
+            _logger.info(
+                "%s: processed %d items in %.1fs, skipped %d (%s)",
+                self._name, processed, time.monotonic() - t0, skipped,
+                ', '.join(f'{k}={v}' for k, v in self._queue_stats().items()),
+            )
 
     def _on_failure(self):
-        pass
+        self.attempts += 1
+        delay = min(timedelta(minutes=2 ** self.attempts), self.max_retry_delay)
+        self.retry_after = fields.Datetime.to_string(fields.Datetime.now() + delay)
 
     def _search_domain(self):
-        return []
+        return [
+            ('retry_after', '<=', fields.Datetime.to_string(fields.Datetime.now())),
+        ]
 
-class ForwardPortTasks(models.Model, Queue):
+    def _retrying_domain(self):
+        return [
+            ('retry_after', '>', fields.Datetime.to_string(fields.Datetime.now())),
+        ]
+
+    @api.model
+    def _queue_stats(self):
+        """ Returns the depth of the queue (items waiting, ready to process
+        and waiting for a retry), and the age in seconds of the oldest
+        ready item.
+        """
+        self.env.cr.execute(f"""
+            SELECT count(*),
+                   count(*) FILTER (WHERE retry_after <= (now() at time zone 'utc')),
+                   coalesce(extract(epoch FROM (now() at time zone 'utc') - min(create_date) FILTER (
+                       WHERE retry_after <= (now() at time zone 'utc')
+                   )), 0)
+            FROM {self._table}
+        """)
+        depth, ready, latency = self.env.cr.fetchone()
+        return {
+            'depth': depth,
+            'ready': ready,
+            'retrying': depth - ready,
+            'latency': int(latency),
+        }
+
+class ForwardPortTasks(models.Model):
     _name = 'forwardport.batches'
+    _inherit = 'forwardport.queue'
     _description = 'batches which got merged and are candidates for forward-porting'
 
     limit = 10
+    max_retry_delay = timedelta(minutes=30)
 
     batch_id = fields.Many2one('runbot_merge.batch', required=True)
     source = fields.Selection([
@@ -55,16 +159,10 @@ class ForwardPortTasks(models.Model, Queue):
         ('fp', 'Forward Port Followup'),
         ('insert', 'New branch port')
     ], required=True)
-    retry_after = fields.Datetime(required=True, default='1900-01-01 01:01:01')
-
-    def _search_domain(self):
-        return super()._search_domain() + [
-            ('retry_after', '<=', fields.Datetime.to_string(fields.Datetime.now())),
-        ]
 
-    def _on_failure(self):
-        super()._on_failure()
-        self.retry_after = fields.Datetime.to_string(fields.Datetime.now() + timedelta(minutes=30))
+    def _ordering_key(self):
+        # ports to the same branch are created in order
+        return self.batch_id.target.id
 
     def _process_item(self):
         batch = self.batch_id
@@ -106,8 +204,9 @@ CONFLICT_TEMPLATE = "{ping}WARNING: the latest change ({previous.head}) triggere
 CHILD_CONFLICT = "{ping}WARNING: the update of {previous.display_name} to " \
                  "{previous.head} has caused a conflict in this pull request, " \
                  "data may have been lost."
-class UpdateQueue(models.Model, Queue):
+class UpdateQueue(models.Model):
     _name = 'forwardport.updates'
+    _inherit = 'forwardport.queue'
     _description = 'if a forward-port PR gets updated & has followups (cherrypick succeeded) the followups need to be updated as well'
 
     limit = 10
@@ -115,6 +214,10 @@ class UpdateQueue(models.Model, Queue):
     original_root = fields.Many2one('runbot_merge.pull_requests')
     new_root = fields.Many2one('runbot_merge.pull_requests')
 
+    def _ordering_key(self):
+        # updates to the same forward-port chain must be applied in order
+        return (self.original_root or self.new_root)._get_root().id
+
     def _process_item(self):
         Feedback = self.env['runbot_merge.pull_requests.feedback']
         previous = self.new_root
@@ -205,8 +308,9 @@ class UpdateQueue(models.Model, Queue):
                 previous = child
 
 _deleter = _logger.getChild('deleter')
-class DeleteBranches(models.Model, Queue):
+class DeleteBranches(models.Model):
     _name = 'forwardport.branch_remover'
+    _inherit = 'forwardport.queue'
     _description = "Removes branches of merged PRs"
 
     pr_id = fields.Many2one('runbot_merge.pull_requests')
@@ -214,7 +318,7 @@ class DeleteBranches(models.Model, Queue):
     def _search_domain(self):
         cutoff = self.env.context.get('forwardport_merged_before') \
              or fields.Datetime.to_string(datetime.now() - MERGE_AGE)
-        return [('pr_id.merge_date', '<', cutoff)]
+        return super()._search_domain() + [('pr_id.merge_date', '<', cutoff)]
 
     def _process_item(self):
         _deleter.info(
@@ -287,15 +391,16 @@ class GC(models.TransientModel):
     _description = "Weekly maintenance of... cache repos?"
 
     def _run(self):
-        # lock out the forward port cron to avoid concurrency issues while we're
+        # lock out the forward port crons to avoid concurrency issues while we're
         # GC-ing it: wait until it's available, then SELECT FOR UPDATE it,
         # which should prevent cron workers from running it
-        fp_cron = self.env.ref('forwardport.port_forward')
+        fp_crons = self.env.ref('forwardport.port_forward')\
+                 | self.env.ref('forwardport.port_forward_worker')
         self.env.cr.execute("""
             SELECT 1 FROM ir_cron
-            WHERE id = %s
+            WHERE id = any(%s)
             FOR UPDATE
-        """, [fp_cron.id])
+        """, [fp_crons.ids])
 
         repos_dir = pathlib.Path(user_cache_dir('forwardport'))
         # run on all repos with a forwardport target (~ forwardport enabled)
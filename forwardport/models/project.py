@@ -234,6 +234,11 @@ class PullRequests(models.Model):
     forwardport_ids = fields.One2many('runbot_merge.pull_requests', 'source_id')
     reminder_backoff_factor = fields.Integer(default=-4, group_operator=None)
     merge_date = fields.Datetime()
+    reminder_next = fields.Datetime(
+        compute='_compute_reminder_next', store=True, index=True,
+        help="When to next remind about the outstanding forward-ports of "
+             "this (source) PR, if any",
+    )
 
     detach_reason = fields.Char()
 
@@ -255,6 +260,24 @@ class PullRequests(models.Model):
         for pr in self:
             pr.refname = pr.label.split(':', 1)[-1]
 
+    @api.depends('merge_date', 'reminder_backoff_factor')
+    def _compute_reminder_next(self):
+        for pr in self:
+            if pr.merge_date:
+                pr.reminder_next = pr.merge_date + DEFAULT_DELTA \
+                    + datetime.timedelta(days=2**pr.reminder_backoff_factor)
+            else:
+                pr.reminder_next = False
+
+    def _auto_init(self):
+        res = super()._auto_init()
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS runbot_merge_pr_source_state
+            ON runbot_merge_pull_requests (source_id, state)
+            WHERE source_id IS NOT NULL
+        """)
+        return res
+
     @api.model_create_single
     def create(self, vals):
         # PR opened event always creates a new PR, override so we can precreate PRs
@@ -1108,20 +1131,34 @@ stderr:
             repo.config('--add', 'remote.origin.fetch', '^refs/heads/staging.*')
             return repo
 
-    def _outstanding(self, cutoff):
+    def _outstanding(self, cutoff, due=None):
         """ Returns "outstanding" (unmerged and unclosed) forward-ports whose
-        source was merged before ``cutoff`` (all of them if not provided).
+        source was merged before ``cutoff``.
 
-        :param str cutoff: a datetime (ISO-8601 formatted)
-        :returns: an iterator of (source, forward_ports)
+        :param cutoff: a datetime
+        :param due: if provided, only sources whose reminder is due by then
+        :returns: a list of (source, forward_ports), oldest merged source
+                  first and forward-ports in the order of
+                  :attr:`forwardport_ids`
         """
-        return groupby(self.env['runbot_merge.pull_requests'].search([
-            # only FP PRs
-            ('source_id', '!=', False),
-            # active
-            ('state', 'not in', ['merged', 'closed']),
-            ('source_id.merge_date', '<', cutoff),
-        ], order='source_id, id'), lambda p: p.source_id)
+        self.env.cr.execute("""
+        SELECT source.id, array_agg(pr.id ORDER BY pr.number DESC)
+        FROM runbot_merge_pull_requests source
+        JOIN runbot_merge_pull_requests pr ON pr.source_id = source.id
+        WHERE source.merge_date < %(cutoff)s
+          AND (%(due)s IS NULL OR source.reminder_next <= %(due)s)
+          AND pr.state != 'merged'
+          AND pr.state != 'closed'
+        GROUP BY source.id
+        ORDER BY min(source.merge_date), source.id
+        """, {'cutoff': cutoff, 'due': due})
+        rows = self.env.cr.fetchall()
+        prefetch = [id_ for source_id, ids in rows for id_ in [source_id, *ids]]
+        PRs = self.env['runbot_merge.pull_requests']
+        return [
+            (PRs.browse(source_id).with_prefetch(prefetch), PRs.browse(ids).with_prefetch(prefetch))
+            for source_id, ids in rows
+        ]
 
     def _hall_of_shame(self):
         """Provides data for the HOS view
@@ -1129,23 +1166,11 @@ stderr:
         * outstanding forward ports per reviewer
         * pull requests with outstanding forward ports, oldest-merged first
         """
-        cutoff_dt = datetime.datetime.now() - DEFAULT_DELTA
-        outstanding = self.env['runbot_merge.pull_requests'].search([
-            ('source_id', '!=', False),
-            ('state', 'not in', ['merged', 'closed']),
-            ('source_id.merge_date', '<', cutoff_dt),
-        ], order=None)
-        # only keep merged because apparently some PRs are in a weird spot
-        # where they're sources but closed?
-        sources = outstanding.mapped('source_id').filtered('merge_date').sorted('merge_date')
-        outstandings = []
-        reviewers = collections.Counter()
-        for source in sources:
-            outstandings.append(Outstanding(source=source, prs=source.forwardport_ids & outstanding))
-            reviewers[source.reviewed_by] += 1
+        outstanding = self._outstanding(datetime.datetime.now() - DEFAULT_DELTA)
+        reviewers = collections.Counter(source.reviewed_by for source, _ in outstanding)
         return HallOfShame(
             reviewers=reviewers.most_common(),
-            outstanding=outstandings,
+            outstanding=[Outstanding(source=source, prs=prs) for source, prs in outstanding],
         )
 
     def _reminder(self):
@@ -1153,21 +1178,25 @@ stderr:
               or fields.Datetime.to_string(datetime.datetime.now() - DEFAULT_DELTA)
         cutoff_dt = fields.Datetime.from_string(cutoff)
 
-        for source, prs in self._outstanding(cutoff):
-            backoff = dateutil.relativedelta.relativedelta(days=2**source.reminder_backoff_factor)
-            prs = list(prs)
-            if source.merge_date > (cutoff_dt - backoff):
-                continue
-            source.reminder_backoff_factor += 1
-            self.env['runbot_merge.pull_requests.feedback'].create({
-                'repository': source.repository.id,
-                'pull_request': source.number,
-                'message': "%sthis pull request has forward-port PRs awaiting action (not merged or closed):\n%s" % (
-                    source.ping(),
-                    '\n- '.join(pr.display_name for pr in sorted(prs, key=lambda p: p.number))
-                ),
-                'token_field': 'fp_github_token',
-            })
+        # only the sources whose reminder is due, the next one is pushed back
+        # by bumping their backoff factor
+        outstanding = self._outstanding(cutoff_dt, due=cutoff_dt + DEFAULT_DELTA)
+        if not outstanding:
+            return
+        self.env['runbot_merge.pull_requests.feedback'].create([{
+            'repository': source.repository.id,
+            'pull_request': source.number,
+            'message': "%sthis pull request has forward-port PRs awaiting action (not merged or closed):\n%s" % (
+                source.ping(),
+                '\n- '.join(pr.display_name for pr in prs.sorted('number'))
+            ),
+            'token_field': 'fp_github_token',
+        } for source, prs in outstanding])
+        for factor, sources in groupby(
+            (source for source, _ in outstanding),
+            key=lambda s: s.reminder_backoff_factor,
+        ):
+            self.browse([s.id for s in sources]).write({'reminder_backoff_factor': factor + 1})
 
     def ping(self, author=True, reviewer=True):
         source = self.source_id
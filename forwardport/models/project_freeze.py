@@ -1,5 +1,6 @@
 from odoo import models
 
+PORT_CRONS = ['forwardport.port_forward', 'forwardport.port_forward_worker']
 
 class FreezeWizard(models.Model):
     """ Override freeze wizard to disable the forward port cron when one is
@@ -12,7 +13,8 @@ class FreezeWizard(models.Model):
 
     def create(self, vals_list):
         r = super().create(vals_list)
-        self.env.ref('forwardport.port_forward').active = False
+        for xid in PORT_CRONS:
+            self.env.ref(xid).active = False
         return r
 
     def action_freeze(self):
@@ -22,5 +24,6 @@ class FreezeWizard(models.Model):
     def unlink(self):
         r = super().unlink()
         if not (self.env.context.get('forwardport_keep_disabled') or self.search_count([])):
-            self.env.ref('forwardport.port_forward').active = True
+            for xid in PORT_CRONS:
+                self.env.ref(xid).active = True
         return r
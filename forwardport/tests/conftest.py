@@ -7,6 +7,8 @@ import requests
 @pytest.fixture
 def default_crons():
     return [
+        'runbot_merge.process_events',
+        'runbot_merge.process_events_worker',
         'runbot_merge.process_updated_commits',
         'runbot_merge.merge_cron',
         'runbot_merge.staging_cron',
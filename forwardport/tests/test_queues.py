@@ -0,0 +1,125 @@
+""" Checks the behaviour of the forward-port queues when drained by concurrent
+workers, do not require github (the queue items are created directly).
+
+An other worker processing an item is simulated by locking its row from a
+separate connection to the database.
+"""
+from datetime import datetime, timedelta
+
+import psycopg2
+import pytest
+
+FMT = '%Y-%m-%d %H:%M:%S'
+
+@pytest.fixture
+def project(env):
+    return env['runbot_merge.project'].create({
+        'name': 'odoo',
+        'github_token': 'x',
+        'github_prefix': 'hansen',
+        'branch_ids': [(0, 0, {'name': 'master'})],
+        'repo_ids': [(0, 0, {'name': 'owner/repo', 'fp_remote_target': 'owner/fork'})],
+    })
+
+@pytest.fixture
+def make_pr(env, project):
+    numbers = iter(range(1, 1000))
+    def make_pr(**kw):
+        n = next(numbers)
+        return env['runbot_merge.pull_requests'].create({
+            'number': n,
+            'repository': project.repo_ids.id,
+            'target': project.branch_ids.id,
+            'label': f'dev:branch-{n}',
+            'head': f'{n:040x}',
+            'message': f'PR {n}',
+            **kw,
+        })
+    return make_pr
+
+@pytest.fixture
+def worker(db):
+    """ Connection of an other worker, its locks are released on rollback
+    """
+    conn = psycopg2.connect(dbname=db)
+    yield conn
+    conn.close()
+
+def run_queue(env, xid, **kw):
+    """ Runs a queue worker cron directly (without :meth:`Environment.run_crons`'s
+    sleep)
+    """
+    _, cron_id = env('ir.model.data', 'check_object_reference', *xid.split('.', 1))
+    env('ir.cron', 'method_direct_trigger', [cron_id], **kw)
+
+def test_skip_locked(env, make_pr, worker):
+    """ An item being processed by a worker is neither claimed by an other
+    worker nor blocking it, but its successors (same ordering key) are not
+    processed until it's done.
+    """
+    root_a, root_b = make_pr(), make_pr()
+    Updates = env['forwardport.updates']
+    a1 = Updates.create({'original_root': root_a.id, 'new_root': root_a.id})
+    a2 = Updates.create({'original_root': root_a.id, 'new_root': root_a.id})
+    b1 = Updates.create({'original_root': root_b.id, 'new_root': root_b.id})
+
+    with worker.cursor() as cr:
+        cr.execute("SELECT id FROM forwardport_updates WHERE id = %s FOR UPDATE", [a1.id])
+    run_queue(env, 'forwardport.updates')
+    assert a1.exists(), "an item locked by an other worker should be skipped"
+    assert a2.exists(), "the successors of an in-flight item should wait for it"
+    assert not b1.exists(), "items with an other ordering key should be processed"
+
+    worker.rollback()
+    run_queue(env, 'forwardport.updates_worker')
+    assert not (a1 | a2).exists()
+
+def test_failure_backoff(env, make_pr):
+    """ A failing item is delayed, then retried once the delay has expired
+    """
+    pr = make_pr(state='merged', label='broken')
+    remover = env['forwardport.branch_remover'].create({'pr_id': pr.id})
+    merged_before = (datetime.utcnow() + timedelta(days=1)).strftime(FMT)
+
+    run_queue(env, 'forwardport.remover', context={'forwardport_merged_before': merged_before})
+    assert remover.exists(), "the failed item should be kept"
+    assert remover.attempts == 1
+    assert remover.retry_after > datetime.utcnow().strftime(FMT), \
+        "the failed item should be delayed"
+
+    run_queue(env, 'forwardport.remover', context={'forwardport_merged_before': merged_before})
+    assert remover.attempts == 1, "the item should not be retried before its delay"
+
+    # the PR's owner does not match the remote, so no call to github
+    pr.label = 'dev:branch'
+    remover.retry_after = '1900-01-01 01:01:01'
+    run_queue(env, 'forwardport.remover', context={'forwardport_merged_before': merged_before})
+    assert not remover.exists()
+
+def test_failure_ordering(env, make_pr, worker):
+    """ The successors of a failed item wait until it's processed, including
+    on the runs following the failure
+    """
+    root, other = make_pr(), make_pr()
+    child = make_pr(parent_id=root.id, source_id=root.id)
+    Updates = env['forwardport.updates']
+    # new_root has a descendant to update (which fails as it's locked)
+    a1 = Updates.create({'original_root': root.id, 'new_root': root.id})
+    a2 = Updates.create({'original_root': root.id, 'new_root': child.id})
+
+    with worker.cursor() as cr:
+        cr.execute("SELECT id FROM runbot_merge_pull_requests WHERE id = %s FOR UPDATE", [child.id])
+    run_queue(env, 'forwardport.updates')
+    worker.rollback()
+    assert a1.attempts == 1
+    assert a1.retry_after > datetime.utcnow().strftime(FMT)
+    assert a2.exists() and a2.attempts == 0
+
+    b1 = Updates.create({'original_root': other.id, 'new_root': other.id})
+    run_queue(env, 'forwardport.updates')
+    assert a2.exists(), "the successor of a failed item should wait for its retry"
+    assert not b1.exists(), "items with an other ordering key should be processed"
+
+    a1.unlink()
+    run_queue(env, 'forwardport.updates')
+    assert not a2.exists()
@@ -30,6 +30,17 @@ def fqdn():
     return socket.gethostname()
 
 
+def is_port_free(port):
+    """ Returns whether the local tcp ``port`` can be bound """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind(('', port))
+        except OSError:
+            return False
+    return True
+
+
 def time2str(t):
     return time.strftime(DEFAULT_SERVER_DATETIME_FORMAT, t)
 
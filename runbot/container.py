@@ -121,6 +121,80 @@ def _docker_build(build_dir, image_tag):
     return (True, None)
 
 
+def docker_image_exists(image_tag):
+    return _docker_image_exists(image_tag)
+
+
+def _docker_image_exists(image_tag):
+    """Return True if an image with this tag is present on the host"""
+    docker_client = docker.from_env()
+    try:
+        docker_client.images.get(image_tag)
+    except docker.errors.ImageNotFound:
+        return False
+    return True
+
+
+def docker_tag(image_tag, new_tag):
+    return _docker_tag(image_tag, new_tag)
+
+
+def _docker_tag(image_tag, new_tag):
+    """Add the tag new_tag to the image tagged image_tag"""
+    docker_client = docker.from_env()
+    repository, tag = new_tag.rsplit(':', 1)
+    return docker_client.images.get(image_tag).tag(repository, tag)
+
+
+def docker_remove_tags(image_tag, keep_tag):
+    return _docker_remove_tags(image_tag, keep_tag)
+
+
+def _docker_remove_tags(image_tag, keep_tag):
+    """Remove the hash tags (image_tag-<hash>) of image_tag other than keep_tag,
+    the superseded images are deleted along with their last tag
+    """
+    docker_client = docker.from_env()
+    repository = image_tag.rsplit(':', 1)[0]
+    for image in docker_client.images.list(name=repository):
+        for tag in image.tags:
+            if tag.startswith(f'{image_tag}-') and tag != keep_tag:
+                try:
+                    docker_client.images.remove(tag)
+                except docker.errors.APIError as e:
+                    _logger.warning('Removal of image tag %s failed: %s', tag, e.explanation)
+
+
+def docker_save(image_tag, path):
+    return _docker_save(image_tag, path)
+
+
+def _docker_save(image_tag, path):
+    """Export the image in a tarball
+    :return: tuple(success, msg) where success is a boolean and msg is the error message or None
+    """
+    result = subprocess.run(['docker', 'save', '-o', path, image_tag], capture_output=True, text=True)
+    if result.returncode:
+        _logger.error('Export of image %s failed', image_tag)
+        return (False, result.stderr)
+    return (True, None)
+
+
+def docker_load(path):
+    return _docker_load(path)
+
+
+def _docker_load(path):
+    """Import the images of a tarball exported by docker_save
+    :return: tuple(success, msg) where success is a boolean and msg is the error message or None
+    """
+    result = subprocess.run(['docker', 'load', '-q', '-i', path], capture_output=True, text=True)
+    if result.returncode:
+        _logger.error('Import of image tarball %s failed', path)
+        return (False, result.stderr)
+    return (True, None)
+
+
 def docker_run(*args, **kwargs):
     return _docker_run(*args, **kwargs)
 
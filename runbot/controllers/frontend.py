@@ -581,16 +581,8 @@ class Runbot(Controller):
         if not builds:
             return {}
 
-        builds = builds.search([('id', 'child_of', builds.ids)])
-
-        parents = {b.id: b.top_parent.id for b in builds.with_context(prefetch_fields=False)}
-        request.env.cr.execute("SELECT build_id, values FROM runbot_build_stat WHERE build_id IN %s AND category = %s", [tuple(builds.ids), key_category]) # read manually is way faster than using orm
-        res = {}
-        for (build_id, values) in request.env.cr.fetchall():
-            if values:
-                res.setdefault(parents[build_id], {}).update(values)
-            # we need to update here to manage the post install case: we want to combine stats from all post_install childrens.
-        return res
+        # the series store the stats of the children (e.g. post_install) on their top parent
+        return request.env['runbot.build.stat.series'].sudo()._read_stats(bundle, trigger, key_category, builds.ids)
 
     @route(['/runbot/stats/<model("runbot.bundle"):bundle>/<model("runbot.trigger"):trigger>'], type='http', auth="public", website=True, sitemap=False)
     def modules_stats(self, bundle, trigger, search=None, **post):
@@ -616,8 +608,11 @@ class Runbot(Controller):
         build_by_bundle = list(build_by_bundle.items())
         build_by_bundle.sort(key=lambda x: -len(x[1]))
         pending_count, level, scheduled_count, pending_assigned_count = self._pending()
+        slot_count, reuse_rate = request.env['runbot.batch.slot']._reuse_stats()
         context = {
             'build_by_bundle': build_by_bundle,
+            'slot_count': slot_count,
+            'reuse_rate': reuse_rate,
             'pending_count': pending_count,
             'pending_assigned_count': pending_assigned_count,
             'pending_level': level,
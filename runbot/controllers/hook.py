@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 
-import time
 import json
 import logging
 
@@ -34,14 +33,17 @@ class Hook(http.Controller):
         remote = request.env['runbot.remote'].sudo().browse(remote_id)
 
         # force update of dependencies too in case a hook is lost
-        if not payload or event == 'push':
-            remote.repo_id._set_hook_time(time.time())
+        if not payload:
+            remote.repo_id._enqueue_hook(remote)
+        elif event == 'push':
+            ref = payload.get('ref', '')
+            remote.repo_id._enqueue_hook(remote, ref[len('refs/heads/'):] if ref.startswith('refs/heads/') else None)
         elif event == 'pull_request':
             pr_number = payload.get('pull_request', {}).get('number', '')
             branch = request.env['runbot.branch'].sudo().search([('remote_id', '=', remote.id), ('name', '=', pr_number)])
             branch._recompute_infos(payload.get('pull_request', {}))
             if payload.get('action') in ('synchronize', 'opened', 'reopened'):
-                remote.repo_id._set_hook_time(time.time())
+                remote.repo_id._enqueue_hook(remote, str(pr_number))
             # remaining recurrent actions: labeled, review_requested, review_request_removed
         elif event == 'delete':
             if payload.get('ref_type') == 'branch':
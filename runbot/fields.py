@@ -50,3 +50,19 @@ class FieldDict(MutableMapping):
 
     def __len__(self):
         return len(self.dict)
+
+
+class IntegerArrayField(Field):
+    type = 'integer_array'
+    column_type = ('_int4', 'int4[]')
+
+    def convert_to_cache(self, value, record, validate=True):
+        return list(value) if value else []
+
+
+class FloatArrayField(Field):
+    type = 'float_array'
+    column_type = ('_float8', 'float8[]')
+
+    def convert_to_cache(self, value, record, validate=True):
+        return list(value) if value else []
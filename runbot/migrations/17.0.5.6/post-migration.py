@@ -0,0 +1,24 @@
+def migrate(cr, version):
+    # fill the stats series from the existing build stats, on the top parent
+    # builds, by chunks of 1000 points
+    cr.execute("""
+        WITH point AS (
+            SELECT DISTINCT batch.bundle_id, params.trigger_id, stat.category, p.key, p.value::float8 AS value, top.id AS build_id, stat.id AS stat_id
+              FROM runbot_build_stat stat
+              JOIN runbot_build build ON build.id = stat.build_id
+              JOIN runbot_build top ON top.id = split_part(build.parent_path, '/', 1)::integer
+              JOIN runbot_build_params params ON params.id = top.params_id
+              JOIN runbot_batch_slot slot ON slot.build_id = top.id
+              JOIN runbot_batch batch ON batch.id = slot.batch_id
+        CROSS JOIN jsonb_each_text(stat.values) AS p(key, value)
+             WHERE params.trigger_id IS NOT NULL
+        ), chunked AS (
+            SELECT *, (row_number() OVER (PARTITION BY bundle_id, trigger_id, category, key ORDER BY build_id, stat_id) - 1) / 1000 AS chunk
+              FROM point
+        )
+        INSERT INTO runbot_build_stat_series (bundle_id, trigger_id, category, key, first_build_id, last_build_id, build_ids, stat_values)
+             SELECT bundle_id, trigger_id, category, key, min(build_id), max(build_id),
+                    array_agg(build_id ORDER BY build_id, stat_id), array_agg(value ORDER BY build_id, stat_id)
+               FROM chunked
+           GROUP BY bundle_id, trigger_id, category, key, chunk
+    """)
@@ -0,0 +1,12 @@
+def migrate(cr, version):
+    # lease the ports of the builds currently started on their host
+    cr.execute("""
+        INSERT INTO runbot_host_port (host_id, port, build_id)
+             SELECT DISTINCT ON (host.id, build.port) host.id, build.port, build.id
+               FROM runbot_build build
+               JOIN runbot_host host ON host.name = build.host
+              WHERE build.local_state IN ('testing', 'running')
+                AND build.port IS NOT NULL
+           ORDER BY host.id, build.port, build.id DESC
+        ON CONFLICT DO NOTHING
+    """)
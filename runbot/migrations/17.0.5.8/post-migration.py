@@ -0,0 +1,22 @@
+import logging
+
+from odoo import api, SUPERUSER_ID
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    # index the similarity of the existing errors, otherwise new errors can't
+    # be matched to them until they are clustered manually
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    cr.execute("""
+        SELECT id FROM runbot_build_error e
+         WHERE NOT EXISTS (SELECT 1 FROM runbot_build_error_bucket b WHERE b.build_error_id = e.id)
+      ORDER BY id
+    """)
+    error_ids = [error_id for error_id, in cr.fetchall()]
+    _logger.info('Indexing the similarity of %s build errors', len(error_ids))
+    BuildError = env['runbot.build.error'].with_context(active_test=False)
+    for i in range(0, len(error_ids), 1000):
+        BuildError.browse(error_ids[i:i + 1000])._index_similarity()
+        env.invalidate_all()
@@ -0,0 +1,22 @@
+import logging
+
+from odoo import api, SUPERUSER_ID
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    # define the last done batch of each bundle to upgrade and category as
+    # its upgrade reference, only new done batches create them otherwise
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    cr.execute("""
+        SELECT DISTINCT ON (batch.bundle_id, batch.category_id) batch.id
+          FROM runbot_batch batch
+          JOIN runbot_bundle bundle ON bundle.id = batch.bundle_id
+         WHERE batch.state = 'done'
+           AND bundle.to_upgrade
+      ORDER BY batch.bundle_id, batch.category_id, batch.id DESC
+    """)
+    batches = env['runbot.batch'].browse(batch_id for batch_id, in cr.fetchall())
+    _logger.info('Defining the upgrade references of %s batches', len(batches))
+    env['runbot.upgrade.reference']._refresh(batches)
@@ -1,8 +1,8 @@
 import time
 import logging
 import datetime
-import subprocess
 
+from collections import defaultdict
 from odoo import models, fields, api
 from ..common import dt2time, s2human_long, pseudo_markdown
 
@@ -99,6 +99,12 @@ class Batch(models.Model):
                     if bundles:
                         batch._log('Cannot kill or skip build %s, build is used in another bundle: %s', build.id, bundles.mapped('name'))
 
+    def write(self, values):
+        res = super().write(values)
+        if values.get('state') == 'done':
+            self.env['runbot.upgrade.reference']._refresh(self)
+        return res
+
     def _process(self):
         processed = self.browse()
         for batch in self:
@@ -123,7 +129,12 @@ class Batch(models.Model):
         build = self.env['runbot.build'].search(domain, limit=1, order='id desc')
         link_type = 'matched'
         killed_states = ('skipped', 'killed', 'manually_killed')
-        if build and build.local_result not in killed_states and build.global_result not in killed_states:
+        if build and (build.local_result in killed_states or build.global_result in killed_states):
+            build = self.env['runbot.build']
+        if not build and not self.bundle_id.host_id:
+            build = self._find_reusable_build(params)
+            link_type = 'reused'
+        if build:
             if build.killable:
                 build.killable = False
         else:
@@ -149,6 +160,32 @@ class Batch(models.Model):
             build._github_status()
         return link_type, build
 
+    def _find_reusable_build(self, params):
+        """ Returns a finished build with the same result fingerprint as
+        ``params``, meaning that only values without impact on the result
+        differ. Failing builds and builds with random errors are not reused
+        since their result may be flaky, neither are builds pinned to a host
+        or created before the last change of the config (the fingerprint
+        does not cover the content of its steps).
+        """
+        reuse_days = int(self.env['ir.config_parameter'].sudo().get_param('runbot.result_reuse_days', 0))
+        if not reuse_days or not params.result_fingerprint:
+            return self.env['runbot.build']
+        builds = self.env['runbot.build'].search([
+            ('params_id.result_fingerprint', '=', params.result_fingerprint),
+            ('parent_id', '=', False),
+            ('keep_host', '=', False),
+            ('global_state', 'in', ('running', 'done')),
+            ('global_result', 'in', ('ok', 'warn')),
+            ('create_date', '>', fields.Datetime.now() - datetime.timedelta(days=reuse_days)),
+            ('create_date', '>=', params.config_id._last_change_date()),
+        ], order='id desc', limit=5)
+        for build in builds:
+            errors = self.env['runbot.build.error.link'].search([('build_id', 'child_of', build.id)]).build_error_id
+            if not any(errors.mapped('random')):
+                return build
+        return self.env['runbot.build']
+
     def _prepare(self, auto_rebase=False):
         _logger.info('Preparing batch %s', self.id)
         if not self.bundle_id.base_id:
@@ -169,12 +206,8 @@ class Batch(models.Model):
         if not dockerfile_id:
             _logger.error('No dockerfile found !')
 
-        triggers = self.env['runbot.trigger'].search([  # could be optimised for multiple batches. Ormcached method?
-            ('project_id', '=', project.id),
-            ('category_id', '=', self.category_id.id)
-        ]).filtered(
-            lambda t: not t.version_domain or \
-            self.bundle_id.version_id.filtered_domain(t._get_version_domain())
+        triggers = self.env['runbot.trigger'].browse(
+            self.env['runbot.trigger']._get_applicable_ids(project.id, self.category_id.id, bundle.version_id.id)
         )
 
         pushed_repo = self.commit_link_ids.mapped('commit_id.repo_id')
@@ -368,45 +401,29 @@ class Batch(models.Model):
             skippable._skip()
 
     def _update_commits_infos(self, base_head_per_repo):
+        links_per_pair = defaultdict(self.env['runbot.commit.link'].browse)
         for link_commit in self.commit_link_ids:
             commit = link_commit.commit_id
             base_head = base_head_per_repo.get(commit.repo_id.id)
             if not base_head:
                 self._warning('No base head found for repo %s', commit.repo_id.name)
                 continue
-            link_commit.base_commit_id = base_head
-            merge_base_sha = False
-            try:
-                link_commit.base_ahead = link_commit.base_behind = 0
-                link_commit.file_changed = link_commit.diff_add = link_commit.diff_remove = 0
-                link_commit.merge_base_commit_id = commit.id
-                if commit.name == base_head.name:
-                    continue
-                merge_base_sha = commit.repo_id._git(['merge-base', commit.name, base_head.name]).strip()
-                merge_base_commit = self.env['runbot.commit']._get(merge_base_sha, commit.repo_id.id)
-                link_commit.merge_base_commit_id = merge_base_commit.id
-
-                ahead, behind = commit.repo_id._git(['rev-list', '--left-right', '--count', '%s...%s' % (commit.name, base_head.name)]).strip().split('\t')
-
-                link_commit.base_ahead = int(ahead)
-                link_commit.base_behind = int(behind)
+            links_per_pair[commit, base_head] |= link_commit
 
-                if merge_base_sha == commit.name:
-                    continue
-
-                # diff. Iter on --numstat, easier to parse than --shortstat summary
-                diff = commit.repo_id._git(['diff', '--numstat', merge_base_sha, commit.name]).strip()
-                if diff:
-                    for line in diff.split('\n'):
-                        link_commit.file_changed += 1
-                        add, remove, _ = line.split(None, 2)
-                        try:
-                            link_commit.diff_add += int(add)
-                            link_commit.diff_remove += int(remove)
-                        except ValueError:  # binary files
-                            pass
-            except subprocess.CalledProcessError:
+        comparisons = self.env['runbot.commit.comparison']._get(links_per_pair)
+        for (commit, base_head), links in links_per_pair.items():
+            comparison = comparisons.get((commit, base_head))
+            if not comparison:
                 self._warning('Commit info failed between %s and %s', commit.name, base_head.name)
+            links.write({
+                'base_commit_id': base_head.id,
+                'merge_base_commit_id': comparison.merge_base_commit_id.id if comparison else commit.id,
+                'base_ahead': comparison.base_ahead if comparison else 0,
+                'base_behind': comparison.base_behind if comparison else 0,
+                'file_changed': comparison.file_changed if comparison else 0,
+                'diff_add': comparison.diff_add if comparison else 0,
+                'diff_remove': comparison.diff_remove if comparison else 0,
+            })
 
     def _warning(self, message, *args):
         self.has_warning = True
@@ -438,7 +455,7 @@ class BatchLog(models.Model):
         return pseudo_markdown(self.message)
 
 
-fa_link_types = {'created': 'hashtag', 'matched': 'link', 'rebuild': 'refresh'}
+fa_link_types = {'created': 'hashtag', 'matched': 'link', 'reused': 'recycle', 'rebuild': 'refresh'}
 
 class BatchSlot(models.Model):
     _name = 'runbot.batch.slot'
@@ -451,7 +468,7 @@ class BatchSlot(models.Model):
     build_id = fields.Many2one('runbot.build', index=True)
     all_build_ids = fields.Many2many('runbot.build', compute='_compute_all_build_ids')
     params_id = fields.Many2one('runbot.build.params', index=True, required=True)
-    link_type = fields.Selection([('created', 'Build created'), ('matched', 'Existing build matched'), ('rebuild', 'Rebuild')], required=True)  # rebuild type?
+    link_type = fields.Selection([('created', 'Build created'), ('matched', 'Existing build matched'), ('reused', 'Equivalent build reused'), ('rebuild', 'Rebuild')], required=True)  # rebuild type?
     active = fields.Boolean('Attached', default=True)
     skipped = fields.Boolean('Skipped', default=False)
     # rebuild, what to do: since build can be in multiple batch:
@@ -468,6 +485,19 @@ class BatchSlot(models.Model):
     def _fa_link_type(self):
         return fa_link_types.get(self.link_type, 'exclamation-triangle')
 
+    @api.model
+    def _reuse_stats(self, days=1):
+        """ Returns the number of slots linked to a build in the last ``days``
+        and the share of them linked to a reused build.
+        """
+        groups = self._read_group(
+            [('create_date', '>', fields.Datetime.now() - datetime.timedelta(days=days)), ('build_id', '!=', False)],
+            ['link_type'], ['__count'],
+        )
+        counts = dict(groups)
+        total = sum(counts.values())
+        return total, (counts.get('reused', 0) / total if total else 0)
+
     def _create_missing_build(self):
         """Create a build when the slot does not have one"""
         self.ensure_one()
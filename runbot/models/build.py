@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import datetime
+import functools
 import getpass
 import hashlib
 import logging
@@ -17,11 +18,13 @@ from psycopg2.extensions import TransactionRollbackError
 
 from ..common import dt2time, now, grep, local_pgadmin_cursor, s2human, dest_reg, os, list_local_dbs, pseudo_markdown, RunbotException, findall, sanitize
 from ..container import docker_stop, docker_state, Command, docker_run
+from ..python_worker import python_worker_run, python_worker_state, python_worker_result, python_worker_stop, python_worker_clear_state
 from ..fields import JsonDictField
 
 from odoo import models, fields, api
 
 from odoo.exceptions import ValidationError
+from odoo.modules.registry import Registry
 from odoo.tools import file_open, file_path
 from odoo.tools.safe_eval import safe_eval
 
@@ -44,6 +47,14 @@ def make_selection(array):
     return [(elem, elem.replace('_', ' ').capitalize()) if isinstance(elem, str) else elem for elem in array]
 
 
+def _run_python_step(dbname, uid, step_id, build_id, force):
+    """ Runs a python step in a worker process, with its own cursor """
+    with Registry(dbname).cursor() as cr:
+        env = api.Environment(cr, uid, {})
+        build = env['runbot.build'].browse(build_id)
+        env['runbot.build.config.step'].browse(step_id)._run_python_worker(build, force=force)
+
+
 class BuildParameters(models.Model):
     _name = 'runbot.build.params'
     _description = "All information used by a build to run, should be unique and set on create only"
@@ -75,6 +86,7 @@ class BuildParameters(models.Model):
     dump_db = fields.Many2one('runbot.database', index=True)  # use to define db to download
 
     fingerprint = fields.Char('Fingerprint', compute='_compute_fingerprint', store=True, index=True)
+    result_fingerprint = fields.Char('Result fingerprint', compute='_compute_fingerprint', store=True, index=True, help="Fingerprint of the values impacting the result of the builds")
 
     _sql_constraints = [
         ('unique_fingerprint', 'unique (fingerprint)', 'avoid duplicate params'),
@@ -105,6 +117,9 @@ class BuildParameters(models.Model):
                 cleaned_vals['used_custom_trigger'] = True
 
             param.fingerprint = hashlib.sha256(str(cleaned_vals).encode('utf8')).hexdigest()
+            relevant_params = (param.config_id._result_relevant_params() if param.config_id else set(cleaned_vals)) | {'create_batch_id'}
+            relevant_vals = {key: value for key, value in cleaned_vals.items() if key in relevant_params}
+            param.result_fingerprint = hashlib.sha256(str(relevant_vals).encode('utf8')).hexdigest()
 
     @api.depends('commit_link_ids')
     def _compute_commit_ids(self):
@@ -126,6 +141,30 @@ class BuildParameters(models.Model):
     def _find_existing(self, fingerprint):
         return self.env['runbot.build.params'].search([('fingerprint', '=', fingerprint)], limit=1)
 
+    def _get_impacted_modules(self):
+        """ Returns the modules impacted by the commits of the bundle compared
+        to their merge base, or None if all the modules must be tested, and
+        the reason of the decision (see :meth:`runbot.trigger._get_impacted_modules`).
+        """
+        self.ensure_one()
+        modified_files = {}
+        # the modules of the trigger's repos depending on a modified module of
+        # a dependency repo are impacted too
+        repos = self.trigger_id.repo_ids | self.trigger_id.dependency_ids
+        for commit_link in self.commit_link_ids:
+            commit = commit_link.commit_id
+            if commit.repo_id not in repos or not commit_link.merge_base_commit_id or commit_link.merge_base_commit_id.name == commit.name:
+                continue
+            modified = commit.repo_id._git(['diff', '--name-only', '%s..%s' % (commit_link.merge_base_commit_id.name, commit.name)])
+            modified_files[commit.repo_id] = [file for file in modified.split('\n') if file]
+        if not any(modified_files.values()):
+            return None, 'no modified files'
+        manifests = {}
+        for commit in self.commit_ids:
+            for module, manifest in commit._get_manifests().items():
+                manifests.setdefault(module, manifest)
+        return self.trigger_id._get_impacted_modules(modified_files, manifests)
+
 class BuildResult(models.Model):
     # remove duplicate management
     # instead, link between bundle_batch and build
@@ -364,6 +403,8 @@ class BuildResult(models.Model):
         if 'local_state' in values:
             if values['local_state'] == 'done':
                 self.filtered(lambda b: b.local_state != 'done').commit_export_ids.unlink()
+            if values['local_state'] in ('pending', 'done'):
+                self.env['runbot.host.port'].search([('build_id', 'in', self.ids)]).build_id = False
 
         local_result = values.get('local_result')
         for build in self:
@@ -392,17 +433,22 @@ class BuildResult(models.Model):
         return res
 
     def _add_child(self, param_values, orphan=False, description=False, additionnal_commit_links=False):
-
-        if len(self.parent_path.split('/')) > 8:
-            self._log('_run_create_build', 'This is too deep, skipping create')
-            return self
-
         if additionnal_commit_links:
             commit_link_ids = self.params_id.commit_link_ids
             commit_link_ids |= additionnal_commit_links
             param_values['commit_link_ids'] = commit_link_ids
 
-        return self.create({
+        return self._add_childs([(param_values, description)], orphan=orphan)
+
+    def _add_childs(self, childs_values, orphan=False):
+        """ Creates all the children of a build at once from a list of
+        (param_values, description) tuples.
+        """
+        if len(self.parent_path.split('/')) > 8:
+            self._log('_run_create_build', 'This is too deep, skipping create')
+            return self
+
+        return self.create([{
             'params_id': self.params_id.copy(param_values).id,
             'parent_id': self.id,
             'build_type': self.build_type,
@@ -410,7 +456,7 @@ class BuildResult(models.Model):
             'orphan_result': orphan,
             'keep_host': self.keep_host,
             'host': self.host if self.keep_host else False,
-        })
+        } for param_values, description in childs_values])
 
     def _result_multi(self):
         if all(build.global_result == 'ok' or not build.global_result for build in self):
@@ -635,19 +681,8 @@ class BuildResult(models.Model):
                     gcstamp.write_text(f'gc date: {datetime.datetime.now()}')
 
     def _find_port(self):
-        # currently used port
-        host_name = self.env['runbot.host']._get_current_name()
-        ids = self.search([('local_state', 'not in', ['pending', 'done']), ('host', '=', host_name)])
-        ports = set(i['port'] for i in ids.read(['port']))
-
-        # starting port
-        icp = self.env['ir.config_parameter']
-        port = int(icp.get_param('runbot.runbot_starting_port', default=2000))
-
-        # find next free port
-        while port in ports:
-            port += 3
-        return port
+        self.ensure_one()
+        return self.env['runbot.host']._get_current()._lease_port(self)
 
     def _logger(self, *l):
         l = list(l)
@@ -732,7 +767,17 @@ class BuildResult(models.Model):
         if build.local_state == 'pending':
             build._init_pendings()
         else:
-            _docker_state = docker_state(build._get_docker_name(), build._path())
+            worker_state = python_worker_state(build._get_docker_name(), build._path())
+            if worker_state in ('END', 'GHOST'):
+                result, message = python_worker_result(build._get_docker_name(), build._path())
+                # the result is kept until it's committed, in case of rollback
+                # (e.g. concurrent update of the build by the worker) it's read
+                # again by the next turn
+                self.env.cr.postcommit.add(functools.partial(python_worker_clear_state, build._get_docker_name(), build._path()))
+                if result != 'ok':
+                    build._log('_schedule', message, level='ERROR')
+                    build.local_result = 'ko'
+            _docker_state = 'RUNNING' if worker_state == 'RUNNING' else docker_state(build._get_docker_name(), build._path())
             if _docker_state == 'RUNNING':
                 timeout = min(build.active_step.cpu_limit, int(icp.get_param('runbot.runbot_timeout', default=10000)))
                 if build.local_state != 'running' and build.job_time > timeout:
@@ -866,6 +911,20 @@ class BuildResult(models.Model):
             docker_run(cmd=cmd, build_dir=build_dir, log_path=log_path, ro_volumes=ro_volumes, **kwargs)
         return start_docker
 
+    def _python_worker_run(self, step, force=False):
+        """ Returns a function starting the python code of ``step`` in a
+        worker process, the result of the worker is checked by ``_schedule``.
+        """
+        self.ensure_one()
+        memory = float(self.env['ir.config_parameter'].sudo().get_param('runbot.python_workers_memory', 0))
+        name = self._get_docker_name()
+        build_dir = self._path()
+        args = (self.env.cr.dbname, self.env.uid, step.id, self.id, force)
+        self.env.flush_all()
+        def start_worker():
+            python_worker_run(name, build_dir, _run_python_step, args, memory=int(memory * 1024 ** 3))
+        return start_worker
+
     def _path(self, *paths):
         """Return the repo build path"""
         self.ensure_one()
@@ -979,6 +1038,7 @@ class BuildResult(models.Model):
             return
         build._log('kill', 'Kill build %s' % build.dest)
         docker_stop(build._get_docker_name(), build._path())
+        python_worker_stop(build._get_docker_name(), build._path())
         v = {'local_state': 'done', 'requested_action': False, 'active_step': False, 'job_end': now()}
         if not build.build_end:
             v['build_end'] = now()
@@ -5,6 +5,7 @@ import logging
 import fnmatch
 import re
 import shlex
+import subprocess
 import time
 from unidiff import PatchSet
 from ..common import now, grep, time2str, rfind, s2human, os, RunbotException, ReProxy
@@ -90,6 +91,31 @@ class Config(models.Model):
                 for create_config in step.create_config_ids:
                     create_config._check_recursion(visited[:])
 
+    def _result_relevant_params(self):
+        """ Returns the names of the build params fields impacting the result
+        of a build using this config, including the builds it creates.
+        """
+        self.ensure_one()
+        relevant_params = {'config_id'}
+        for step in self.step_ids:
+            relevant_params |= step._result_relevant_params()
+            if step.job_type == 'create_build':
+                for create_config in step.create_config_ids:
+                    relevant_params |= create_config._result_relevant_params()
+        return relevant_params
+
+    def _last_change_date(self):
+        """ Returns the date of the last change of the config, of its steps
+        and of the configs they create, builds created before may have run
+        different steps.
+        """
+        self.ensure_one()
+        dates = [self.write_date, *self.step_order_ids.mapped('write_date'), *self.step_ids.mapped('write_date')]
+        for step in self.step_ids:
+            if step.job_type == 'create_build':
+                dates += [create_config._last_change_date() for create_config in step.create_config_ids]
+        return max(dates)
+
 
 class ConfigStepUpgradeDb(models.Model):
     _name = 'runbot.config.step.upgrade.db'
@@ -148,6 +174,7 @@ class ConfigStep(models.Model):
     python_code = fields.Text('Python code', tracking=True, default=PYTHON_DEFAULT)
     python_result_code = fields.Text('Python code for result', tracking=True, default=PYTHON_DEFAULT)
     running_job = fields.Boolean('Job final state is running', default=False, help="Docker won't be killed if checked")
+    python_worker = fields.Boolean('Run in a worker', default=False, tracking=True, help="Run the python code in a separate process so that a long step does not block the other builds of the host. The code cannot start a docker container")
     # create_build
     create_config_ids = fields.Many2many('runbot.build.config', 'runbot_build_config_step_ids_create_config_ids_rel', string='New Build Configs', tracking=True, index=True)
     number_builds = fields.Integer('Number of build to create', default=1, tracking=True)
@@ -188,6 +215,12 @@ class ConfigStep(models.Model):
     def _check_python_result_code(self):
         return self._check_python_field('python_result_code')
 
+    @api.constrains('python_worker', 'python_code')
+    def _check_python_worker(self):
+        for step in self:
+            if step.python_worker and step._is_docker_step():
+                raise ValidationError('A python step running in a worker cannot start a docker container')
+
     def _check_python_field(self, field_name):
         for step in self.sudo().filtered(field_name):
             msg = test_python_expr(expr=step[field_name].strip(), mode="exec")
@@ -259,6 +292,8 @@ class ConfigStep(models.Model):
 
     def _run_step(self, build, **kwargs):
         build.log_counter = self.env['ir.config_parameter'].sudo().get_param('runbot.runbot_maxlogs', 100)
+        if self.job_type == 'python' and self.python_worker:
+            return build._python_worker_run(self, **kwargs)
         run_method = getattr(self, '_run_%s' % self.job_type)
         docker_params = run_method(build, **kwargs)
         if docker_params:
@@ -321,6 +356,26 @@ class ConfigStep(models.Model):
             else:
                 raise
 
+    def _run_python_worker(self, build, force=False):
+        """ Runs the python code of the step then its result code, in a worker
+        process (see :func:`runbot.models.build._run_python_step`).
+        """
+        if self._run_python(build, force=force):
+            raise RunbotException('A python step running in a worker cannot start a docker container')
+        if self.python_result_code and self.python_result_code != PYTHON_DEFAULT:
+            build.write(self._make_python_results(build))
+
+    def _result_relevant_params(self):
+        """ Returns the names of the build params fields impacting the result
+        of this step, a finished build can be reused for any params having the
+        same values for these fields (see :meth:`runbot.batch._find_reusable_build`).
+        """
+        self.ensure_one()
+        relevant_params = {'version_id', 'trigger_id', 'config_data', 'modules', 'commit_link_ids', 'builds_reference_ids', 'upgrade_from_build_id', 'upgrade_to_build_id', 'dump_db'}
+        if self._is_docker_step():
+            relevant_params |= {'dockerfile_id', 'skip_requirements', 'extra_params'}
+        return relevant_params
+
     def _is_docker_step(self):
         if not self:
             return False
@@ -389,6 +444,9 @@ class ConfigStep(models.Model):
         exports = build._checkout()
 
         modules_to_install = self._modules_to_install(build)
+        impacted_modules = self._impacted_modules(build, modules_to_install)
+        if impacted_modules is not None:
+            modules_to_install &= impacted_modules
         mods = ",".join(modules_to_install)
         python_params = []
         py_version = build._get_py_version()
@@ -434,6 +492,8 @@ class ConfigStep(models.Model):
                         test_tags += auto_tags
 
             test_tags = [test_tag for test_tag in test_tags if test_tag]
+            if impacted_modules is not None:
+                test_tags = self._impacted_test_tags(test_tags, modules_to_install)
             if test_tags:
                 cmd.extend(['--test-tags', ','.join(test_tags)])
         elif (test_tags_in_extra or self.test_tags) and "--test-tags" not in available_options:
@@ -501,23 +561,25 @@ class ConfigStep(models.Model):
 
         for target in valid_targets:
             build._log('', 'Checking upgrade to [%s](%s)' % (target.params_id.version_id.name, target.build_url), log_type='markdown')
+            childs_values = []
             for upgrade_db in upgrade_complement_step.upgrade_dbs:
                 if not upgrade_db.min_target_version_id or upgrade_db.min_target_version_id.number <= target.params_id.version_id.number:
                     # note: here we don't consider the upgrade_db config here
                     dbs = build.database_ids.sorted('db_suffix')
                     for db in self._filter_upgrade_database(dbs, upgrade_db.db_pattern):
-                        child = build._add_child({
+                        childs_values.append(({
                             'upgrade_to_build_id': target.id,
                             'upgrade_from_build_id': build,  # always current build
                             'dump_db': db.id,
                             'config_id': upgrade_complement_step.upgrade_config_id
-                        })
-                        child.description = 'Testing migration from %s to %s using parent db %s' % (
+                        }, 'Testing migration from %s to %s using parent db %s' % (
                             version.name,
                             target.params_id.version_id.name,
                             db.name,
-                        )
-                        child._log('', 'This build tests change of schema in stable version testing upgrade to %s' % target.params_id.version_id.name)
+                        )))
+            if childs_values:
+                for child in build._add_childs(childs_values):
+                    child._log('', 'This build tests change of schema in stable version testing upgrade to %s' % target.params_id.version_id.name)
 
     def _run_configure_upgrade(self, build):
         """
@@ -579,11 +641,10 @@ class ConfigStep(models.Model):
                 build._log('_run_configure_upgrade', 'No reference build found with correct target in availables references, skipping. %s' % builds_references.mapped('params_id.version_id.name'), level='ERROR')
                 end = True
             elif len(target_builds) > 1 and not self.upgrade_flat:
-                for target_build in target_builds:
-                    build._add_child(
-                        {'upgrade_to_build_id': target_build.id},
-                        description="Testing migration to %s" % target_build.params_id.version_id.name
-                    )
+                build._add_childs([(
+                    {'upgrade_to_build_id': target_build.id},
+                    "Testing migration to %s" % target_build.params_id.version_id.name
+                ) for target_build in target_builds])
                 end = True
         if end:
             return  # replace this by a python job friendly solution
@@ -603,17 +664,18 @@ class ConfigStep(models.Model):
                 if not from_builds:
                     build._log('_run_configure_upgrade', 'No source version found for %s, skipping' % target_version.name, level='INFO')
                 elif not self.upgrade_flat:
-                    for from_build in from_builds:
-                        build._add_child(
-                            {'upgrade_to_build_id': target_build.id, 'upgrade_from_build_id': from_build.id},
-                            description="Testing migration from %s to %s" % (from_build.params_id.version_id.name, target_build.params_id.version_id.name)
-                        )
+                    build._add_childs([(
+                        {'upgrade_to_build_id': target_build.id, 'upgrade_from_build_id': from_build.id},
+                        "Testing migration from %s to %s" % (from_build.params_id.version_id.name, target_build.params_id.version_id.name)
+                    ) for from_build in from_builds])
                     end = True
 
         if end:
             return  # replace this by a python job friendly solution
 
         assert not param.dump_db
+        dump_builds_by_source = self.env['runbot.upgrade.reference']._get_dump_builds(build.browse().union(*source_builds_by_target.values()))
+        childs_values = []
         for target, sources in source_builds_by_target.items():
             for source in sources:
                 valid_databases = []
@@ -622,8 +684,9 @@ class ConfigStep(models.Model):
                 for upgrade_db in self.upgrade_dbs:
                     if not upgrade_db.min_target_version_id or upgrade_db.min_target_version_id.number <= target.params_id.version_id.number:
                         config_id = upgrade_db.config_id
-                        dump_builds = build.search([('id', 'child_of', source.id), ('params_id.config_id', '=', config_id.id), ('orphan_result', '=', False)])
-                        # this search is not optimal
+                        dump_builds = dump_builds_by_source.get(source, build.browse()).filtered(lambda dump_build: dump_build.params_id.config_id == config_id)
+                        if not dump_builds:
+                            dump_builds = build.search([('id', 'child_of', source.id), ('params_id.config_id', '=', config_id.id), ('orphan_result', '=', False)])
                         if not dump_builds:
                             build._log('_run_configure_upgrade', 'No child build found with config %s in %s' % (config_id.name, source.id), level='ERROR')
                         dbs = dump_builds.database_ids.sorted('db_suffix')
@@ -639,20 +702,20 @@ class ConfigStep(models.Model):
                     #            additionnal_commit_links |= commit_link
                     #    build._log('', 'Adding sources from build [%s](%s)' % (target.id, target.build_url), log_type='markdown')
 
-                    child = build._add_child({
+                    childs_values.append(({
                         'upgrade_to_build_id': target.id,
                         'upgrade_from_build_id': source,
                         'dump_db': db.id,
                         'config_id': self.upgrade_config_id
-                    })
-
-                    child.description = 'Testing migration from %s to %s using db %s (%s)' % (
+                    }, 'Testing migration from %s to %s using db %s (%s)' % (
                         source.params_id.version_id.name,
                         target.params_id.version_id.name,
                         db.name,
                         config_id.name
-                    )
+                    )))
                 # TODO log somewhere if no db at all is found for a db_suffix
+        if childs_values:
+            build._add_childs(childs_values)
 
     def _get_upgrade_source_versions(self, target_version):
         if self.upgrade_from_version_ids:
@@ -809,9 +872,8 @@ class ConfigStep(models.Model):
             for next_version in next_versions:
                 if bundle.version_id in upgrade_complement_step._get_upgrade_source_versions(next_version):
                     target_versions |= next_version
-        return target_versions.with_context(
-            category_id=category_id, project_id=bundle.project_id.id
-            ).mapped('base_bundle_id').filtered('to_upgrade').mapped('last_done_batch')
+        target_bundles = target_versions.with_context(project_id=bundle.project_id.id).mapped('base_bundle_id').filtered('to_upgrade')
+        return self.env['runbot.upgrade.reference']._get_batches(target_bundles, category_id)
 
     def _reference_batches_upgrade(self, bundle, category_id):
         target_refs_bundles = self.env['runbot.bundle']
@@ -848,9 +910,7 @@ class ConfigStep(models.Model):
                 from_versions(f_bundle)
             source_refs_bundles = source_refs_bundles.filtered('to_upgrade')
 
-        return (target_refs_bundles | source_refs_bundles).with_context(
-            category_id=category_id
-            ).mapped('last_done_batch')
+        return self.env['runbot.upgrade.reference']._get_batches(target_refs_bundles | source_refs_bundles, category_id)
 
     def _log_end(self, build):
         if self.job_type == 'create_build':
@@ -880,6 +940,38 @@ class ConfigStep(models.Model):
     def _modules_to_install(self, build):
         return set(build._get_modules_to_test(modules_patterns=self.install_modules))
 
+    def _impacted_modules(self, build, modules_to_install):
+        """ Returns the modules to test if the trigger only tests the modules
+        impacted by the changes, None if all the modules must be tested.
+        """
+        if not build.params_id.trigger_id.test_impacted_modules:
+            return None
+        try:
+            impacted_modules, reason = build.params_id._get_impacted_modules()
+        except subprocess.CalledProcessError as e:
+            impacted_modules, reason = None, f'modified files cannot be listed ({e})'
+        if impacted_modules is not None and not impacted_modules & modules_to_install:
+            impacted_modules, reason = None, f'no module to test in the impacted modules ({reason})'
+        if impacted_modules is None:
+            build._log('impacted_modules', f'Testing all modules: {reason}')
+        else:
+            build._log('impacted_modules', 'Testing %s impacted modules out of %s (%s): %s' % (
+                len(impacted_modules & modules_to_install), len(modules_to_install), reason, ', '.join(sorted(impacted_modules & modules_to_install))))
+        return impacted_modules
+
+    def _impacted_test_tags(self, test_tags, modules):
+        """ Restricts the positive ``test_tags`` to ``modules`` """
+        negative_tags = [test_tag for test_tag in test_tags if test_tag.startswith('-')]
+        positive_tags = [test_tag for test_tag in test_tags if not test_tag.startswith('-')] or ['']
+        impacted_tags = []
+        for test_tag in positive_tags:
+            if '/' in test_tag:  # already restricted to a module
+                impacted_tags.append(test_tag)
+                continue
+            tag, spec = re.match(r'([^:.]*)(.*)', test_tag).groups()
+            impacted_tags += [f'{tag}/{module}{spec}' for module in sorted(modules)]
+        return impacted_tags + negative_tags
+
     def _post_install_commands(self, build, modules_to_install, py_version=None):
         cmds = []
         if self.coverage:
@@ -914,7 +1006,9 @@ class ConfigStep(models.Model):
         if log_time:
             build.job_end = log_time
         if self.job_type == 'python' and self.python_result_code and self.python_result_code != PYTHON_DEFAULT:
-            build.write(self._make_python_results(build))
+            # the results of a step running in a worker are made by the worker
+            if not self.python_worker:
+                build.write(self._make_python_results(build))
         elif self.job_type in ['install_odoo', 'python']:
             if self.coverage:
                 build.write(self._make_coverage_results(build))
@@ -1088,6 +1182,7 @@ class ConfigStep(models.Model):
                     } for category, values in stats_per_regex.items()
                 ]
                 self.env['runbot.build.stat'].create(build_stats)
+                self.env['runbot.build.stat.series']._add_stats(build, stats_per_regex)
         except Exception as e:
             message = '**An error occured while computing statistics of %s:**\n`%s`' % (build.job, str(e).replace('\\n', '\n').replace("\\'", "'"))
             _logger.exception(message)
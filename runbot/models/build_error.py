@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import hashlib
 import logging
+import random
 import re
 
 from collections import defaultdict
@@ -12,6 +13,50 @@ from odoo.exceptions import ValidationError, UserError
 
 _logger = logging.getLogger(__name__)
 
+# Similarity index: the minhash signature of the cleaned content shingles is
+# split in LSH bands, errors sharing a band bucket are candidates for being
+# similar and are then compared on their whole signature.
+SHINGLE_SIZE = 3
+LSH_BANDS = 16
+LSH_ROWS = 4
+LSH_CANDIDATES = 20
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_random = random.Random(0x5EED)
+_PERMUTATIONS = [
+    (_random.randrange(1, _MERSENNE_PRIME), _random.randrange(0, _MERSENNE_PRIME))
+    for _ in range(LSH_BANDS * LSH_ROWS)
+]
+
+
+def _minhash(content):
+    """ Returns the minhash signature of the token shingles of ``content`` """
+    tokens = re.findall(r'\w+', content)
+    shingles = {
+        ' '.join(tokens[i:i + SHINGLE_SIZE])
+        for i in range(max(1, len(tokens) - SHINGLE_SIZE + 1))
+    }
+    hashes = [
+        int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=4).digest(), 'big')
+        for shingle in shingles
+    ]
+    return [
+        min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+        for a, b in _PERMUTATIONS
+    ]
+
+
+def _lsh_buckets(signature):
+    return [
+        hashlib.sha1(f'{band}:{signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]}'.encode()).hexdigest()[:16]
+        for band in range(LSH_BANDS)
+    ]
+
+
+def _similarity(signature, other):
+    """ Estimated jaccard similarity of the shingles of two signatures """
+    return sum(a == b for a, b in zip(signature, other)) / len(signature)
+
 
 class BuildErrorLink(models.Model):
     _name = 'runbot.build.error.link'
@@ -48,6 +93,7 @@ class BuildError(models.Model):
     file_path = fields.Char('File Path')  # path in ir logging
     function = fields.Char('Function name')  # func name in ir logging
     fingerprint = fields.Char('Error fingerprint', index=True)
+    minhash = fields.Char('Similarity signature', compute='_compute_minhash', store=True)
     random = fields.Boolean('underterministic error', tracking=True)
     responsible = fields.Many2one('res.users', 'Assigned fixer', tracking=True)
     team_id = fields.Many2one('runbot.team', 'Assigned team', tracking=True)
@@ -63,15 +109,15 @@ class BuildError(models.Model):
     trigger_ids = fields.Many2many('runbot.trigger', compute='_compute_trigger_ids', string='Triggers', search='_search_trigger_ids')
     active = fields.Boolean('Active (not fixed)', default=True, tracking=True)
     tag_ids = fields.Many2many('runbot.build.error.tag', string='Tags')
-    build_count = fields.Integer(compute='_compute_build_counts', string='Nb seen', store=True)
+    build_count = fields.Integer(compute='_compute_seen', string='Nb seen', store=True, index=True)
     parent_id = fields.Many2one('runbot.build.error', 'Linked to', index=True)
     child_ids = fields.One2many('runbot.build.error', 'parent_id', string='Child Errors', context={'active_test': False})
     children_build_ids = fields.Many2many('runbot.build', compute='_compute_children_build_ids', string='Children builds')
     error_history_ids = fields.Many2many('runbot.build.error', compute='_compute_error_history_ids', string='Old errors', context={'active_test': False})
-    first_seen_build_id = fields.Many2one('runbot.build', compute='_compute_first_seen_build_id', string='First Seen build')
-    first_seen_date = fields.Datetime(string='First Seen Date', compute='_compute_seen_date', store=True)
-    last_seen_build_id = fields.Many2one('runbot.build', compute='_compute_last_seen_build_id', string='Last Seen build', store=True)
-    last_seen_date = fields.Datetime(string='Last Seen Date', compute='_compute_seen_date', store=True)
+    first_seen_build_id = fields.Many2one('runbot.build', compute='_compute_seen', string='First Seen build', store=True)
+    first_seen_date = fields.Datetime(string='First Seen Date', compute='_compute_seen', store=True, index=True)
+    last_seen_build_id = fields.Many2one('runbot.build', compute='_compute_seen', string='Last Seen build', store=True)
+    last_seen_date = fields.Datetime(string='Last Seen Date', compute='_compute_seen', store=True, index=True)
     test_tags = fields.Char(string='Test tags', help="Comma separated list of test_tags to use to reproduce/remove this error", tracking=True)
 
     @api.constrains('test_tags')
@@ -91,6 +137,7 @@ class BuildError(models.Model):
                 'fingerprint': self._digest(cleaned_content)
             })
         records = super().create(vals_list)
+        records._index_similarity()
         records.action_assign()
         return records
 
@@ -106,6 +153,8 @@ class BuildError(models.Model):
         if 'cleaned_content' in vals:
             vals.update({'fingerprint': self._digest(vals['cleaned_content'])})
         result = super(BuildError, self).write(vals)
+        if 'cleaned_content' in vals:
+            self._index_similarity()
         if vals.get('parent_id'):
             for build_error in self:
                 parent = build_error.parent_id
@@ -127,6 +176,11 @@ class BuildError(models.Model):
                     build_error.team_id = False
         return result
 
+    @api.depends('cleaned_content')
+    def _compute_minhash(self):
+        for build_error in self:
+            build_error.minhash = ' '.join(map(str, _minhash(build_error.cleaned_content or '')))
+
     @api.depends('build_error_link_ids')
     def _compute_build_ids(self):
         for record in self:
@@ -137,11 +191,6 @@ class BuildError(models.Model):
         for record in self:
             record.children_build_error_link_ids = record.build_error_link_ids | record.child_ids.build_error_link_ids
 
-    @api.depends('build_ids', 'child_ids.build_ids')
-    def _compute_build_counts(self):
-        for build_error in self:
-            build_error.build_count = len(build_error.build_ids | build_error.mapped('child_ids.build_ids'))
-
     @api.depends('build_ids')
     def _compute_bundle_ids(self):
         for build_error in self:
@@ -150,13 +199,15 @@ class BuildError(models.Model):
 
     @api.depends('children_build_ids')
     def _compute_version_ids(self):
+        versions = self._links_aggregates('array_agg(DISTINCT b.version_id)')
         for build_error in self:
-            build_error.version_ids = build_error.children_build_ids.version_id 
+            build_error.version_ids = self.env['runbot.version'].browse(versions.get(build_error.id) or [])
 
     @api.depends('children_build_ids')
     def _compute_trigger_ids(self):
+        triggers = self._links_aggregates('array_agg(DISTINCT b.trigger_id) FILTER (WHERE b.trigger_id IS NOT NULL)')
         for build_error in self:
-            build_error.trigger_ids = build_error.children_build_ids.trigger_id
+            build_error.trigger_ids = self.env['runbot.trigger'].browse(triggers.get(build_error.id) or [])
 
     @api.depends('content')
     def _compute_summary(self):
@@ -170,28 +221,59 @@ class BuildError(models.Model):
             all_builds = build_error.build_ids | build_error.mapped('child_ids.build_ids')
             build_error.children_build_ids = all_builds.sorted(key=lambda rec: rec.id, reverse=True)
 
-    @api.depends('children_build_ids')
-    def _compute_last_seen_build_id(self):
-        for build_error in self:
-            build_error.last_seen_build_id = build_error.children_build_ids and build_error.children_build_ids[0] or False
-
-    @api.depends('build_error_link_ids', 'child_ids.build_error_link_ids')
-    def _compute_seen_date(self):
-        for build_error in self:
-            error_dates = (build_error.build_error_link_ids | build_error.child_ids.build_error_link_ids).mapped('log_date')
-            build_error.first_seen_date = error_dates and min(error_dates)
-            build_error.last_seen_date = error_dates and max(error_dates)
-
-    @api.depends('children_build_ids')
-    def _compute_first_seen_build_id(self):
+    @api.depends(
+        'build_error_link_ids.build_id', 'build_error_link_ids.log_date',
+        'child_ids.build_error_link_ids.build_id', 'child_ids.build_error_link_ids.log_date',
+    )
+    def _compute_seen(self):
+        stats = self._links_aggregates(
+            'count(DISTINCT l.build_id), min(l.build_id), max(l.build_id), min(l.log_date), max(l.log_date)'
+        )
         for build_error in self:
-            build_error.first_seen_build_id = build_error.children_build_ids and build_error.children_build_ids[-1] or False
+            build_count, first_build_id, last_build_id, first_date, last_date = stats.get(build_error.id, (0, False, False, False, False))
+            build_error.build_count = build_count
+            build_error.first_seen_build_id = first_build_id
+            build_error.last_seen_build_id = last_build_id
+            build_error.first_seen_date = first_date
+            build_error.last_seen_date = last_date
+
+    def _links_aggregates(self, aggregates):
+        """ Returns the ``aggregates`` over the links (``l``) and linked builds
+        (``b``) of each error and its children, by error id
+        """
+        ids = [build_error.id for build_error in self if isinstance(build_error.id, int)]
+        if not ids:
+            return {}
+        self.env['runbot.build.error.link'].flush_model(['build_id', 'build_error_id', 'log_date'])
+        self.flush_model(['parent_id'])
+        self.env.cr.execute(f"""
+            WITH errors AS (
+                SELECT id AS error_id, id FROM runbot_build_error WHERE id = any(%(ids)s)
+                UNION ALL
+                SELECT parent_id, id FROM runbot_build_error WHERE parent_id = any(%(ids)s)
+            )
+            SELECT errors.error_id, {aggregates}
+              FROM errors
+              JOIN runbot_build_error_link l ON l.build_error_id = errors.id
+              JOIN runbot_build b ON b.id = l.build_id
+          GROUP BY errors.error_id
+        """, {'ids': ids})
+        return {
+            error_id: values[0] if len(values) == 1 else values
+            for error_id, *values in self.env.cr.fetchall()
+        }
 
     @api.depends('fingerprint', 'child_ids.fingerprint')
     def _compute_error_history_ids(self):
+        fingerprints = set(self.mapped('fingerprint')) | set(self.child_ids.mapped('fingerprint'))
+        fixed_errors = defaultdict(self.browse)
+        for fixed_error in self.search([('fingerprint', 'in', list(fingerprints)), ('active', '=', False)]):
+            fixed_errors[fixed_error.fingerprint] |= fixed_error
         for error in self:
-            fingerprints = [error.fingerprint] + [rec.fingerprint for rec in error.child_ids]
-            error.error_history_ids = self.search([('fingerprint', 'in', fingerprints), ('active', '=', False), ('id', '!=', error.id or False)])
+            error.error_history_ids = self.browse().union(*(
+                fixed_errors[fingerprint]
+                for fingerprint in [error.fingerprint] + error.child_ids.mapped('fingerprint')
+            )).filtered(lambda fixed_error: fixed_error.id != error.id)
 
     @api.model
     def _digest(self, s):
@@ -200,6 +282,55 @@ class BuildError(models.Model):
         """
         return hashlib.sha256(s.encode()).hexdigest()
 
+    def _signature(self):
+        self.ensure_one()
+        return [int(v) for v in self.minhash.split()] if self.minhash else _minhash(self.cleaned_content or '')
+
+    @api.model
+    def _similarity_threshold(self):
+        return float(self.env['ir.config_parameter'].sudo().get_param('runbot.error_similarity', default=0))
+
+    def _index_similarity(self):
+        """ Replaces the lsh buckets of the errors by the ones of their
+        current signature
+        """
+        if not self:
+            return
+        error_ids, buckets = [], []
+        for build_error in self:
+            for bucket in _lsh_buckets(build_error._signature()):
+                error_ids.append(build_error.id)
+                buckets.append(bucket)
+        self.env.cr.execute("DELETE FROM runbot_build_error_bucket WHERE build_error_id = any(%s)", [self.ids])
+        self.env.cr.execute("""
+            INSERT INTO runbot_build_error_bucket (build_error_id, bucket)
+            SELECT * FROM unnest(%s::integer[], %s::varchar[])
+        """, [error_ids, buckets])
+        self.env['runbot.build.error.bucket'].invalidate_model()
+
+    @api.model
+    def _find_similar(self, signature, threshold, exclude=None):
+        """ Returns the active error most similar to ``signature`` if at least
+        ``threshold`` similar, only the errors sharing an lsh bucket with the
+        signature are compared.
+        """
+        self.flush_model(['active'])
+        self.env.cr.execute("""
+            SELECT b.build_error_id
+              FROM runbot_build_error_bucket b
+              JOIN runbot_build_error e ON e.id = b.build_error_id
+             WHERE b.bucket = any(%s)
+               AND e.active
+               AND b.build_error_id != %s
+          GROUP BY b.build_error_id
+          ORDER BY count(*) DESC, b.build_error_id
+             LIMIT %s
+        """, [_lsh_buckets(signature), exclude.id if exclude else 0, LSH_CANDIDATES])
+        candidates = self.browse(error_id for error_id, in self.env.cr.fetchall())
+        similarities = [(_similarity(signature, candidate._signature()), candidate) for candidate in candidates]
+        similarity, build_error = max(similarities, default=(0, self.browse()), key=lambda s: s[0])
+        return build_error if similarity >= threshold else self.browse()
+
     @api.model
     def _parse_logs(self, ir_logs):
         if not ir_logs:
@@ -208,48 +339,92 @@ class BuildError(models.Model):
         search_regs = regexes.filtered(lambda r: r.re_type == 'filter')
         cleaning_regs = regexes.filtered(lambda r: r.re_type == 'cleaning')
 
-        hash_dict = defaultdict(self.env['ir.logging'].browse)
+        logs_by_fingerprint = defaultdict(list)
+        cleaned_contents = {}
         for log in ir_logs:
             if search_regs._r_search(log.message):
                 continue
-            fingerprint = self._digest(cleaning_regs._r_sub(log.message))
-            hash_dict[fingerprint] |= log
+            cleaned_content = cleaning_regs._r_sub(log.message)
+            fingerprint = self._digest(cleaned_content)
+            logs_by_fingerprint[fingerprint].append(log)
+            cleaned_contents[fingerprint] = cleaned_content
 
-        build_errors = self.env['runbot.build.error']
+        errors_by_fingerprint = {}
         # add build ids to already detected errors
-        existing_errors = self.env['runbot.build.error'].search([('fingerprint', 'in', list(hash_dict.keys())), ('active', '=', True)])
-        existing_fingerprints = existing_errors.mapped('fingerprint')
-        build_errors |= existing_errors
+        existing_errors = self.search([('fingerprint', 'in', list(logs_by_fingerprint)), ('active', '=', True)])
+        moved_errors = defaultdict(self.browse)
         for build_error in existing_errors:
-            logs = hash_dict[build_error.fingerprint]
+            if build_error.fingerprint in errors_by_fingerprint:
+                continue
+            errors_by_fingerprint[build_error.fingerprint] = build_error
+            log = logs_by_fingerprint[build_error.fingerprint][0]
             # update filepath if it changed. This is optionnal and mainly there in case we adapt the OdooRunner log 
-            if logs[0].path != build_error.file_path:
-                build_error.file_path = logs[0].path
-                build_error.function = logs[0].func
-
-        # create an error for the remaining entries
-        for fingerprint, logs in hash_dict.items():
-            if fingerprint in existing_fingerprints:
+            if log.path != build_error.file_path:
+                moved_errors[log.path, log.func] |= build_error
+        for (path, func), build_errors in moved_errors.items():
+            build_errors.write({'file_path': path, 'function': func})
+
+        # attach the remaining entries to a similar enough error (possibly
+        # one of the errors about to be created), or create one
+        threshold = self._similarity_threshold()
+        new_fingerprints = []
+        new_signatures = []
+        similar_fingerprints = {}
+        for fingerprint in logs_by_fingerprint:
+            if fingerprint in errors_by_fingerprint:
                 continue
-            new_build_error = self.env['runbot.build.error'].create({
-                'content': logs[0].message,
-                'module_name': logs[0].name.removeprefix('odoo.').removeprefix('addons.'),
-                'file_path': logs[0].path,
-                'function': logs[0].func,
+            if threshold:
+                signature = _minhash(cleaned_contents[fingerprint])
+                similar = self._find_similar(signature, threshold)
+                if similar:
+                    errors_by_fingerprint[fingerprint] = similar
+                    continue
+                similar_fingerprint = next((
+                    other for other, other_signature in zip(new_fingerprints, new_signatures)
+                    if _similarity(signature, other_signature) >= threshold
+                ), None)
+                if similar_fingerprint:
+                    similar_fingerprints[fingerprint] = similar_fingerprint
+                    continue
+                new_signatures.append(signature)
+            new_fingerprints.append(fingerprint)
+
+        new_errors = self.create([{
+            'content': logs[0].message,
+            'module_name': logs[0].name.removeprefix('odoo.').removeprefix('addons.'),
+            'file_path': logs[0].path,
+            'function': logs[0].func,
+        } for logs in (logs_by_fingerprint[fingerprint] for fingerprint in new_fingerprints)])
+        errors_by_fingerprint.update(zip(new_fingerprints, new_errors))
+        for fingerprint, similar_fingerprint in similar_fingerprints.items():
+            errors_by_fingerprint[fingerprint] = errors_by_fingerprint[similar_fingerprint]
+
+        # link the builds to their errors, dated by their first log
+        log_dates = {}
+        for fingerprint, build_error in errors_by_fingerprint.items():
+            for log in logs_by_fingerprint[fingerprint]:
+                log_dates.setdefault((log.build_id.id, build_error.id), log.create_date)
+        # the links which already exist are skipped, e.g. when the logs of the
+        # same build are parsed concurrently
+        if log_dates:
+            self.env.cr.execute("""
+                INSERT INTO runbot_build_error_link (build_id, build_error_id, log_date, create_uid, write_uid, create_date, write_date)
+                SELECT build_id, build_error_id, log_date, %(uid)s, %(uid)s, now() at time zone 'utc', now() at time zone 'utc'
+                  FROM unnest(%(build_ids)s::integer[], %(error_ids)s::integer[], %(log_dates)s::timestamp[]) AS l(build_id, build_error_id, log_date)
+                ON CONFLICT (build_id, build_error_id) DO NOTHING
+                RETURNING id
+            """, {
+                'uid': self.env.uid,
+                'build_ids': [build_id for build_id, _ in log_dates],
+                'error_ids': [error_id for _, error_id in log_dates],
+                'log_dates': list(log_dates.values()),
             })
-            build_errors |= new_build_error
-            existing_fingerprints.append(fingerprint)
-
-        for build_error in build_errors:
-            logs = hash_dict[build_error.fingerprint]
-            for rec in logs:
-                if rec.build_id not in build_error.build_error_link_ids.build_id:
-                    self.env['runbot.build.error.link'].create({
-                        'build_id': rec.build_id.id,
-                        'build_error_id': build_error.id,
-                        'log_date': rec.create_date
-                    })
+            links = self.env['runbot.build.error.link'].browse(id_ for id_, in self.env.cr.fetchall())
+            self.invalidate_model(['build_error_link_ids'])
+            self.env['runbot.build'].invalidate_model(['build_error_link_ids'])
+            links.modified(['build_id', 'build_error_id', 'log_date'], create=True)
 
+        build_errors = self.browse(list(dict.fromkeys(build_error.id for build_error in errors_by_fingerprint.values())))
         if build_errors:
             window_action = {
                 "type": "ir.actions.act_window",
@@ -359,6 +534,39 @@ class BuildError(models.Model):
             errors_to_merge = errors_by_fingerprint.filtered(lambda r: r.fingerprint == fingerprint)
             errors_to_merge._merge()
 
+    def action_cluster_errors(self):
+        """ Links together the similar active errors of the recordset, e.g.
+        the ones created before the similarity threshold was set. The errors
+        are re-indexed first.
+        """
+        threshold = self._similarity_threshold()
+        if not threshold:
+            raise UserError("An error similarity threshold must be set in the settings to cluster errors")
+        build_errors = self.filtered('active')
+        _logger.info('Clustering %s build errors', len(build_errors))
+        build_errors._index_similarity()
+
+        roots = {}
+
+        def root(error_id):
+            while roots.get(error_id, error_id) != error_id:
+                error_id = roots[error_id]
+            return error_id
+
+        for build_error in build_errors.sorted('id'):
+            similar = self._find_similar(build_error._signature(), threshold, exclude=build_error)
+            if similar:
+                a, b = root(build_error.id), root((similar.parent_id or similar).id)
+                if a != b:
+                    roots[max(a, b)] = min(a, b)
+
+        clusters = defaultdict(list)
+        for error_id in roots:
+            clusters[root(error_id)].append(error_id)
+        for root_id, error_ids in clusters.items():
+            cluster = self.browse([root_id] + error_ids)
+            (cluster | cluster.child_ids).action_link_errors()
+
     def action_assign(self):
         if not any((not record.responsible and not record.team_id and record.file_path and not record.parent_id) for record in self):
             return
@@ -371,6 +579,15 @@ class BuildError(models.Model):
                     record.team_id = team
 
 
+class BuildErrorBucket(models.Model):
+    _name = 'runbot.build.error.bucket'
+    _description = 'Build error similarity bucket'
+    _log_access = False
+
+    build_error_id = fields.Many2one('runbot.build.error', required=True, index=True, ondelete='cascade')
+    bucket = fields.Char('LSH bucket', required=True, index=True)
+
+
 class BuildErrorTag(models.Model):
 
     _name = "runbot.build.error.tag"
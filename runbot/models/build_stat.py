@@ -1,7 +1,7 @@
 import logging
 
 from odoo import models, fields, api, tools
-from ..fields import JsonDictField
+from ..fields import JsonDictField, IntegerArrayField, FloatArrayField
 
 _logger = logging.getLogger(__name__)
 
@@ -25,3 +25,123 @@ class BuildStat(models.Model):
     )
     category = fields.Char("Category", index=True)
     values = JsonDictField("Value")
+
+
+class BuildStatSeries(models.Model):
+    """ Values of a stat key for the builds of a trigger in a bundle, stored
+    as arrays by chunks of at most ``_chunk_size`` points, so that a range of
+    builds can be read without unpacking the json values of each build stat.
+    Points are stored on the top parent build.
+    """
+    _name = "runbot.build.stat.series"
+    _description = "Statistics series"
+    _log_access = False
+    _chunk_size = 1000
+
+    bundle_id = fields.Many2one("runbot.bundle", "Bundle", required=True, ondelete="cascade")
+    trigger_id = fields.Many2one("runbot.trigger", "Trigger", required=True, ondelete="cascade")
+    category = fields.Char("Category", required=True)
+    key = fields.Char("Key", required=True)
+    first_build_id = fields.Integer("First build", required=True)
+    last_build_id = fields.Integer("Last build", required=True)
+    build_ids = IntegerArrayField("Builds")
+    stat_values = FloatArrayField("Values")
+
+    def init(self):
+        tools.create_index(
+            self._cr, 'runbot_build_stat_series_range', self._table,
+            ['bundle_id', 'trigger_id', 'category', 'last_build_id'],
+        )
+        tools.create_index(
+            self._cr, 'runbot_build_stat_series_trigger_range', self._table,
+            ['trigger_id', 'category', 'last_build_id'],
+        )
+
+    @api.model
+    def _add_stats(self, build, stats_per_category):
+        """ Appends the ``{category: {key: value}}`` stats of ``build`` to the
+        series of its top parent's bundles and trigger
+        """
+        top_parent = build.top_parent
+        trigger = top_parent.params_id.trigger_id
+        points = [
+            (category, key, value)
+            for category, values in stats_per_category.items()
+            for key, value in values.items()
+        ]
+        if not trigger or not points:
+            return
+        categories, keys, values = zip(*points)
+        for bundle in top_parent.slot_ids.batch_id.bundle_id:
+            self.env.cr.execute("""
+                WITH point AS (
+                    SELECT * FROM unnest(%(categories)s::varchar[], %(keys)s::varchar[], %(values)s::float8[]) AS p(category, key, value)
+                ), last_chunk AS (
+                    SELECT DISTINCT ON (s.category, s.key) s.id, s.category, s.key
+                      FROM runbot_build_stat_series s
+                      JOIN point USING (category, key)
+                     WHERE s.bundle_id = %(bundle)s
+                       AND s.trigger_id = %(trigger)s
+                  ORDER BY s.category, s.key, s.last_build_id DESC
+                ), appended AS (
+                    UPDATE runbot_build_stat_series s
+                       SET build_ids = s.build_ids || %(build)s,
+                           stat_values = s.stat_values || point.value,
+                           first_build_id = least(s.first_build_id, %(build)s),
+                           last_build_id = greatest(s.last_build_id, %(build)s)
+                      FROM last_chunk
+                      JOIN point USING (category, key)
+                     WHERE s.id = last_chunk.id
+                       AND cardinality(s.build_ids) < %(chunk_size)s
+                 RETURNING s.category, s.key
+                )
+                INSERT INTO runbot_build_stat_series (bundle_id, trigger_id, category, key, first_build_id, last_build_id, build_ids, stat_values)
+                     SELECT %(bundle)s, %(trigger)s, point.category, point.key, %(build)s, %(build)s, ARRAY[%(build)s], ARRAY[point.value]
+                       FROM point
+                      WHERE NOT EXISTS (SELECT FROM appended WHERE appended.category = point.category AND appended.key = point.key)
+            """, {
+                'categories': list(categories),
+                'keys': list(keys),
+                'values': list(values),
+                'bundle': bundle.id,
+                'trigger': trigger.id,
+                'build': top_parent.id,
+                'chunk_size': self._chunk_size,
+            })
+        self.invalidate_model()
+
+    @api.model
+    def _read_stats(self, bundle, trigger, category, build_ids):
+        """ Returns the ``{build_id: {key: value}}`` stats of the given top
+        parent builds, only reading the chunks overlapping their range.
+
+        The builds of ``bundle`` which are not in its series (e.g. builds
+        matched from or rebuilt in an other bundle) are looked for in the
+        series of the other bundles.
+        """
+        if not build_ids:
+            return {}
+        self.flush_model()
+        res = self._read_points(trigger, category, build_ids, bundle=bundle)
+        missing = set(build_ids) - res.keys()
+        if missing:
+            res.update(self._read_points(trigger, category, missing))
+        return res
+
+    def _read_points(self, trigger, category, build_ids, bundle=None):
+        self.env.cr.execute("""
+            SELECT point.build_id, s.key, point.value
+              FROM runbot_build_stat_series s,
+                   unnest(s.build_ids, s.stat_values) WITH ORDINALITY AS point(build_id, value, position)
+             WHERE (%s IS NULL OR s.bundle_id = %s)
+               AND s.trigger_id = %s
+               AND s.category = %s
+               AND s.last_build_id >= %s
+               AND s.first_build_id <= %s
+               AND point.build_id = any(%s)
+          ORDER BY s.id, point.position
+        """, [bundle and bundle.id, bundle and bundle.id, trigger.id, category, min(build_ids), max(build_ids), list(build_ids)])
+        res = {}
+        for build_id, key, value in self.env.cr.fetchall():
+            res.setdefault(build_id, {})[key] = value
+        return res
@@ -1,7 +1,10 @@
 
+import ast
 import datetime
 import subprocess
 
+from collections import defaultdict
+
 from ..common import os, RunbotException, make_github_session
 import glob
 import shutil
@@ -34,6 +37,8 @@ class Commit(models.Model):
     subject = fields.Text('Subject')
     dname = fields.Char('Display name', compute='_compute_dname')
     rebase_on_id = fields.Many2one('runbot.commit', 'Rebase on commit')
+    addons_tree_ids = fields.Many2many('runbot.addons.tree', string='Addons trees')
+    modules_indexed = fields.Boolean('Modules indexed', help='The modules of the commit are listed in the addons trees')
 
     @api.model_create_multi
     def create(self, vals_list):
@@ -68,6 +73,9 @@ class Commit(models.Model):
         return self._get(self.name, self.repo_id.id, self.read()[0], commit.id)
 
     def _get_available_modules(self):
+        if self._is_modules_indexed():
+            yield from self._get_indexed_modules()
+            return
         for manifest_file_name in self.repo_id.manifest_files.split(','):  # '__manifest__.py' '__openerp__.py'
             for addons_path in (self.repo_id.addons_paths or '').split(','):  # '' 'addons' 'odoo/addons'
                 sep = os.path.join(addons_path, '*')
@@ -75,6 +83,69 @@ class Commit(models.Model):
                     module = os.path.basename(os.path.dirname(manifest_path))
                     yield (addons_path, module, manifest_file_name)
 
+    def _is_modules_indexed(self):
+        # a rebased commit is exported as a merge, its modules may differ
+        return self.modules_indexed and not self.rebase_on_id
+
+    def _get_indexed_modules(self):
+        """ Yields the ``(addons_path, module, manifest_file_name)`` of the
+        modules indexed by :meth:`_index_modules`, in the same order as the
+        filesystem lookup.
+        """
+        self.ensure_one()
+        trees = {tree.addons_path or '': tree for tree in self.addons_tree_ids}
+        for manifest_file_name in self.repo_id.manifest_files.split(','):
+            for addons_path in (self.repo_id.addons_paths or '').split(','):
+                if addons_path not in trees:
+                    continue
+                manifests = trees[addons_path].manifest_ids.filtered(lambda manifest: manifest.manifest_file_name == manifest_file_name)
+                for manifest in manifests.sorted('module'):
+                    yield (addons_path, manifest.module, manifest_file_name)
+
+    def _get_manifests(self):
+        """ Returns the parsed manifests of the commit modules by module name,
+        from the index of the commit (or of the commit it was rebased from),
+        or from the exported sources if the commit is not indexed.
+        """
+        self.ensure_one()
+        commit = self
+        if self.rebase_on_id:
+            commit = self.search([('name', '=', self.name), ('repo_id', '=', self.repo_id.id), ('rebase_on_id', '=', False)], limit=1) or self
+        manifests = {}
+        if commit._is_modules_indexed():
+            for manifest in commit.addons_tree_ids.manifest_ids:
+                manifests.setdefault(manifest.module, {
+                    'depends': manifest.depends.split(',') if manifest.depends else [],
+                    'installable': manifest.installable,
+                    'auto_install': manifest.auto_install,
+                })
+        else:
+            for addons_path, module, manifest_file_name in self._get_available_modules():
+                if module not in manifests:
+                    manifests[module] = _parse_manifest(self._read_source(os.path.join(addons_path, module, manifest_file_name)))
+        return manifests
+
+    def _index_modules(self):
+        """ Lists the modules of each addons path of the commits from the git
+        objects, without export. The trees and manifests are shared between
+        commits so only the addons paths and modules which changed since an
+        already indexed commit need to be parsed.
+        """
+        commits_per_repo = defaultdict(lambda: self.env['runbot.commit'])
+        for commit in self:
+            if not commit.modules_indexed and not commit.rebase_on_id:
+                commits_per_repo[commit.repo_id] |= commit
+        for repo, commits in commits_per_repo.items():
+            try:
+                with repo._cat_file() as read_object:
+                    for commit in commits:
+                        commit.write({
+                            'addons_tree_ids': [(6, 0, self.env['runbot.addons.tree']._index(repo, commit.name, read_object).ids)],
+                            'modules_indexed': True,
+                        })
+            except OSError as e:
+                _logger.warning('Module indexation failed in %s: %s', repo.name, e)
+
     def _list_files(self, patterns):
         #example: git ls-files --with-tree=abcf390f90dbdd39fd61abc53f8516e7278e0931 ':(glob)addons/*/*.py' ':(glob)odoo/addons/*/*.py'
         # note that glob is needed to avoid the star matching **
@@ -83,6 +154,9 @@ class Commit(models.Model):
 
     def _list_available_modules(self):
         # beta version, may replace _get_available_modules latter
+        if self._is_modules_indexed():
+            yield from self._get_indexed_modules()
+            return
         addons_paths = (self.repo_id.addons_paths or '').split(',')
         patterns = []
         for manifest_file_name in self.repo_id.manifest_files.split(','):  # '__manifest__.py' '__openerp__.py'
@@ -209,6 +283,221 @@ class CommitLink(models.Model):
     diff_remove = fields.Integer('# line removed')
 
 
+class CommitComparison(models.Model):
+    """ Cache of the comparison of a commit with a base commit, the same
+    pairs are compared for every batch, rebuild and bundle sharing commits.
+    """
+    _name = 'runbot.commit.comparison'
+    _description = "Commit comparison with a base commit"
+    _log_access = False
+
+    _sql_constraints = [
+        (
+            "commit_comparison_unique",
+            "unique (commit_id, base_commit_id)",
+            "A commit must be compared only once with a base commit",
+        )
+    ]
+
+    commit_id = fields.Many2one('runbot.commit', 'Commit', required=True, ondelete='cascade')
+    base_commit_id = fields.Many2one('runbot.commit', 'Base head commit', required=True, ondelete='cascade')
+    merge_base_commit_id = fields.Many2one('runbot.commit', 'Merge Base commit')
+    base_behind = fields.Integer('# commits behind base')
+    base_ahead = fields.Integer('# commits ahead base')
+    file_changed = fields.Integer('# file changed')
+    diff_add = fields.Integer('# line added')
+    diff_remove = fields.Integer('# line removed')
+
+    @api.model
+    def _get(self, pairs):
+        """ Returns the comparisons of the ``(commit, base_commit)`` pairs by
+        pair, comparing the pairs not in cache with one batch of git processes
+        per repo. Pairs which cannot be compared are missing from the result.
+        """
+        pairs = set(pairs)
+        if not pairs:
+            return {}
+        commits = self.env['runbot.commit'].browse(commit.id for commit, _ in pairs)
+        bases = self.env['runbot.commit'].browse(base.id for _, base in pairs)
+        comparisons = {
+            (comparison.commit_id, comparison.base_commit_id): comparison
+            for comparison in self.search([('commit_id', 'in', commits.ids), ('base_commit_id', 'in', bases.ids)])
+        }
+
+        missing_per_repo = defaultdict(list)
+        vals_list = []
+        for commit, base in pairs:
+            if (commit, base) in comparisons:
+                continue
+            if commit.name == base.name:
+                vals_list.append({'commit_id': commit.id, 'base_commit_id': base.id, 'merge_base_commit_id': commit.id})
+            else:
+                missing_per_repo[commit.repo_id].append((commit, base))
+        for repo, missing in missing_per_repo.items():
+            try:
+                results = repo._compare_commits([(commit.name, base.name) for commit, base in missing])
+            except (OSError, subprocess.CalledProcessError) as e:
+                _logger.warning('Commits comparison failed in %s: %s', repo.name, e)
+                continue
+            merge_bases = {}
+            for commit, base in missing:
+                result = results.get((commit.name, base.name))
+                if not result:
+                    continue
+                merge_base_sha, ahead, behind, file_changed, diff_add, diff_remove = result
+                if merge_base_sha not in merge_bases:
+                    merge_bases[merge_base_sha] = commit if merge_base_sha == commit.name else self.env['runbot.commit']._get(merge_base_sha, repo.id)
+                vals_list.append({
+                    'commit_id': commit.id,
+                    'base_commit_id': base.id,
+                    'merge_base_commit_id': merge_bases[merge_base_sha].id,
+                    'base_ahead': ahead,
+                    'base_behind': behind,
+                    'file_changed': file_changed,
+                    'diff_add': diff_add,
+                    'diff_remove': diff_remove,
+                })
+        for comparison in self.create(vals_list):
+            comparisons[comparison.commit_id, comparison.base_commit_id] = comparison
+        return {pair: comparison for pair, comparison in comparisons.items() if pair in pairs}
+
+
+def _parse_manifest(content):
+    """ Returns the ``depends``, ``installable`` and ``auto_install`` values
+    of the raw content of a manifest, without evaluating it.
+    """
+    try:
+        manifest = ast.literal_eval(content.decode() if isinstance(content, bytes) else content or '')
+        if not isinstance(manifest, dict):
+            manifest = {}
+    except (ValueError, SyntaxError, UnicodeDecodeError, MemoryError, RecursionError, TypeError):
+        manifest = {}
+    return {
+        'depends': [str(depend) for depend in manifest.get('depends') or []],
+        'installable': bool(manifest.get('installable', True)),
+        # auto_install can be a list of the depends triggering the installation
+        'auto_install': bool(manifest.get('auto_install', False)),
+    }
+
+
+def _parse_tree(content):
+    """ Returns the ``{name: (mode, sha)}`` entries of a raw git tree """
+    entries = {}
+    index = 0
+    while index < len(content):
+        space = content.index(b' ', index)
+        nul = content.index(b'\0', space)
+        entries[content[space + 1:nul].decode(errors='replace')] = (content[index:space], content[nul + 1:nul + 21].hex())
+        index = nul + 21
+    return entries
+
+
+class AddonsTree(models.Model):
+    """ Modules of an addons path, identified by the sha of its git tree """
+    _name = 'runbot.addons.tree'
+    _description = "Addons path tree"
+    _log_access = False
+
+    _sql_constraints = [
+        (
+            "addons_tree_unique",
+            "unique (repo_id, addons_path, name)",
+            "An addons tree must be indexed only once",
+        )
+    ]
+
+    name = fields.Char('Tree SHA', required=True)
+    repo_id = fields.Many2one('runbot.repo', 'Repo', required=True, ondelete='cascade')
+    addons_path = fields.Char('Addons path')
+    manifest_ids = fields.Many2many('runbot.module.manifest', string='Manifests')
+
+    @api.model
+    def _index(self, repo, sha, read_object):
+        """ Returns the addons trees of the addons paths of ``repo`` at
+        commit ``sha``, reading the missing ones through ``read_object``
+        (see :meth:`runbot.repo._cat_file`).
+        """
+        addons_paths = (repo.addons_paths or '').split(',')
+        tree_shas = {}
+        for addons_path in addons_paths:
+            git_object = read_object(f'{sha}:{addons_path}')
+            if git_object and git_object[1] == 'tree':
+                tree_shas[addons_path] = git_object[0]
+        trees = self.search([('repo_id', '=', repo.id), ('name', 'in', list(tree_shas.values()))])
+        existing = {(tree.addons_path or '', tree.name) for tree in trees}
+        manifest_file_names = repo.manifest_files.split(',')
+        vals_list = []
+        for addons_path, tree_sha in tree_shas.items():
+            if (addons_path, tree_sha) in existing:
+                continue
+            manifest_keys = set()
+            for module, (mode, module_sha) in _parse_tree(read_object(tree_sha)[2]).items():
+                if mode != b'40000':
+                    continue
+                module_entries = _parse_tree(read_object(module_sha)[2])
+                for manifest_file_name in manifest_file_names:
+                    mode, blob_sha = module_entries.get(manifest_file_name, (None, None))
+                    if mode and not mode.startswith(b'4'):
+                        manifest_keys.add((blob_sha, module, manifest_file_name))
+            manifests = self.env['runbot.module.manifest']._get(manifest_keys, read_object)
+            vals_list.append({
+                'name': tree_sha,
+                'repo_id': repo.id,
+                'addons_path': addons_path,
+                'manifest_ids': [(6, 0, manifests.ids)],
+            })
+            existing.add((addons_path, tree_sha))
+        return trees | self.create(vals_list)
+
+
+class ModuleManifest(models.Model):
+    """ Parsed manifest of a module, identified by the sha of the manifest blob """
+    _name = 'runbot.module.manifest'
+    _description = "Module manifest"
+    _log_access = False
+
+    _sql_constraints = [
+        (
+            "module_manifest_unique",
+            "unique (name, module, manifest_file_name)",
+            "A manifest must be parsed only once",
+        )
+    ]
+
+    name = fields.Char('Blob SHA', required=True)
+    module = fields.Char('Module', required=True, index=True)
+    manifest_file_name = fields.Char('Manifest file name', required=True)
+    depends = fields.Char('Depends', help='Comma separated list of the module dependencies')
+    installable = fields.Boolean('Installable', default=True)
+    auto_install = fields.Boolean('Auto install')
+
+    @api.model
+    def _get(self, keys, read_object):
+        """ Returns the manifests of the ``(blob_sha, module, manifest_file_name)``
+        ``keys``, parsing the ones not known yet.
+        """
+        if not keys:
+            return self
+        manifests = self.search([('name', 'in', list({blob_sha for blob_sha, _, _ in keys}))])
+        existing = {(manifest.name, manifest.module, manifest.manifest_file_name) for manifest in manifests}
+        vals_list = []
+        for key in keys:
+            if key in existing:
+                continue
+            blob_sha, module, manifest_file_name = key
+            manifest = _parse_manifest(read_object(blob_sha)[2])
+            vals_list.append({
+                'name': blob_sha,
+                'module': module,
+                'manifest_file_name': manifest_file_name,
+                'depends': ','.join(manifest['depends']),
+                'installable': manifest['installable'],
+                'auto_install': manifest['auto_install'],
+            })
+            existing.add(key)
+        return manifests | self.create(vals_list)
+
+
 class CommitStatus(models.Model):
     _name = 'runbot.commit.status'
     _description = 'Commit status'
@@ -22,6 +22,8 @@ class Dockerfile(models.Model):
     view_ids = fields.Many2many('ir.ui.view', compute='_compute_view_ids', groups="runbot.group_runbot_admin")
     project_ids = fields.One2many('runbot.project', 'dockerfile_id', string='Default for Projects')
     bundle_ids = fields.One2many('runbot.bundle', 'dockerfile_id', string='Used in Bundles')
+    image_hash = fields.Char('Image hash', readonly=True, help="Content hash of the last image exported by the docker images builder host")
+    host_image_ids = fields.One2many('runbot.docker.image', 'dockerfile_id', string='Host images')
 
     _sql_constraints = [('runbot_dockerfile_name_unique', 'unique(name)', 'A Dockerfile with this name already exists')]
 
@@ -53,3 +55,26 @@ class Dockerfile(models.Model):
         for rec in self:
             keys = re.findall(r'<t.+t-call="(.+)".+', rec.arch_base or '')
             rec.view_ids = self.env['ir.ui.view'].search([('type', '=', 'qweb'), ('key', 'in', keys)]).ids
+
+
+class DockerImage(models.Model):
+    _name = 'runbot.docker.image'
+    _description = "Docker image of a host"
+    _order = 'date desc'
+
+    dockerfile_id = fields.Many2one('runbot.dockerfile', required=True, index=True, ondelete='cascade')
+    host_id = fields.Many2one('runbot.host', required=True, ondelete='cascade')
+    image_hash = fields.Char('Image hash')
+    origin = fields.Selection([('build', 'Built'), ('pull', 'Pulled')], required=True)
+    duration = fields.Float('Duration (in seconds)')
+    date = fields.Datetime('Date', default=fields.Datetime.now)
+
+    _sql_constraints = [('runbot_docker_image_unique', 'unique(dockerfile_id, host_id)', 'Only one image per Dockerfile and host')]
+
+    def _record(self, dockerfile, host, image_hash, origin, duration):
+        values = {'image_hash': image_hash, 'origin': origin, 'duration': duration, 'date': fields.Datetime.now()}
+        image = self.search([('dockerfile_id', '=', dockerfile.id), ('host_id', '=', host.id)])
+        if image:
+            image.write(values)
+        else:
+            self.create({'dockerfile_id': dockerfile.id, 'host_id': host.id, **values})
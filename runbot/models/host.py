@@ -1,16 +1,21 @@
+import hashlib
 import logging
 import getpass
 import time
+import requests
 
 from collections import defaultdict
 
 from odoo import models, fields, api
 from odoo.tools import config, ormcache, file_open
-from ..common import fqdn, local_pgadmin_cursor, os, list_local_dbs, local_pg_cursor
-from ..container import docker_build
+from ..common import fqdn, is_port_free, local_pgadmin_cursor, os, list_local_dbs, local_pg_cursor, RunbotException
+from ..container import docker_build, docker_image_exists, docker_load, docker_remove_tags, docker_save, docker_tag
 
 _logger = logging.getLogger(__name__)
 
+PORT_STEP = 3  # a build exposes its port and the next one
+PORT_LEASE_ATTEMPTS = 10
+
 
 class Host(models.Model):
     _name = 'runbot.host'
@@ -45,6 +50,7 @@ class Host(models.Model):
     build_ids = fields.One2many('runbot.build', compute='_compute_build_ids')
 
     paused = fields.Boolean('Paused', help='Host will stop scheduling while paused')
+    docker_image_builder = fields.Boolean('Docker images builder', tracking=True, help='Build the docker images and export them for the other hosts, which load them instead of building them when their content is the same')
     profile = fields.Boolean('Profile', help='Enable profiling on this host')
 
 
@@ -112,7 +118,7 @@ class Host(models.Model):
 
     def _bootstrap(self):
         """ Create needed directories in static """
-        dirs = ['build', 'nginx', 'repo', 'sources', 'src', 'docker']
+        dirs = ['build', 'nginx', 'repo', 'sources', 'src', 'docker', 'docker/images']
         static_path = self.env['runbot.runbot']._root()
         static_dirs = {d: self.env['runbot.runbot']._path(d) for d in dirs}
         for dir, path in static_dirs.items():
@@ -124,11 +130,25 @@ class Host(models.Model):
         """ build docker images needed by locally pending builds"""
         _logger.info('Building docker images...')
         self.ensure_one()
-        for dockerfile in self.env['runbot.dockerfile'].search([('to_build', '=', True)]):
+        dockerfiles = self.env['runbot.dockerfile'].search([('to_build', '=', True)])
+        for dockerfile in dockerfiles:
             self._docker_build_dockerfile(dockerfile)
+        if self.docker_image_builder:
+            # remove the exported images that are not the last ones
+            images_path = self.env['runbot.runbot']._path('docker', 'images')
+            image_files = {'%s.tar' % image_hash for image_hash in dockerfiles.mapped('image_hash') if image_hash}
+            for image_file in os.listdir(images_path):
+                if image_file not in image_files:
+                    os.remove(os.path.join(images_path, image_file))
         _logger.info('Done...')
 
     def _docker_build_dockerfile(self, dockerfile):
+        """ Makes the image of ``dockerfile`` available on the host. The image
+        is tagged with the hash of its content, nothing is done if this tag is
+        already present. Otherwise, the image exported by the docker images
+        builder host is loaded if it has the same content, else it is built,
+        and the previous hash tags of the image are removed.
+        """
         start = time.time()
         docker_build_path = self.env['runbot.runbot']._path('docker', dockerfile.image_tag)
         os.makedirs(docker_build_path, exist_ok=True)
@@ -143,18 +163,70 @@ class Host(models.Model):
             USER {user}
             ENV COVERAGE_FILE /data/build/.coverage
             """
-        with open(self.env['runbot.runbot']._path('docker', dockerfile.image_tag, 'Dockerfile'), 'w') as Dockerfile:
-            Dockerfile.write(dockerfile.dockerfile + docker_append)
-
-        docker_build_success, msg = docker_build(docker_build_path, dockerfile.image_tag)
-        if not docker_build_success:
-            dockerfile.to_build = False
-            dockerfile.message_post(body=f'Build failure:\n{msg}')
-            # self.env['runbot.runbot']._warning(f'Dockerfile build "{dockerfile.image_tag}" failed on host {self.name}')
+        content = dockerfile.dockerfile + docker_append
+        image_hash = hashlib.sha256(content.encode()).hexdigest()
+        hash_tag = '%s-%s' % (dockerfile.image_tag, image_hash[:16])
+        image_path = self.env['runbot.runbot']._path('docker', 'images', '%s.tar' % image_hash)
+        if docker_image_exists(hash_tag):
+            docker_tag(hash_tag, dockerfile.image_tag)
+            if not self.docker_image_builder or os.path.isfile(image_path):
+                return
+
+        elif not self.docker_image_builder and dockerfile.image_hash == image_hash and self._docker_pull_image(image_hash, image_path):
+            docker_tag(hash_tag, dockerfile.image_tag)
+            docker_remove_tags(dockerfile.image_tag, hash_tag)
+            self.env['runbot.docker.image']._record(dockerfile, self, image_hash, 'pull', time.time() - start)
+            _logger.info('Dockerfile %s loaded in %s', dockerfile.image_tag, time.time() - start)
+            return
+
         else:
+            with open(self.env['runbot.runbot']._path('docker', dockerfile.image_tag, 'Dockerfile'), 'w') as Dockerfile:
+                Dockerfile.write(content)
+
+            docker_build_success, msg = docker_build(docker_build_path, dockerfile.image_tag)
+            if not docker_build_success:
+                dockerfile.to_build = False
+                dockerfile.message_post(body=f'Build failure:\n{msg}')
+                # self.env['runbot.runbot']._warning(f'Dockerfile build "{dockerfile.image_tag}" failed on host {self.name}')
+                return
+            docker_tag(dockerfile.image_tag, hash_tag)
+            docker_remove_tags(dockerfile.image_tag, hash_tag)
             duration = time.time() - start
+            self.env['runbot.docker.image']._record(dockerfile, self, image_hash, 'build', duration)
             if duration > 1:
                 _logger.info('Dockerfile %s finished build in %s', dockerfile.image_tag, duration)
+
+        if self.docker_image_builder:
+            docker_save_success, msg = docker_save(hash_tag, image_path)
+            if docker_save_success:
+                dockerfile.image_hash = image_hash
+            else:
+                _logger.warning('Failed to export image %s: %s', hash_tag, msg)
+
+    def _docker_pull_image(self, image_hash, image_path):
+        """ Downloads and loads the image exported by the docker images builder host """
+        builder = self.search([('docker_image_builder', '=', True)], limit=1)
+        if not builder:
+            return False
+        use_ssl = self.env['ir.config_parameter'].sudo().get_param('runbot.use_ssl', default=True)
+        url = '%s://%s/runbot/static/docker/images/%s.tar' % ('https' if use_ssl else 'http', builder.name, image_hash)
+        try:
+            with requests.get(url, stream=True, timeout=60) as response:
+                response.raise_for_status()
+                with open(image_path, 'wb') as image_file:
+                    for chunk in response.iter_content(chunk_size=1024 * 1024):
+                        image_file.write(chunk)
+            docker_load_success, msg = docker_load(image_path)
+        except (OSError, requests.RequestException) as e:
+            docker_load_success, msg = False, str(e)
+        finally:
+            try:
+                os.remove(image_path)
+            except FileNotFoundError:
+                pass
+        if not docker_load_success:
+            _logger.warning('Failed to load image %s from %s: %s', image_hash, builder.name, msg)
+        return docker_load_success
     
     @ormcache()
     def _host_list(self):
@@ -281,6 +353,98 @@ class Host(models.Model):
     def _process_messages(self):
         self.host_message_ids._process()
 
+    def _lease_port(self, build):
+        """ Leases a free port of the host to ``build`` and returns it. The
+        first released lease is reused, a new one is added after the last
+        lease otherwise. The ports still bound on the host (e.g. by a
+        container being killed) are skipped.
+        """
+        self.ensure_one()
+        Port = self.env['runbot.host.port']
+        Port.search([('build_id', '=', build.id)]).build_id = False
+        Port.flush_model()
+        starting_port = int(self.env['ir.config_parameter'].sudo().get_param('runbot.runbot_starting_port', default=2000))
+        busy_ports = []
+        # ports added concurrently: not visible in the snapshot of the
+        # transaction, so MAX(port) would give the same conflicting port again
+        skipped = 0
+        port = None
+        for attempt in range(PORT_LEASE_ATTEMPTS):
+            port = None
+            self.env.cr.execute("""
+                UPDATE runbot_host_port
+                   SET build_id = %(build_id)s
+                 WHERE id = (
+                    SELECT id
+                      FROM runbot_host_port
+                     WHERE host_id = %(host_id)s
+                       AND build_id IS NULL
+                       AND port >= %(starting_port)s
+                       AND port != ALL(%(busy_ports)s)
+                  ORDER BY port
+                     LIMIT 1
+                       FOR UPDATE SKIP LOCKED
+                 )
+             RETURNING port
+            """, {'build_id': build.id, 'host_id': self.id, 'starting_port': starting_port, 'busy_ports': busy_ports})
+            row = self.env.cr.fetchone()
+            if not row:
+                self.env.cr.execute("""
+                    INSERT INTO runbot_host_port (host_id, port, build_id)
+                    SELECT %(host_id)s, GREATEST(MAX(port) + %(step)s, %(starting_port)s) + %(skipped)s, %(build_id)s
+                      FROM runbot_host_port
+                     WHERE host_id = %(host_id)s
+                ON CONFLICT DO NOTHING
+                 RETURNING port
+                """, {'build_id': build.id, 'host_id': self.id, 'starting_port': starting_port, 'step': PORT_STEP, 'skipped': skipped})
+                row = self.env.cr.fetchone()
+                if not row:  # leased concurrently
+                    skipped += PORT_STEP
+                    continue
+            port = row[0]
+            if all(is_port_free(port + offset) for offset in range(2)):
+                break
+            if attempt == PORT_LEASE_ATTEMPTS - 1:
+                _logger.warning('No free port found on host %s, using port %s', self.name, port)
+                break
+            _logger.warning('Port %s of host %s is still in use, skipping it', port, self.name)
+            self.env.cr.execute("UPDATE runbot_host_port SET build_id = NULL WHERE host_id = %s AND port = %s", (self.id, port))
+            busy_ports.append(port)
+        if port is None:
+            raise RunbotException(f'Cannot lease a port on host {self.name}')
+        Port.invalidate_model(['build_id'])
+        return port
+
+    def _release_ports(self):
+        """ Releases the port leases of the builds not holding a container anymore """
+        leases = self.env['runbot.host.port'].search([('host_id', 'in', self.ids), ('build_id', '!=', False)])
+        leases.filtered(lambda lease: lease.build_id.local_state in ('pending', 'done') or lease.build_id.host not in self.mapped('name')).build_id = False
+
+
+class HostPort(models.Model):
+    """ Lease of a port of a host by a build, from the start of the build
+    until it is done.
+    """
+    _name = 'runbot.host.port'
+    _description = "Host port lease"
+    _order = 'port'
+    _log_access = False
+
+    _sql_constraints = [
+        ('host_port_unique', 'unique (host_id, port)', 'A port can only be leased once per host'),
+    ]
+
+    host_id = fields.Many2one('runbot.host', 'Host', required=True, ondelete='cascade')
+    port = fields.Integer('Port', required=True)
+    build_id = fields.Many2one('runbot.build', 'Build', index=True, ondelete='set null')
+
+    def init(self):
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS runbot_host_port_free_index
+            ON runbot_host_port (host_id, port)
+            WHERE build_id IS NULL
+        """)
+
 
 class MessageQueue(models.Model):
     _name = 'runbot.host.message'
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import re
 
 from collections import defaultdict
+from datetime import timedelta
 
 from ..common import pseudo_markdown
 from odoo import models, fields, tools, api
@@ -12,6 +14,11 @@ _logger = logging.getLogger(__name__)
 
 TYPES = [(t, t.capitalize()) for t in 'client server runbot subbuild link markdown'.split()]
 
+# number of ids covered by each ir_logging partition
+PARTITION_SIZE = 10_000_000
+# number of partitions created ahead of the current ir_logging id
+PARTITIONS_AHEAD = 2
+
 
 class IrLogging(models.Model):
 
@@ -60,6 +67,165 @@ class IrLogging(models.Model):
             for ir_logging in fingerprints[build_error.fingerprint]:
                 ir_logging.error_id = build_error.id
 
+    def init(self):
+        super().init()
+        self._partition_table()
+
+    def _partition_table(self):
+        """ Converts ir_logging to a table range-partitioned by id.
+
+        The existing table is kept as is and attached as the first partition
+        (covering all the existing logs), so the conversion does not copy
+        anything, only the validation of its bound scans it.
+        """
+        cr = self.env.cr
+        cr.execute("SELECT relkind FROM pg_class WHERE oid = 'ir_logging'::regclass")
+        if cr.fetchone()[0] == 'p':
+            self._create_default_partition()
+            return
+
+        cr.execute("SELECT greatest(max(id), (SELECT last_value FROM ir_logging_id_seq)) FROM ir_logging")
+        [last_id] = cr.fetchone()
+        bound = (last_id // PARTITION_SIZE + 1) * PARTITION_SIZE
+        _logger.info("Partitioning ir_logging, existing logs are kept in ir_logging_legacy (ids below %d)", bound)
+
+        cr.execute("ALTER TABLE ir_logging RENAME TO ir_logging_legacy")
+        cr.execute("ALTER TABLE ir_logging_legacy RENAME CONSTRAINT ir_logging_pkey TO ir_logging_legacy_pkey")
+        # index names are global, move the existing ones out of the way
+        cr.execute("""
+            SELECT indexname, indexdef FROM pg_indexes
+            WHERE schemaname = current_schema()
+              AND tablename = 'ir_logging_legacy'
+              AND indexname != 'ir_logging_legacy_pkey'
+        """)
+        indexes = cr.fetchall()
+        for name, _ in indexes:
+            cr.execute(f'ALTER INDEX "{name}" RENAME TO "{name}_legacy"')
+        cr.execute("""
+            SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+            WHERE conrelid = 'ir_logging_legacy'::regclass AND contype = 'f'
+        """)
+        foreign_keys = cr.fetchall()
+
+        cr.execute("""
+            CREATE TABLE ir_logging (LIKE ir_logging_legacy INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE)
+            PARTITION BY RANGE (id)
+        """)
+        cr.execute("ALTER TABLE ir_logging ADD CONSTRAINT ir_logging_pkey PRIMARY KEY (id)")
+        cr.execute("ALTER SEQUENCE ir_logging_id_seq OWNED BY ir_logging.id")
+        # with a validated bound constraint, attaching the partition does not
+        # need to scan it under an exclusive lock
+        cr.execute("""
+            ALTER TABLE ir_logging_legacy
+            ADD CONSTRAINT ir_logging_legacy_bound CHECK (id IS NOT NULL AND id < %s) NOT VALID
+        """, [bound])
+        cr.execute("ALTER TABLE ir_logging_legacy VALIDATE CONSTRAINT ir_logging_legacy_bound")
+        cr.execute("ALTER TABLE ir_logging ATTACH PARTITION ir_logging_legacy FOR VALUES FROM (MINVALUE) TO (%s)", [bound])
+
+        # recreate the indexes and foreign keys on the partitioned table, the
+        # existing ones of the legacy partition get attached to them
+        for _, definition in indexes:
+            cr.execute(re.sub(r' ON (\w+\.)?ir_logging_legacy ', ' ON ir_logging ', definition, count=1))
+        for name, definition in foreign_keys:
+            cr.execute(f'ALTER TABLE ir_logging ADD CONSTRAINT "{name}" {definition}')
+
+        self._create_default_partition()
+        self._create_partitions()
+
+    def _create_default_partition(self):
+        """ Creates the partition receiving the logs with ids beyond the
+        existing partitions, so logging never fails if the next partitions
+        were not created in time (they are moved out of it when they are).
+        """
+        self.env.cr.execute("CREATE TABLE IF NOT EXISTS ir_logging_default PARTITION OF ir_logging DEFAULT")
+
+    def _last_id(self):
+        self.env.cr.execute("SELECT last_value FROM ir_logging_id_seq")
+        return self.env.cr.fetchone()[0]
+
+    def _partitions(self):
+        """ Lists the partitions of ir_logging, in order.
+
+        :returns: list of ``(name, lower, upper)``, ``lower`` is ``None`` for
+                  the first partition
+        """
+        self.env.cr.execute("""
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'ir_logging'::regclass
+        """)
+        partitions = []
+        for name, bound in self.env.cr.fetchall():
+            if bound == 'DEFAULT':
+                continue
+            lower, upper = re.fullmatch(r"FOR VALUES FROM \((.+)\) TO \((.+)\)", bound).groups()
+            partitions.append((
+                name,
+                None if lower == 'MINVALUE' else int(lower.strip("'")),
+                int(upper.strip("'")),
+            ))
+        partitions.sort(key=lambda p: p[2])
+        return partitions
+
+    def _create_partitions(self):
+        """ Creates the partitions for the current and next ids, the logs
+        which landed in the default partition meanwhile are moved to them.
+        """
+        cr = self.env.cr
+        partitions = self._partitions()
+        if not partitions:
+            return
+        last_id = self._last_id()
+        lower = partitions[-1][2]
+        while lower < (last_id // PARTITION_SIZE + PARTITIONS_AHEAD + 1) * PARTITION_SIZE:
+            upper = lower + PARTITION_SIZE
+            name = f'ir_logging_{lower // PARTITION_SIZE}'
+            _logger.info("Creating ir_logging partition for ids %d to %d", lower, upper)
+            # a partition overlapping rows of the default partition can't be
+            # created directly, it's filled then attached
+            cr.execute(f'CREATE TABLE "{name}" (LIKE ir_logging INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE)')
+            cr.execute(f"""
+                WITH moved AS (
+                    DELETE FROM ir_logging_default
+                    WHERE id >= %s AND id < %s
+                    RETURNING *
+                )
+                INSERT INTO "{name}" SELECT * FROM moved
+            """, [lower, upper])
+            if cr.rowcount:
+                _logger.warning("Moved %d logs from the default ir_logging partition to %s", cr.rowcount, name)
+            cr.execute(f'ALTER TABLE ir_logging ATTACH PARTITION "{name}" FOR VALUES FROM (%s) TO (%s)', [lower, upper])
+            lower = upper
+
+    def _gc_partitions(self):
+        """ Drops the partitions only containing logs older than the logs
+        retention (the build directories removal delay by default), and creates
+        the next ones.
+        """
+        icp = self.env['ir.config_parameter']
+        days = int(icp.get_param('runbot.logs_gc_days') or icp.get_param('runbot.full_gc_days', default=365))
+        limit = fields.Datetime.now() - timedelta(days=days)
+
+        last_id = self._last_id()
+        for name, lower, upper in self._partitions():
+            # never drop the partition currently being filled
+            if upper > last_id:
+                break
+            # ids are sequential, so is the newest log of the partition
+            self.env.cr.execute("""
+                SELECT create_date FROM ir_logging
+                WHERE id >= %s AND id < %s
+                ORDER BY id DESC LIMIT 1
+            """, [lower or 0, upper])
+            [newest] = self.env.cr.fetchone() or [None]
+            if newest and newest >= limit:
+                break
+            _logger.info("Dropping ir_logging partition %s (logs before %s)", name, newest)
+            self.env.cr.execute(f'DROP TABLE "{name}"')
+
+        self._create_partitions()
+
     def _prepare_create_values(self, vals_list):
         # keep the given create date
         result_vals_list = super()._prepare_create_values(vals_list)
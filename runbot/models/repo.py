@@ -9,9 +9,11 @@ import time
 import requests
 import markupsafe
 
+from collections import defaultdict
+from contextlib import contextmanager
 from pathlib import Path
 
-from odoo import models, fields, api
+from odoo import models, fields, api, tools
 from odoo.tools import file_open, mail
 from ..common import os, RunbotException, make_github_session, sanitize
 from odoo.exceptions import UserError
@@ -65,6 +67,8 @@ class Trigger(models.Model):
 
     team_ids = fields.Many2many('runbot.team', string="Runbot Teams", help="Teams responsible of this trigger, mainly usefull for nightly")
     active = fields.Boolean("Active", default=True)
+    test_impacted_modules = fields.Boolean('Test impacted modules only', help="Only install and test the modules impacted by the modified files of the bundle, and the modules depending on them", tracking=True)
+    impacted_modules_core = fields.Char('Core modules', default='base', help="Comma separated list of modules whose modification requires testing all the modules", tracking=True)
 
     @api.depends('config_id.step_order_ids.step_id.make_stats')
     def _compute_has_stats(self):
@@ -100,6 +104,37 @@ class Trigger(models.Model):
             return safe_eval(self.version_domain)
         return []
 
+    @tools.ormcache('project_id', 'category_id', 'version_id')
+    def _get_applicable_ids(self, project_id, category_id, version_id):
+        """ Returns the ids of the active triggers of a project and category
+        whose version domain matches the given version. Cached since all the
+        batches of a version resolve the same triggers, invalidated when a
+        trigger or a version is modified.
+        """
+        triggers = self.with_context(active_test=True).search([
+            ('project_id', '=', project_id),
+            ('category_id', '=', category_id),
+        ])
+        version = self.env['runbot.version'].browse(version_id)
+        return tuple(
+            trigger.id for trigger in triggers
+            if not trigger.version_domain or version.filtered_domain(trigger._get_version_domain())
+        )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.env.registry.clear_cache()
+        return super().create(vals_list)
+
+    def write(self, values):
+        if {'project_id', 'category_id', 'version_domain', 'active', 'sequence'} & values.keys():
+            self.env.registry.clear_cache()
+        return super().write(values)
+
+    def unlink(self):
+        self.env.registry.clear_cache()
+        return super().unlink()
+
     def _filter_modules_to_test(self, modules, module_patterns=None):
         repo_module_patterns = {}
         for module_filter in self.module_filters:
@@ -140,6 +175,98 @@ class Trigger(models.Model):
 
         return sorted(modules_to_install)
 
+    def _get_impacted_modules(self, modified_files, manifests):
+        """ Returns the modules impacted by ``modified_files`` (``{repo: [file_path]}``)
+        given the ``{module: manifest}`` of the build, and the reason of the
+        decision. The modules are None if all the modules must be tested.
+        """
+        core_modules = set((self.impacted_modules_core or '').split(',')) - {''}
+        modified_modules = set()
+        for repo, file_paths in modified_files.items():
+            addons_paths = sorted(((repo.addons_paths or '').split(',')), key=len, reverse=True)
+            for file_path in file_paths:
+                module = None
+                for addons_path in addons_paths:
+                    prefix = f'{addons_path}/' if addons_path else ''
+                    if file_path.startswith(prefix) and '/' in file_path[len(prefix):]:
+                        module = file_path[len(prefix):].split('/', 1)[0]
+                        if module in manifests:
+                            break
+                        module = None
+                if module is None:
+                    return None, f'{file_path} is not part of a module'
+                if module in core_modules:
+                    return None, f'core module {module} is modified'
+                modified_modules.add(module)
+
+        # the modules depending on a modified module are impacted
+        dependents = defaultdict(set)
+        for module, manifest in manifests.items():
+            for depend in manifest['depends']:
+                dependents[depend].add(module)
+        impacted = set()
+        to_visit = list(modified_modules)
+        while to_visit:
+            module = to_visit.pop()
+            if module not in impacted:
+                impacted.add(module)
+                to_visit += dependents[module]
+
+        # installing the impacted modules also installs the auto_install
+        # modules depending only on installed modules (bridges)
+        installed = set()
+        to_visit = list(impacted)
+        while to_visit:
+            module = to_visit.pop()
+            if module not in installed and module in manifests:
+                installed.add(module)
+                to_visit += manifests[module]['depends']
+        bridges = True
+        while bridges:
+            bridges = {
+                module for module, manifest in manifests.items()
+                if manifest['auto_install'] and module not in installed and manifest['depends']
+                and all(depend in installed for depend in manifest['depends'])
+            }
+            impacted |= bridges
+            installed |= bridges
+        return impacted, f'{len(modified_modules)} modified modules: {", ".join(sorted(modified_modules))}'
+
+    def action_impacted_modules_report(self):
+        """ Computes the impacted modules of the last finished builds of the
+        trigger to estimate the build time saved and the failures missed by
+        :attr:`test_impacted_modules`.
+        """
+        self.ensure_one()
+        builds = self.env['runbot.build'].search([
+            ('params_id.trigger_id', '=', self.id),
+            ('parent_id', '=', False),
+            ('global_state', '=', 'done'),
+        ], order='id desc', limit=100)
+        analysed = full = 0
+        build_time = saved_time = 0
+        missed = self.env['runbot.build']
+        for build in builds:
+            try:
+                impacted, _reason = build.params_id._get_impacted_modules()
+            except (subprocess.CalledProcessError, OSError):
+                continue
+            analysed += 1
+            all_builds = build | build.children_ids
+            builds_time = sum(all_builds.mapped('build_time'))
+            build_time += builds_time
+            if impacted is None:
+                full += 1
+                continue
+            tested = set(build._get_modules_to_test()) or impacted
+            saved_time += builds_time * (1 - len(impacted & tested) / len(tested))
+            failed_modules = {error.module_name.split('.')[0] for error in all_builds.build_error_ids if error.module_name}
+            if (failed_modules & tested) - impacted:
+                missed |= build
+        output = markupsafe.Markup('<h4>Impacted modules on %s builds</h4><ul><li>%s builds testing all modules</li><li>Estimated build time saved: %ss on %ss</li><li>%s builds with missed failures: %s</li></ul>') % (
+            analysed, full, int(saved_time), build_time, len(missed), ', '.join(str(build.id) for build in missed))
+        self.message_post(body=output)
+
     def action_test_modules_filters(self):
         output = markupsafe.Markup()
         sticky_bundles = self.env['runbot.bundle'].search([('project_id', '=', self.project_id.id), ('sticky', '=', True)])
@@ -414,6 +541,60 @@ class Repo(models.Model):
             self.env['runbot.repo.hooktime'].create({'time': value, 'repo_id': repo.id})
         self.invalidate_recordset(['hook_time'])
 
+    def _enqueue_hook(self, remote=None, ref=None):
+        """ Records a hook received for the repository, processed by the next
+        fetch loop turn. Only inserts in the hooks queue (which coalesces
+        identical hooks) so concurrent hooks don't contend on the repository.
+        An identical hook being processed by a fetch waits for it, and is
+        kept for the next turn (see :meth:`_clear_hooks`).
+
+        :param remote: the remote the hook was received for
+        :param ref: the name of the updated branch or PR, if any
+        """
+        for repo in self:
+            self.env.cr.execute("""
+                INSERT INTO runbot_repo_hook (repo_id, remote_id, ref, time)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (repo_id, coalesce(remote_id, 0), coalesce(ref, ''))
+                DO UPDATE SET time = EXCLUDED.time
+            """, [repo.id, remote.id if remote else None, ref, time.time()])
+
+    def _get_hooks(self):
+        """ Returns the hooks received by the repository, they are kept (and
+        locked, so identical hooks received meanwhile wait for the end of the
+        transaction to update their time) until :meth:`_clear_hooks` is
+        called once the repository is fetched.
+
+        :returns: ``runbot.repo.hook`` records, with their time as read
+        """
+        self.ensure_one()
+        self.env.cr.execute("""
+            SELECT id FROM runbot_repo_hook
+            WHERE repo_id = %s
+            ORDER BY id
+            FOR UPDATE
+        """, [self.id])
+        hooks = self.env['runbot.repo.hook'].browse(id_ for id_, in self.env.cr.fetchall())
+        hooks.mapped('time')  # read before any hook is updated
+        return hooks
+
+    def _clear_hooks(self, hooks):
+        """ Removes the hooks processed by a successful fetch of the
+        repository. Hooks received later, including the ones updated since
+        :meth:`_get_hooks` read them, are kept for the next turn.
+        """
+        self.ensure_one()
+        if not hooks:
+            return
+        last = max(hooks.mapped('time'))
+        self.env.cr.execute("""
+            DELETE FROM runbot_repo_hook
+            WHERE id = any(%s) AND time <= %s
+        """, [hooks.ids, last])
+        hooks.invalidate_recordset()
+        self._set_hook_time(last)
+        self.last_processed_hook_time = last
+
     def _set_ref_time(self, value):
         for repo in self:
             self.env['runbot.repo.reftime'].create({'time': value, 'repo_id': repo.id})
@@ -457,6 +638,86 @@ class Repo(models.Model):
         _logger.info("git command: %s", ' '.join(cmd))
         return subprocess.check_output(cmd, stderr=subprocess.STDOUT).decode(errors=errors)
 
+    @contextmanager
+    def _cat_file(self):
+        """ Yields a function returning the ``(sha, type, content)`` of a git
+        object from its revision (or None if it does not exist), all the
+        objects are read through a single ``git cat-file --batch`` process.
+        """
+        self.ensure_one()
+        cmd = self._get_git_command(['cat-file', '--batch'])
+        _logger.info("git command: %s", ' '.join(cmd))
+        with subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE) as cat_file:
+
+            def read_object(rev):
+                cat_file.stdin.write(f'{rev}\n'.encode())
+                cat_file.stdin.flush()
+                header = cat_file.stdout.readline().split()
+                if not header:
+                    raise OSError(f'git cat-file exited while reading {rev} in {self.name}')
+                if len(header) != 3:  # missing or ambiguous
+                    return None
+                content = cat_file.stdout.read(int(header[2]) + 1)[:-1]
+                return header[0].decode(), header[1].decode(), content
+
+            yield read_object
+
+    def _compare_commits(self, pairs):
+        """ Compares the ``(sha, base_sha)`` pairs, returns a dict
+        ``{(sha, base_sha): (merge_base_sha, ahead, behind, file_changed, diff_add, diff_remove)}``.
+
+        The merge base and ahead/behind counts are computed by git for each
+        pair, and all the diffs are computed by a single ``git diff-tree``,
+        whatever the number of pairs. Pairs which cannot be compared (missing
+        commit, no common ancestor) are omitted.
+        """
+        self.ensure_one()
+        comparisons = {}
+        for sha, base_sha in pairs:
+            merge_base_sha, ahead, behind = self._git_merge_base_ahead_behind(sha, base_sha)
+            if merge_base_sha:
+                comparisons[sha, base_sha] = (merge_base_sha, ahead, behind, 0, 0, 0)
+
+        # a line "<commit> <parent>" diffs parent..commit, --always outputs the
+        # commit header line even for empty diffs so the output matches the input
+        to_diff = [(pair, comparison[0]) for pair, comparison in comparisons.items() if comparison[0] != pair[0]]
+        if to_diff:
+            cmd = self._get_git_command(['diff-tree', '--stdin', '--always', '--numstat', '-r', '-M'])
+            _logger.info("git command: %s", ' '.join(cmd))
+            output = subprocess.run(
+                cmd,
+                input=''.join(f'{sha} {merge_base_sha}\n' for (sha, _), merge_base_sha in to_diff).encode(),
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=True,
+            ).stdout.decode(errors='replace')
+            diffs = []
+            for line in output.splitlines():
+                if '\t' not in line:
+                    diffs.append([0, 0, 0])
+                    continue
+                add, remove, _ = line.split('\t', 2)
+                diffs[-1][0] += 1
+                try:
+                    diffs[-1][1] += int(add)
+                    diffs[-1][2] += int(remove)
+                except ValueError:  # binary files
+                    pass
+            for (pair, _), diff in zip(to_diff, diffs):
+                comparisons[pair] = comparisons[pair][:3] + tuple(diff)
+        return comparisons
+
+    def _git_merge_base_ahead_behind(self, sha, base_sha):
+        """ Returns the merge base of ``sha`` and ``base_sha`` and the number
+        of commits only reachable from ``sha`` and from ``base_sha``, the merge
+        base is ``None`` if the commits cannot be compared.
+        """
+        try:
+            merge_base_sha = self._git(['merge-base', sha, base_sha]).strip()
+        except subprocess.CalledProcessError as e:
+            _logger.warning('Cannot compare %s with %s in %s: %s', sha, base_sha, self.name, e.output.decode(errors='replace').strip())
+            return None, 0, 0
+        ahead, behind = map(int, self._git(['rev-list', '--left-right', '--count', f'{sha}...{base_sha}']).split())
+        return merge_base_sha, ahead, behind
+
     def _fetch(self, sha):
         if not self._hash_exists(sha):
             self._update(force=True)
@@ -493,8 +754,10 @@ class Repo(models.Model):
             return os.path.getmtime(fname_fetch_head)
         return 0
 
-    def _get_refs(self, max_age=30, ignore=None):
+    def _get_refs(self, max_age=30, ignore=None, hooks=None):
         """Find new refs
+        :param hooks: if provided, the ``(remote, ref)`` the repository was
+                      hooked for, only their refs are listed
         :return: list of tuples with following refs informations:
         name, sha, date, author, author_email, subject, committer, committer_email
         """
@@ -506,9 +769,17 @@ class Repo(models.Model):
                 self._set_ref_time(get_ref_time)
                 fields = ['refname', 'objectname', 'committerdate:unix', 'authorname', 'authoremail', 'subject', 'committername', 'committeremail']
                 fmt = "%00".join(["%(" + field + ")" for field in fields])
-                cmd = ['for-each-ref', '--format', fmt, '--sort=-committerdate', 'refs/*/heads/*']
-                if any(remote.fetch_pull for remote in self.remote_ids):
-                    cmd.append('refs/*/pull/*')
+                cmd = ['for-each-ref', '--format', fmt, '--sort=-committerdate']
+                if hooks:
+                    for remote, ref in hooks:
+                        remote_name = remote.remote_name if remote else '*'
+                        cmd.append(f'refs/{remote_name}/heads/{ref}')
+                        if ref.isdigit() and (remote.fetch_pull if remote else any(self.remote_ids.mapped('fetch_pull'))):
+                            cmd.append(f'refs/{remote_name}/pull/{ref}')
+                else:
+                    cmd.append('refs/*/heads/*')
+                    if any(remote.fetch_pull for remote in self.remote_ids):
+                        cmd.append('refs/*/pull/*')
                 git_refs = self._git(cmd)
                 git_refs = git_refs.strip()
                 if not git_refs:
@@ -565,6 +836,7 @@ class Repo(models.Model):
         """
         self.ensure_one()
 
+        new_commits = self.env['runbot.commit']
         for ref_name, sha, date, author, author_email, subject, committer, committer_email in refs:
             branch = ref_branches[ref_name]
             if branch.head_name != sha:  # new push on branch
@@ -579,6 +851,7 @@ class Repo(models.Model):
                         'date': datetime.datetime.fromtimestamp(int(date)),
                     })
                 branch.head = commit
+                new_commits |= commit
                 if not branch.alive:
                     if branch.is_pr:
                         _logger.info('Recomputing infos of dead pr %s', branch.name)
@@ -606,13 +879,26 @@ class Repo(models.Model):
                 if bundle.last_batch.state == 'preparing':
                     bundle.last_batch._new_commit(branch)
 
+        new_commits._index_modules()
+
     def _update_batches(self, force=False, ignore=None):
         """ Find new commits in physical repos"""
         updated = False
         for repo in self:
-            if repo.remote_ids and self._update(poll_delay=30 if force else 60*5):
+            if not repo.remote_ids:
+                continue
+            # hooked repos are fetched regardless of their mode or delay, and
+            # only the hooked refs need to be looked at
+            # hooks are only cleared once the fetch succeeded, so the hooked
+            # refs of a failed fetch are looked at by the next turn
+            hooks = repo._get_hooks()
+            if repo._update(force=bool(hooks), poll_delay=30 if force else 60*5):
                 max_age = int(self.env['ir.config_parameter'].get_param('runbot.runbot_max_age', default=30))
-                ref = repo._get_refs(max_age, ignore=ignore)
+                hooked_refs = None
+                if hooks and all(hooks.mapped('ref')) and repo.mode == 'hook':
+                    hooked_refs = [(hook.remote_id, hook.ref) for hook in hooks]
+                repo._clear_hooks(hooks)
+                ref = repo._get_refs(max_age, ignore=ignore, hooks=hooked_refs)
                 ref_branches = repo._find_or_create_branches(ref)
                 repo._find_new_commits(ref, ref_branches)
                 updated = True
@@ -661,9 +947,8 @@ class Repo(models.Model):
         if not force and os.path.isfile(fname_fetch_head):
             fetch_time = os.path.getmtime(fname_fetch_head)
             if repo.mode == 'hook':
-                if not repo.hook_time or (repo.last_processed_hook_time and repo.hook_time <= repo.last_processed_hook_time):
-                    return False
-                repo.last_processed_hook_time = repo.hook_time
+                # hooked repositories are updated with force
+                return False
             if repo.mode == 'poll':
                 if (time.time() < fetch_time + poll_delay):
                     return False
@@ -720,6 +1005,23 @@ class RefTime(models.Model):
     repo_id = fields.Many2one('runbot.repo', 'Repository', required=True, ondelete='cascade')
 
 
+class Hook(models.Model):
+    _name = 'runbot.repo.hook'
+    _description = "Repo hook queue"
+    _log_access = False
+
+    repo_id = fields.Many2one('runbot.repo', 'Repository', required=True, ondelete='cascade')
+    remote_id = fields.Many2one('runbot.remote', 'Remote', ondelete='cascade')
+    ref = fields.Char('Branch or PR')
+    time = fields.Float('Time')
+
+    def init(self):
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS runbot_repo_hook_unique
+            ON runbot_repo_hook (repo_id, coalesce(remote_id, 0), coalesce(ref, ''))
+        """)
+
+
 class HookTime(models.Model):
     _name = 'runbot.repo.hooktime'
     _description = "Repo hooktime"
@@ -12,9 +12,11 @@ class ResConfigSettings(models.TransientModel):
     runbot_workers = fields.Integer('Default number of workers')
     runbot_containers_memory = fields.Float('Containers Mem limit (in GiB)')
     runbot_memory_bytes = fields.Float('Bytes', compute='_compute_memory_bytes')
+    runbot_python_workers_memory = fields.Float('Python workers Mem limit (in GiB)', config_parameter='runbot.python_workers_memory', help='Address space limit of the processes running the python steps in a worker, 0 to disable')
     runbot_running_max = fields.Integer('Max running builds')
     runbot_timeout = fields.Integer('Max step timeout (in seconds)')
     runbot_starting_port = fields.Integer('Starting port for running builds')
+    runbot_nginx_reload_delay = fields.Integer('Nginx reload delay (in seconds)', default=5, config_parameter='runbot.nginx_reload_delay', help='Minimal delay between two reloads of nginx')
     runbot_max_age = fields.Integer('Max commit age (in days)')
     runbot_logdb_name = fields.Char('Local Logs DB name', default='runbot_logs', config_parameter='runbot.logdb_name')
     runbot_update_frequency = fields.Integer('Update frequency (in seconds)')
@@ -45,6 +47,20 @@ class ResConfigSettings(models.TransientModel):
         default=365,
         config_parameter='runbot.full_gc_days',
         help='Number of days to wait after to first gc to completely remove build directory (remaining test/log files)')
+    runbot_logs_gc_days = fields.Integer(
+        'Days before logs removal',
+        config_parameter='runbot.logs_gc_days',
+        help='Number of days to keep the builds logs, defaults to the days before directory removal')
+
+    runbot_error_similarity = fields.Float(
+        'Error similarity threshold',
+        config_parameter='runbot.error_similarity',
+        help='Minimal estimated similarity (between 0 and 1) for a new error message to be attached to an existing error, 0 to disable')
+
+    runbot_result_reuse_days = fields.Integer(
+        'Days to reuse build results',
+        config_parameter='runbot.result_reuse_days',
+        help='Maximal age of a successful build to reuse for equivalent build params (only differing by values without impact on the result), 0 to disable')
 
     runbot_pending_warning = fields.Integer('Pending warning limit', default=5, config_parameter='runbot.pending.warning')
     runbot_pending_critical = fields.Integer('Pending critical limit', default=5, config_parameter='runbot.pending.critical')
@@ -1,4 +1,5 @@
 import time
+import hashlib
 import logging
 import glob
 import random
@@ -73,6 +74,8 @@ class Runbot(models.AbstractModel):
         self._commit()
         self._gc_running(host)
         self._commit()
+        host._release_ports()
+        self._commit()
         self._reload_nginx()
         self._commit()
         return processed
@@ -157,7 +160,16 @@ class Runbot(models.AbstractModel):
         return self.env.cr.fetchall()
 
     def _reload_nginx(self):
+        """ Updates the nginx configuration of the running builds of the host:
+        the main config includes one file per running build, only the files
+        of the builds started or stopped since the last call are written or
+        removed. The name of a build file contains a key of the values it is
+        rendered from (template views, settings, build access token), so that
+        their changes rewrite it. nginx is reloaded at most once every
+        ``runbot.nginx_reload_delay`` seconds.
+        """
         env = self.env
+        start = time.time()
         settings = {}
         settings['port'] = config.get('http_port')
         settings['runbot_static'] = self.env['runbot.runbot']._root() + os.sep
@@ -168,32 +180,80 @@ class Runbot(models.AbstractModel):
         host_name = self.env['runbot.host']._get_current_name()
         settings['host_name'] = self.env['runbot.host']._get_current_name()
 
-        settings['builds'] = env['runbot.build'].search([('local_state', '=', 'running'), ('host', '=', host_name)])
+        builds_dir = os.path.join(nginx_dir, 'builds')
+        os.makedirs(builds_dir, exist_ok=True)
+        changed = False
 
-        nginx_config = env['ir.ui.view']._render_template("runbot.nginx_config", settings)
-        os.makedirs(nginx_dir, exist_ok=True)
-        content = None
+        nginx_config = str(env['ir.ui.view']._render_template("runbot.nginx_config", settings))
         nginx_conf_path = self.env['runbot.runbot']._path('nginx', 'nginx.conf')
         content = ''
         if os.path.isfile(nginx_conf_path):
             with file_open(nginx_conf_path, 'r') as f:
                 content = f.read()
         if content != nginx_config:
-            _logger.info('reload nginx')
             with open(nginx_conf_path, 'w') as f:
-                f.write(str(nginx_config))
-            try:
-                pid = int(file_open(self.env['runbot.runbot']._path('nginx', 'nginx.pid')).read().strip(' \n'))
-                os.kill(pid, signal.SIGHUP)
-            except Exception:
-                _logger.info('start nginx')
-                if subprocess.call(['/usr/sbin/nginx', '-p', nginx_dir, '-c', 'nginx.conf']):
-                    # obscure nginx bug leaving orphan worker listening on nginx port
-                    if not subprocess.call(['pkill', '-f', '-P1', 'nginx: worker']):
-                        _logger.warning('failed to start nginx - orphan worker killed, retrying')
-                        subprocess.call(['/usr/sbin/nginx', '-p', nginx_dir, '-c', 'nginx.conf'])
-                    else:
-                        _logger.warning('failed to start nginx - failed to kill orphan worker - oh well')
+                f.write(nginx_config)
+            changed = True
+
+        # the port is part of the file name since a woken up build may get a new one
+        builds = env['runbot.build'].search([('local_state', '=', 'running'), ('host', '=', host_name)])
+        template_key = self._nginx_template_key(settings)
+        build_files = {}
+        for build in builds:
+            build_key = hashlib.sha1(f'{template_key}:{build._get_run_token()[0]}'.encode()).hexdigest()[:8]
+            build_files[f'{build.dest}_{build.port}_{build_key}.conf'] = build
+        existing_files = {file_name for file_name in os.listdir(builds_dir) if file_name.endswith('.conf')}
+        for file_name in existing_files - set(build_files):
+            os.remove(os.path.join(builds_dir, file_name))
+            changed = True
+        for file_name in set(build_files) - existing_files:
+            build_config = env['ir.ui.view']._render_template("runbot.nginx_config", {**settings, 'build': build_files[file_name]})
+            with open(os.path.join(builds_dir, file_name), 'w') as f:
+                f.write(str(build_config))
+            changed = True
+
+        reload_path = os.path.join(nginx_dir, 'reload_needed')
+        if changed:
+            _logger.info('nginx config of %s running builds updated in %.3fs', len(builds), time.time() - start)
+            with open(reload_path, 'w'):
+                pass
+        if not os.path.exists(reload_path):
+            return
+        reload_delay = int(self.env['ir.config_parameter'].sudo().get_param('runbot.nginx_reload_delay', default=5))
+        pid_path = self.env['runbot.runbot']._path('nginx', 'nginx.pid')
+        # the pid file is touched on reload, nginx is reloaded at most once per delay
+        # and the pending changes are kept for the next call
+        if os.path.exists(pid_path) and time.time() - os.path.getmtime(pid_path) < reload_delay:
+            return
+        os.remove(reload_path)
+        _logger.info('reload nginx')
+        try:
+            pid = int(file_open(pid_path).read().strip(' \n'))
+            os.kill(pid, signal.SIGHUP)
+        except Exception:
+            _logger.info('start nginx')
+            if subprocess.call(['/usr/sbin/nginx', '-p', nginx_dir, '-c', 'nginx.conf']):
+                # obscure nginx bug leaving orphan worker listening on nginx port
+                if not subprocess.call(['pkill', '-f', '-P1', 'nginx: worker']):
+                    _logger.warning('failed to start nginx - orphan worker killed, retrying')
+                    subprocess.call(['/usr/sbin/nginx', '-p', nginx_dir, '-c', 'nginx.conf'])
+                else:
+                    _logger.warning('failed to start nginx - failed to kill orphan worker - oh well')
+        else:
+            os.utime(pid_path)
+
+    def _nginx_template_key(self, settings):
+        """ Returns a key of the nginx config template, including the views
+        inheriting it, and of the settings it is rendered with.
+        """
+        views = self.env.ref('runbot.nginx_config')
+        children = views.inherit_children_ids
+        while children:
+            views |= children
+            children = children.inherit_children_ids
+        values = [view.arch_db for view in views.sorted('id')]
+        values += [f'{key}={value}' for key, value in sorted(settings.items()) if isinstance(value, (str, int))]
+        return hashlib.sha1('\n'.join(values).encode()).hexdigest()
 
     def _get_cron_period(self):
         """ Compute a randomized cron period with a 2 min margin below
@@ -35,6 +35,69 @@ class UpgradeRegex(models.Model):
     regex = fields.Char('Regex')
 
 
+class UpgradeReference(models.Model):
+    _name = 'runbot.upgrade.reference'
+    _description = 'Upgrade reference'
+
+    bundle_id = fields.Many2one('runbot.bundle', required=True, index=True, ondelete='cascade')
+    version_id = fields.Many2one('runbot.version', related='bundle_id.version_id', store=True)
+    category_id = fields.Many2one('runbot.category', required=True, ondelete='cascade')
+    batch_id = fields.Many2one('runbot.batch', 'Last done batch', required=True, ondelete='cascade')
+    dump_build_ids = fields.Many2many('runbot.build', string='Builds with databases')
+
+    _sql_constraints = [
+        (
+            "bundle_category_unique",
+            "unique (bundle_id, category_id)",
+            "Only one reference per bundle and category is allowed",
+        )
+    ]
+
+    def _refresh(self, batches):
+        """ Defines the done ``batches`` of bundles to upgrade as the
+        reference of their bundle and category, with the builds holding the
+        databases that can be used as upgrade source.
+        """
+        for batch in batches.filtered(lambda batch: batch.state == 'done' and batch.bundle_id.to_upgrade):
+            reference = self.search([('bundle_id', '=', batch.bundle_id.id), ('category_id', '=', batch.category_id.id)])
+            if reference.batch_id.id > batch.id:
+                continue
+            values = {
+                'batch_id': batch.id,
+                'dump_build_ids': [(6, 0, batch.all_build_ids.filtered(lambda build: build.database_ids and not build.orphan_result).ids)],
+            }
+            if reference:
+                reference.write(values)
+            else:
+                self.create({'bundle_id': batch.bundle_id.id, 'category_id': batch.category_id.id, **values})
+
+    def _get_batches(self, bundles, category_id):
+        """ Returns the reference batches of ``bundles`` for a category,
+        falling back on the last done batch of the bundles without reference.
+        """
+        references = self.search([('bundle_id', 'in', bundles.ids), ('category_id', '=', category_id)])
+        batch_per_bundle = {reference.bundle_id: reference.batch_id for reference in references}
+        batches = self.env['runbot.batch']
+        for bundle in bundles.with_context(category_id=category_id):
+            batches |= batch_per_bundle.get(bundle) or bundle.last_done_batch
+        return batches
+
+    def _get_dump_builds(self, builds):
+        """ Returns the builds with databases in the tree of each of the
+        given ``builds`` that are part of a reference batch. The builds
+        without any (e.g. rebuilt after their batch was done) are omitted,
+        their children have to be searched.
+        """
+        references = self.search([('batch_id.slot_ids.build_id', 'in', builds.ids)])
+        dump_builds = {}
+        for build in builds:
+            build_references = references.filtered(lambda reference: build in reference.batch_id.slot_ids.build_id)
+            build_dump_builds = build_references.dump_build_ids.filtered_domain([('id', 'child_of', build.id), ('orphan_result', '=', False)])
+            if build_dump_builds:
+                dump_builds[build] = build_dump_builds
+        return dump_builds
+
+
 class BuildResult(models.Model):
     _inherit = 'runbot.build'
 
@@ -42,6 +42,11 @@ class Version(models.Model):
         model.env.registry.clear_cache()
         return super().create(vals_list)
 
+    def write(self, values):
+        # trigger version domains may depend on any field
+        self.env.registry.clear_cache()
+        return super().write(values)
+
     def _get(self, name):
         return self.browse(self._get_id(name))
 
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""Run python steps in worker processes
+
+A python step running in a worker is executed in a forked process using its
+own database connections, so that a long step does not block the scheduling
+of the other builds of the host.
+
+Like the docker containers, the state of a worker is kept in a file of the
+build directory, `worker-<name>.json`, replaced by the result of the step once
+it is finished:
+    {"state": "running", "start": 1700000000.0}
+    {"state": "end", "result": "ok", "message": "", "duration": 12.3}
+"""
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import signal
+import time
+import traceback
+
+import odoo
+
+_logger = logging.getLogger(__name__)
+_workers = {}
+_inherited_connections = []
+
+
+def _state_path(name, build_dir):
+    return os.path.join(build_dir, 'worker-%s.json' % name)
+
+
+def _write_state(name, build_dir, values):
+    path = _state_path(name, build_dir)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(values, f)
+    os.replace(path + '.tmp', path)
+
+
+def _read_state(name, build_dir):
+    try:
+        with open(_state_path(name, build_dir)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _worker_main(name, build_dir, target, args, memory):
+    start = time.time()
+    if memory:
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+    pool = odoo.sql_db._Pool
+    if pool:
+        # the connections of the pool are shared with the parent process, they
+        # must neither be used nor closed (garbage collected) by the worker
+        _inherited_connections.extend(pool._connections)
+        pool._connections = []
+    result, message = 'ok', ''
+    try:
+        target(*args)
+    except Exception as e:
+        _logger.exception('Python worker %s failed', name)
+        result, message = 'ko', '%s\n%s' % (e, traceback.format_exc())
+    _write_state(name, build_dir, {'state': 'end', 'result': result, 'message': message, 'duration': time.time() - start})
+
+
+def python_worker_run(*args, **kwargs):
+    return _python_worker_run(*args, **kwargs)
+
+
+def _python_worker_run(name, build_dir, target, args=(), memory=None):
+    """Run target(*args) in a forked process
+    :param name: name of the worker, unique in the build directory
+    :param build_dir: the build directory where the state of the worker is kept
+    :param target: function to run in the worker
+    :param memory: address space limit in bytes for the worker
+    """
+    for worker_name, worker in list(_workers.items()):  # avoid zombies of workers whose state is never checked
+        if not worker.is_alive():
+            worker.join()
+            del _workers[worker_name]
+    _write_state(name, build_dir, {'state': 'running', 'start': time.time()})
+    process = multiprocessing.get_context('fork').Process(target=_worker_main, args=(name, build_dir, target, args, memory), name='worker-%s' % name)
+    process.start()
+    _workers[name] = process
+    _logger.info('Started python worker %s (%s)', name, process.pid)
+
+
+def python_worker_state(name, build_dir):
+    """Returns the state of a worker: VOID, RUNNING, END or GHOST if the worker
+    disappeared without result (killed or builder restarted)
+    """
+    state = _read_state(name, build_dir)
+    if not state:
+        return 'VOID'
+    process = _workers.get(name)
+    if state['state'] == 'end':
+        if process:
+            process.join()
+            del _workers[name]
+        return 'END'
+    if process:
+        if process.is_alive():
+            return 'RUNNING'
+        process.join()
+        del _workers[name]
+        # the result may have been written in between time
+        return 'END' if _read_state(name, build_dir)['state'] == 'end' else 'GHOST'
+    return 'GHOST'
+
+
+def python_worker_result(name, build_dir):
+    """Returns a tuple (result, message) for the worker"""
+    state = _read_state(name, build_dir) or {}
+    if state.get('state') != 'end':
+        return 'ko', 'Python worker ended without result'
+    return state['result'], state['message']
+
+
+def python_worker_stop(name, build_dir):
+    """Kills the worker if it is running"""
+    process = _workers.pop(name, None)
+    if process and process.is_alive():
+        _logger.info('Stopping python worker %s (%s)', name, process.pid)
+        os.kill(process.pid, signal.SIGKILL)
+        process.join()
+    if python_worker_state(name, build_dir) == 'GHOST':
+        _write_state(name, build_dir, {'state': 'end', 'result': 'ko', 'message': 'Python worker killed', 'duration': 0})
+
+
+def python_worker_clear_state(name, build_dir):
+    """Removes the result of a finished worker, the state of a worker started
+    since then is kept
+    """
+    state = _read_state(name, build_dir)
+    if state and state['state'] != 'end':
+        return
+    try:
+        os.remove(_state_path(name, build_dir))
+    except FileNotFoundError:
+        pass
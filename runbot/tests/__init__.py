@@ -15,3 +15,5 @@ from . import test_commit
 from . import test_upgrade
 from . import test_dockerfile
 from . import test_host
+from . import test_ir_logging
+from . import test_python_worker
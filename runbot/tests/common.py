@@ -180,6 +180,12 @@ class RunbotCase(TransactionCase):
         self.start_patcher('docker_build', 'odoo.addons.runbot.container._docker_build')
         self.start_patcher('docker_ps', 'odoo.addons.runbot.container._docker_ps', [])
         self.start_patcher('docker_stop', 'odoo.addons.runbot.container._docker_stop')
+        self.start_patcher('docker_image_exists', 'odoo.addons.runbot.container._docker_image_exists', False)
+        self.start_patcher('docker_tag', 'odoo.addons.runbot.container._docker_tag', True)
+        self.start_patcher('docker_remove_tags', 'odoo.addons.runbot.container._docker_remove_tags')
+        self.start_patcher('docker_save', 'odoo.addons.runbot.container._docker_save', (True, None))
+        self.start_patcher('docker_load', 'odoo.addons.runbot.container._docker_load', (True, None))
+        self.start_patcher('python_worker_run', 'odoo.addons.runbot.python_worker._python_worker_run')
         self.start_patcher('docker_get_gateway_ip', 'odoo.addons.runbot.models.build_config.docker_get_gateway_ip', None)
 
         self.start_patcher('repo_commit', 'odoo.addons.runbot.models.runbot.Runbot._commit', None)
@@ -189,6 +195,7 @@ class RunbotCase(TransactionCase):
         self.start_patcher('set_psql_conn_count', 'odoo.addons.runbot.models.host.Host._set_psql_conn_count', None)
         self.start_patcher('reload_nginx', 'odoo.addons.runbot.models.runbot.Runbot._reload_nginx', None)
         self.start_patcher('update_commits_infos', 'odoo.addons.runbot.models.batch.Batch._update_commits_infos', None)
+        self.start_patcher('commit_index_modules', 'odoo.addons.runbot.models.commit.Commit._index_modules', None)
         self.start_patcher('_local_pg_createdb', 'odoo.addons.runbot.models.build.BuildResult._local_pg_createdb', True)
         self.start_patcher('getmtime', 'odoo.addons.runbot.common.os.path.getmtime', datetime.datetime.now().timestamp())
         self.start_patcher('file_exist', 'odoo.tools.misc.os.path.exists', True)
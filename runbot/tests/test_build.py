@@ -74,6 +74,80 @@ class TestBuildParams(RunbotCaseMinimalSetup):
         })
         self.assertNotEqual(copied_params.id, params.id)
 
+    def test_result_fingerprint(self):
+        server_commit = self.Commit.create({
+            'name': 'dfdfcfcf0000ffffffffffffffffffffffffffff',
+            'repo_id': self.repo_server.id
+        })
+        other_dockerfile = self.env['runbot.dockerfile'].create({'name': 'Other dockerfile', 'to_build': False})
+        codeowner_config = self.Config.create({
+            'name': 'Codeowner',
+            'step_order_ids': [(0, 0, {'sequence': 10, 'step_id': self.Step.create({'name': 'codeowner', 'job_type': 'codeowner'}).id})],
+        })
+        params_values = {
+            'version_id': self.version_13.id,
+            'project_id': self.project.id,
+            'trigger_id': self.trigger_server.id,
+            'commit_link_ids': [(0, 0, {'commit_id': server_commit.id})],
+        }
+        for config, shared in ((codeowner_config, True), (self.default_config, False)):
+            params = self.BuildParameters.create({**params_values, 'config_id': config.id})
+            other_params = params.copy({'dockerfile_id': other_dockerfile.id})
+            self.assertNotEqual(params, other_params)
+            self.assertEqual(params.result_fingerprint == other_params.result_fingerprint, shared)
+
+        params = self.BuildParameters.create({**params_values, 'config_id': codeowner_config.id})
+        other_params = params.copy({'dockerfile_id': other_dockerfile.id})
+        build = self.Build.create({'params_id': params.id, 'local_state': 'done', 'local_result': 'ok'})
+        self.assertEqual(self.dev_batch._create_build(other_params)[0], 'created', 'result reuse is disabled by default')
+
+        self.env['ir.config_parameter'].sudo().set_param('runbot.result_reuse_days', 7)
+        other_params = params.copy({'dockerfile_id': other_dockerfile.id, 'extra_params': '--foo'})
+        self.assertEqual(self.dev_batch._create_build(other_params), ('reused', build))
+
+        self.env['runbot.build.error.link'].create({
+            'build_id': build.id,
+            'build_error_id': self.env['runbot.build.error'].create({'content': 'foo', 'random': True}).id,
+        })
+        other_params = params.copy({'dockerfile_id': other_dockerfile.id, 'extra_params': '--bar'})
+        self.assertEqual(self.dev_batch._create_build(other_params)[0], 'created', 'builds with random errors should not be reused')
+
+    def test_result_reuse_restrictions(self):
+        server_commit = self.Commit.create({
+            'name': 'dfdfcfcf0000ffffffffffffffffffffffffffff',
+            'repo_id': self.repo_server.id
+        })
+        codeowner_config = self.Config.create({
+            'name': 'Codeowner',
+            'step_order_ids': [(0, 0, {'sequence': 10, 'step_id': self.Step.create({'name': 'codeowner', 'job_type': 'codeowner'}).id})],
+        })
+        params = self.BuildParameters.create({
+            'version_id': self.version_13.id,
+            'project_id': self.project.id,
+            'trigger_id': self.trigger_server.id,
+            'commit_link_ids': [(0, 0, {'commit_id': server_commit.id})],
+            'config_id': codeowner_config.id,
+        })
+        build = self.Build.create({'params_id': params.id, 'local_state': 'done', 'local_result': 'ok'})
+        self.env['ir.config_parameter'].sudo().set_param('runbot.result_reuse_days', 7)
+        # the config was last changed before the build
+        self.env.cr.execute("UPDATE runbot_build SET create_date = create_date - interval '1 hour' WHERE id = %s", [build.id])
+        for records in (codeowner_config, codeowner_config.step_order_ids, codeowner_config.step_ids):
+            self.env.cr.execute(f"UPDATE {records._table} SET write_date = write_date - interval '2 hours' WHERE id = any(%s)", [records.ids])
+        self.env.invalidate_all()
+
+        other_params = params.copy({'extra_params': '--foo'})
+        self.assertEqual(self.dev_batch._create_build(other_params), ('reused', build))
+
+        build.keep_host = True
+        other_params = params.copy({'extra_params': '--bar'})
+        self.assertEqual(self.dev_batch._create_build(other_params)[0], 'created', 'builds pinned to a host should not be reused')
+
+        build.keep_host = False
+        codeowner_config.step_ids.cpu_limit = 60
+        other_params = params.copy({'extra_params': '--baz'})
+        self.assertEqual(self.dev_batch._create_build(other_params)[0], 'created', 'builds using older steps should not be reused')
+
     def test_trigger_build_config(self):
         """Test that a build gets the build config from the trigger"""
         self.additionnal_setup()
@@ -123,6 +197,62 @@ class TestBuildParams(RunbotCaseMinimalSetup):
         build_slot = bundle.last_batch.slot_ids.filtered(lambda rec: rec.trigger_id == self.trigger_server)
         self.assertEqual(build_slot.build_id.params_id.config_id, custom_config)
 
+    def test_applicable_triggers_cache(self):
+        Trigger = self.env['runbot.trigger']
+        default_category = self.env.ref('runbot.default_category')
+        version_13 = self.version_13.id
+        applicable_ids = Trigger._get_applicable_ids(self.project.id, default_category.id, version_13)
+        self.assertEqual(applicable_ids, tuple((self.trigger_server | self.trigger_addons).ids))
+
+        with patch.object(type(Trigger), 'search', autospec=True, side_effect=type(Trigger).search) as search:
+            Trigger._get_applicable_ids(self.project.id, default_category.id, version_13)
+            search.assert_not_called()
+
+        self.trigger_addons.version_domain = "[('number', '>', '13.00')]"
+        self.assertEqual(Trigger._get_applicable_ids(self.project.id, default_category.id, version_13), (self.trigger_server.id,))
+        self.version_13.name = '14.0'
+        self.assertEqual(Trigger._get_applicable_ids(self.project.id, default_category.id, version_13), tuple((self.trigger_server | self.trigger_addons).ids))
+        self.trigger_server.active = False
+        self.assertEqual(Trigger._get_applicable_ids(self.project.id, default_category.id, version_13), (self.trigger_addons.id,))
+
+    def test_impacted_modules_dependency(self):
+        """ The changes of the dependency repos of the trigger impact the
+        modules of its repos
+        """
+        manifests = {
+            'base': {'depends': [], 'installable': True, 'auto_install': False},
+            'mail': {'depends': ['base'], 'installable': True, 'auto_install': False},
+            'mail_enterprise': {'depends': ['mail'], 'installable': True, 'auto_install': False},
+            'helpdesk': {'depends': ['base'], 'installable': True, 'auto_install': False},
+            'stock_enterprise': {'depends': ['base'], 'installable': True, 'auto_install': False},
+        }
+        commits = {}
+        for repo in self.repo_server | self.repo_addons:
+            for name in ('base', 'head'):
+                commits[repo, name] = self.Commit.create({'name': f'{repo.name}_{name}', 'repo_id': repo.id})
+        params = self.BuildParameters.create({
+            'version_id': self.version_13.id,
+            'project_id': self.project.id,
+            'config_id': self.default_config.id,
+            'trigger_id': self.trigger_addons.id,
+            'commit_link_ids': [
+                (0, 0, {'commit_id': commits[repo, 'head'].id, 'merge_base_commit_id': commits[repo, 'base'].id})
+                for repo in self.repo_server | self.repo_addons
+            ],
+        })
+        diffs = {
+            'server': 'addons/mail/models/mail.py\n',
+            'addons': 'helpdesk/models/helpdesk.py\n',
+        }
+        with patch('odoo.addons.runbot.models.repo.Repo._git', new=lambda repo, cmd: diffs[repo.name]), \
+             patch('odoo.addons.runbot.models.commit.Commit._get_manifests', return_value=manifests):
+            modules, reason = params._get_impacted_modules()
+            self.assertEqual(modules, {'mail', 'mail_enterprise', 'helpdesk'})
+            self.assertEqual(reason, '2 modified modules: helpdesk, mail')
+
+            diffs['server'] = 'odoo/tools/misc.py\n'
+            self.assertEqual(params._get_impacted_modules(), (None, 'odoo/tools/misc.py is not part of a module'))
+
 
 class TestBuildResult(RunbotCase):
 
@@ -2,7 +2,7 @@
 from unittest.mock import patch, mock_open
 from odoo import Command
 from odoo.tools import mute_logger
-from odoo.exceptions import UserError
+from odoo.exceptions import UserError, ValidationError
 from odoo.addons.runbot.common import RunbotException
 from .common import RunbotCase
 
@@ -516,6 +516,45 @@ class TestBuildConfigStep(TestBuildConfigStepCommon):
         self.assertEqual(tags, '-at_install,/module1,/module2,-:otherclass.othertest')
 
 
+    @patch('odoo.addons.runbot.models.build.BuildResult._get_modules_to_test')
+    @patch('odoo.addons.runbot.models.build.BuildParameters._get_impacted_modules')
+    @patch('odoo.addons.runbot.models.build.BuildResult._parse_config')
+    @patch('odoo.addons.runbot.models.build.BuildResult._checkout')
+    def test_install_impacted_modules(self, mock_checkout, parse_config, get_impacted_modules, get_modules_to_test):
+        parse_config.return_value = {'--test-enable', '--test-tags'}
+        get_modules_to_test.return_value = ['crm', 'mail', 'sale', 'web']
+        config_step = self.ConfigStep.create({
+            'name': 'all',
+            'job_type': 'install_odoo',
+            'enable_auto_tags': False,
+            'test_tags': 'at_install,-:class.method',
+        })
+        build = self.Build.create({
+            'params_id': self.parent_build.params_id.copy({'trigger_id': self.trigger_server.id}).id,
+        })
+
+        def get_modules(params):
+            cmd = params['cmd'].cmd
+            return set(cmd[cmd.index('-i') + 1].split(','))
+
+        params = config_step._run_install_odoo(build)
+        self.assertEqual(get_modules(params), {'crm', 'mail', 'sale', 'web'})
+        self.assertEqual(self.get_test_tags(params), 'at_install,-:class.method')
+        get_impacted_modules.assert_not_called()
+
+        self.trigger_server.test_impacted_modules = True
+        get_impacted_modules.return_value = ({'mail', 'crm', 'mail_bot'}, '1 modified modules: mail')
+        params = config_step._run_install_odoo(build)
+        self.assertEqual(get_modules(params), {'crm', 'mail'})
+        self.assertEqual(self.get_test_tags(params), 'at_install/crm,at_install/mail,-:class.method')
+        self.assertIn('Testing 2 impacted modules out of 4 (1 modified modules: mail): crm, mail', build.log_ids.mapped('message'))
+
+        get_impacted_modules.return_value = (None, 'core module base is modified')
+        params = config_step._run_install_odoo(build)
+        self.assertEqual(get_modules(params), {'crm', 'mail', 'sale', 'web'})
+        self.assertEqual(self.get_test_tags(params), 'at_install,-:class.method')
+        self.assertIn('Testing all modules: core module base is modified', build.log_ids.mapped('message'))
+
     @patch('odoo.addons.runbot.models.build.BuildResult._checkout')
     def test_db_name(self, mock_checkout):
         config_step = self.ConfigStep.create({
@@ -588,6 +627,61 @@ def run():
         retult = config_step._run_python(self.parent_build)
         self.assertEqual(retult, {'a': 'b'})
 
+    def test_run_python_worker(self):
+        with self.assertRaises(ValidationError):
+            self.ConfigStep.create({
+                'name': 'default',
+                'job_type': 'python',
+                'python_code': 'docker_params = dict(cmd=build._cmd())',
+                'python_worker': True,
+            })
+        config_step = self.ConfigStep.create({
+            'name': 'default',
+            'job_type': 'python',
+            'python_code': "build._log('worker', 'in worker')",
+            'python_worker': True,
+            'test_enable': False,
+        })
+        self.parent_build.params_id.config_id = self.Config.create({
+            'name': 'Worker',
+            'step_order_ids': [(0, 0, {'step_id': config_step.id})],
+        })
+        self.parent_build.write({'local_state': 'testing', 'active_step': config_step.id})
+
+        config_step._run_step(self.parent_build)()
+        name, build_dir, target, args = self.patchers['python_worker_run'].call_args.args
+        self.assertEqual(name, self.parent_build._get_docker_name())
+        self.assertEqual(args, (self.env.cr.dbname, self.env.uid, config_step.id, self.parent_build.id, False))
+        self.assertFalse(self.parent_build.log_ids.filtered(lambda log: log.message == 'in worker'), 'the code is only executed by the worker')
+
+        self.start_patcher('fetch_local_logs', 'odoo.addons.runbot.models.host.Host._fetch_local_logs', [])
+        self.start_patcher('python_worker_state', 'odoo.addons.runbot.models.build.python_worker_state', 'RUNNING')
+        self.start_patcher('python_worker_result', 'odoo.addons.runbot.models.build.python_worker_result', ('ko', 'Worker failure'))
+        self.start_patcher('python_worker_clear_state', 'odoo.addons.runbot.models.build.python_worker_clear_state')
+        self.assertFalse(self.parent_build._schedule())
+        self.assertEqual(self.parent_build.local_state, 'testing')
+
+        self.patchers['python_worker_state'].return_value = 'END'
+        self.parent_build._schedule()
+        self.assertEqual(self.parent_build.local_state, 'done')
+        self.assertEqual(self.parent_build.local_result, 'ko')
+        self.assertTrue(self.parent_build.log_ids.filtered(lambda log: log.message == 'Worker failure' and log.level == 'ERROR'))
+        # the worker state is only cleared once the result is committed
+        self.patchers['python_worker_clear_state'].assert_not_called()
+        [clear_state] = [func for func in self.env.cr.postcommit._funcs if getattr(func, 'func', None) is self.patchers['python_worker_clear_state']]
+        clear_state()
+        self.patchers['python_worker_clear_state'].assert_called_once_with(self.parent_build._get_docker_name(), self.parent_build._path())
+
+        # the result code is run by the worker too
+        config_step.python_result_code = "return_value = {'description': 'worker result'}"
+        Step = type(config_step)
+        with patch.object(Step, '_make_python_results', autospec=True, side_effect=Step._make_python_results) as make_python_results:
+            config_step._make_results(self.parent_build)
+            make_python_results.assert_not_called()
+            config_step._run_python_worker(self.parent_build)
+            make_python_results.assert_called_once()
+        self.assertEqual(self.parent_build.description, 'worker result')
+
     @patch('odoo.addons.runbot.models.build.BuildResult._checkout')
     def test_sub_command(self, mock_checkout):
         config_step = self.ConfigStep.create({
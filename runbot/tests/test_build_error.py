@@ -1,7 +1,7 @@
 import hashlib
 
 from odoo import fields
-from odoo.exceptions import ValidationError
+from odoo.exceptions import UserError, ValidationError
 from .common import RunbotCase
 
 RTE_ERROR = """FAIL: TestUiTranslate.test_admin_tour_rte_translator
@@ -95,6 +95,11 @@ class TestBuildError(RunbotCase):
         self.assertIn(build_b, error_a.build_ids)
         self.assertFalse(error_b.build_error_link_ids)
         self.assertFalse(error_b.build_ids)
+        self.assertEqual(error_a.build_count, 2)
+        self.assertEqual(error_a.first_seen_build_id, build_a)
+        self.assertEqual(error_a.last_seen_build_id, build_b)
+        self.assertEqual(error_b.build_count, 0)
+        self.assertFalse(error_b.last_seen_build_id)
 
         error_c = self.BuildError.create({'content': 'foo foo'})
 
@@ -210,6 +215,31 @@ class TestBuildError(RunbotCase):
         self.assertIn(ko_build_new, new_build_error.build_ids, 'The parsed build with a re-apearing error should generate a new runbot.build.error')
         self.assertIn(build_error, new_build_error.error_history_ids, 'The old error should appear in history')
 
+    def test_build_scan_bulk(self):
+        builds = self.Build.browse()
+        for _ in range(5):
+            builds |= self.create_test_build({'local_result': 'ko'})
+        for build in builds:
+            for message in (RTE_ERROR, 'Fail: foo bar error', RTE_ERROR):
+                self.create_log({'create_date': fields.Datetime.from_string('2023-08-29 00:46:21'), 'message': message, 'build_id': build.id})
+
+        known_error = self.BuildError.create({'content': 'Fail: foo bar error', 'file_path': '/old/path.py'})
+        self.BuildErrorLink.create({'build_id': builds[0].id, 'build_error_id': known_error.id})
+
+        ir_logs = self.IrLog.search([('build_id', 'in', builds.ids)])
+        self.BuildError._parse_logs(ir_logs)
+        rte_error = self.BuildError.search([('content', '=', RTE_ERROR)])
+        self.assertEqual(len(rte_error), 1)
+        self.assertEqual(rte_error.build_ids, builds)
+        self.assertEqual(known_error.build_ids, builds, 'Existing links should be kept without being duplicated')
+        self.assertEqual(known_error.file_path, '/data/build/server/addons/web_studio/tests/test_ui.py')
+        self.assertEqual(self.BuildErrorLink.search_count([('build_id', 'in', builds.ids)]), 10)
+        self.assertEqual(known_error.build_count, 5)
+
+        # parsing the same logs again does not change anything
+        self.BuildError._parse_logs(ir_logs)
+        self.assertEqual(self.BuildErrorLink.search_count([('build_id', 'in', builds.ids)]), 10)
+
     def test_seen_date(self):
         # create all the records before the tests to evaluate compute dependencies
         build_a = self.create_test_build({'local_result': 'ok', 'local_state': 'testing'})
@@ -293,6 +323,40 @@ class TestBuildError(RunbotCase):
         self.assertEqual(error_a.build_count, 1)
         self.assertEqual(error_b.build_count, 2)
 
+    def test_similar_errors(self):
+        rte_tmp = RTE_ERROR.replace('dropdown-toggle)', 'dropdown-toggle) in /tmp/tmpx8a2k3q')
+        build_a = self.create_test_build({'local_result': 'ko'})
+        build_b = self.create_test_build({'local_result': 'ko'})
+        build_c = self.create_test_build({'local_result': 'ko'})
+        self.create_log({'create_date': fields.Datetime.from_string('2023-08-29 00:46:21'), 'message': RTE_ERROR, 'build_id': build_a.id})
+        self.create_log({'create_date': fields.Datetime.from_string('2023-08-29 01:46:21'), 'message': rte_tmp, 'build_id': build_b.id})
+        self.create_log({'create_date': fields.Datetime.from_string('2023-08-29 02:46:21'), 'message': 'Fail: foo bar error', 'build_id': build_c.id})
+
+        # without threshold, only identical errors are grouped
+        build_a._parse_logs()
+        build_b._parse_logs()
+        error_a = build_a.build_error_ids
+        error_b = build_b.build_error_ids
+        self.assertNotEqual(error_a, error_b)
+        self.assertEqual(self.BuildError._find_similar(error_b._signature(), 0.8, exclude=error_b), error_a)
+
+        # the existing errors can be clustered afterwards
+        with self.assertRaises(UserError):
+            (error_a | error_b).action_cluster_errors()
+        self.env['ir.config_parameter'].sudo().set_param('runbot.error_similarity', 0.8)
+        (error_a | error_b).action_cluster_errors()
+        self.assertEqual(error_a.child_ids, error_b)
+
+        # and new similar messages are attached to the existing error
+        build_d = self.create_test_build({'local_result': 'ko'})
+        self.create_log({'create_date': fields.Datetime.from_string('2023-08-29 03:46:21'), 'message': rte_tmp.replace('x8a2k3q', '4rt0p1z'), 'build_id': build_d.id})
+        build_d._parse_logs()
+        self.assertEqual(build_d.build_error_ids, error_a)
+
+        # while different ones still create a new error
+        build_c._parse_logs()
+        self.assertNotIn(build_c.build_error_ids, error_a | error_b)
+
     def test_build_error_test_tags(self):
         build_a = self.create_test_build({'local_result': 'ko'})
         build_b = self.create_test_build({'local_result': 'ko'})
@@ -139,3 +139,81 @@ chocolate 15
                 'website_blog.tests.test_ui': 2501.0
             }
         )
+
+
+class TestBuildStatSeries(RunbotCase):
+    def setUp(self):
+        super().setUp()
+        self.Series = self.env['runbot.build.stat.series']
+        self.params = self.BuildParameters.create({
+            'version_id': self.version_13.id,
+            'project_id': self.project.id,
+            'config_id': self.default_config.id,
+            'trigger_id': self.trigger_server.id,
+        })
+        self.batch = self.env['runbot.batch'].create({'bundle_id': self.dev_bundle.id})
+
+    def create_build(self, **vals):
+        build = self.Build.create({'params_id': self.params.id, 'port': '1234', **vals})
+        if not build.parent_id:
+            self.env['runbot.batch.slot'].create({
+                'batch_id': self.batch.id,
+                'build_id': build.id,
+                'params_id': self.params.id,
+                'trigger_id': self.trigger_server.id,
+                'link_type': 'created',
+            })
+        return build
+
+    def test_series(self):
+        build_a = self.create_build()
+        child_a = self.create_build(parent_id=build_a.id)
+        build_b = self.create_build()
+
+        self.Series._add_stats(build_a, {'query_count': {'website': 10.0}})
+        self.Series._add_stats(child_a, {'query_count': {'sale': 20.0}, 'module_loading_queries': {'sale': 5.0}})
+        self.Series._add_stats(build_b, {'query_count': {'website': 12.0, 'sale': 21.0}})
+
+        self.assertEqual(self.Series.search_count([('category', '=', 'query_count')]), 2, 'one series per key')
+        self.assertEqual(
+            self.Series._read_stats(self.dev_bundle, self.trigger_server, 'query_count', [build_a.id, build_b.id]),
+            {
+                build_a.id: {'website': 10.0, 'sale': 20.0},
+                build_b.id: {'website': 12.0, 'sale': 21.0},
+            },
+            'children stats should be on their top parent'
+        )
+        self.assertEqual(
+            self.Series._read_stats(self.dev_bundle, self.trigger_server, 'query_count', [build_b.id]),
+            {build_b.id: {'website': 12.0, 'sale': 21.0}},
+        )
+
+        # reused in an other bundle, the stats are in the series of the bundle it was created for
+        master_batch = self.env['runbot.batch'].create({'bundle_id': self.master_bundle.id})
+        self.env['runbot.batch.slot'].create({
+            'batch_id': master_batch.id,
+            'build_id': build_b.id,
+            'params_id': self.params.id,
+            'trigger_id': self.trigger_server.id,
+            'link_type': 'matched',
+        })
+        self.assertFalse(self.Series.search_count([('bundle_id', '=', self.master_bundle.id)]))
+        self.assertEqual(
+            self.Series._read_stats(self.master_bundle, self.trigger_server, 'query_count', [build_b.id]),
+            {build_b.id: {'website': 12.0, 'sale': 21.0}},
+        )
+
+    def test_series_chunks(self):
+        self.patch(type(self.Series), '_chunk_size', 2)
+        builds = [self.create_build() for _ in range(5)]
+        for value, build in enumerate(builds):
+            self.Series._add_stats(build, {'query_count': {'website': float(value)}})
+
+        series = self.Series.search([('category', '=', 'query_count')], order='id')
+        self.assertEqual([len(chunk.build_ids) for chunk in series], [2, 2, 1])
+        self.assertEqual(series[1].first_build_id, builds[2].id)
+        self.assertEqual(series[1].last_build_id, builds[3].id)
+        self.assertEqual(
+            self.Series._read_stats(self.dev_bundle, self.trigger_server, 'query_count', [b.id for b in builds[1:4]]),
+            {build.id: {'website': float(value)} for value, build in enumerate(builds) if 0 < value < 4},
+        )
@@ -1,5 +1,9 @@
 # -*- coding: utf-8 -*-
 import datetime
+import os
+import shutil
+import subprocess
+import tempfile
 from unittest.mock import patch
 from werkzeug.urls import url_parse
 
@@ -18,6 +22,115 @@ class TestCommitDate(RunbotCaseMinimalSetup):
 
         self.assertNotEqual(commit.date, False, "A commit should always have a date")
 
+
+class TestCommitComparison(RunbotCaseMinimalSetup):
+
+    def setUp(self):
+        super().setUp()
+        self.stop_patcher('git_patcher')
+        self.git_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.git_dir)
+        git_dir = self.git_dir
+        self.patch(type(self.repo_server), '_get_git_command', lambda repo, cmd, errors='strict': ['git', '-C', git_dir] + cmd)
+        self.git('init', '-q')
+        self.tstamp = 1700000000
+
+    def git(self, *args):
+        env = {
+            **os.environ,
+            'GIT_AUTHOR_NAME': 'a', 'GIT_AUTHOR_EMAIL': 'a@example.com',
+            'GIT_COMMITTER_NAME': 'a', 'GIT_COMMITTER_EMAIL': 'a@example.com',
+            'GIT_AUTHOR_DATE': f'{self.tstamp} +0000', 'GIT_COMMITTER_DATE': f'{self.tstamp} +0000',
+        }
+        return subprocess.check_output(['git', '-C', self.git_dir, *args], env=env).decode().strip()
+
+    def make_commit(self, filename, content):
+        self.tstamp += 60
+        os.makedirs(os.path.dirname(os.path.join(self.git_dir, filename)), exist_ok=True)
+        with open(os.path.join(self.git_dir, filename), 'a') as f:
+            f.write(content)
+        self.git('add', filename)
+        self.git('commit', '-q', '-m', filename)
+        sha = self.git('rev-parse', 'HEAD')
+        return self.Commit.create({'name': sha, 'repo_id': self.repo_server.id})
+
+    def test_compare(self):
+        root = self.make_commit('a', 'a\n')
+        self.git('checkout', '-q', '-b', 'dev')
+        dev_1 = self.make_commit('b', 'b\nb\n')
+        dev_2 = self.make_commit('a', 'a\n')
+        self.git('checkout', '-q', '-')
+        base = self.make_commit('c', 'c\n')
+
+        with patch.object(type(self.repo_server), '_compare_commits', autospec=True, side_effect=type(self.repo_server)._compare_commits) as compare:
+            comparisons = self.env['runbot.commit.comparison']._get([(dev_2, base), (dev_1, base), (root, base), (base, base)])
+            self.assertEqual(compare.call_count, 1, 'all the pairs of a repo should be compared at once')
+            self.assertEqual(len(compare.call_args.args[1]), 3, 'identical commits do not need to be compared')
+
+            comparison = comparisons[dev_2, base]
+            self.assertEqual(comparison.merge_base_commit_id, root)
+            self.assertEqual((comparison.base_ahead, comparison.base_behind), (2, 1))
+            self.assertEqual((comparison.file_changed, comparison.diff_add, comparison.diff_remove), (2, 3, 0))
+            comparison = comparisons[root, base]
+            self.assertEqual(comparison.merge_base_commit_id, root)
+            self.assertEqual((comparison.base_ahead, comparison.base_behind), (0, 1))
+            self.assertEqual((comparison.file_changed, comparison.diff_add, comparison.diff_remove), (0, 0, 0))
+            self.assertEqual(comparisons[base, base].merge_base_commit_id, base)
+
+            # the comparisons are cached
+            self.assertEqual(self.env['runbot.commit.comparison']._get([(dev_2, base)]), {(dev_2, base): comparisons[dev_2, base]})
+            self.assertEqual(compare.call_count, 1)
+
+    def test_compare_clock_skew(self):
+        """ Commits older than their parents are compared correctly """
+        self.make_commit('a', 'a\n')
+        root_tstamp = self.tstamp
+        self.tstamp += 3 * 24 * 3600
+        parent = self.make_commit('b', 'b\n')
+        self.tstamp = root_tstamp - 12 * 3600
+        skewed = self.make_commit('c', 'c\n')
+        self.tstamp += 4 * 24 * 3600
+        merge = self.git('commit-tree', 'HEAD^{tree}', '-p', skewed.name, '-p', parent.name, '-m', 'merge')
+        merge = self.Commit.create({'name': merge, 'repo_id': self.repo_server.id})
+
+        comparison = self.env['runbot.commit.comparison']._get([(merge, skewed)])[merge, skewed]
+        self.assertEqual(comparison.merge_base_commit_id, skewed)
+        self.assertEqual((comparison.base_ahead, comparison.base_behind), (1, 0))
+
+    def test_index_modules(self):
+        self.stop_patcher('commit_index_modules')
+        self.make_commit('addons/web/__manifest__.py', "{'depends': ['base'], 'auto_install': True}")
+        self.make_commit('addons/mail/__manifest__.py', "{'depends': ['base', 'web']}")
+        self.make_commit('core/addons/base/__manifest__.py', "{'installable': True}")
+        commit = self.make_commit('addons/broken/__manifest__.py', "{'depends': ")
+        self.make_commit('addons/web/static.txt', 'x')
+        commit._index_modules()
+        self.assertTrue(commit.modules_indexed)
+
+        with patch('odoo.addons.runbot.models.commit.glob.glob') as glob_patcher:
+            modules = list(commit._get_available_modules())
+            glob_patcher.assert_not_called()
+        self.assertEqual(modules, [
+            ('addons', 'broken', '__manifest__.py'),
+            ('addons', 'mail', '__manifest__.py'),
+            ('addons', 'web', '__manifest__.py'),
+            ('core/addons', 'base', '__manifest__.py'),
+        ])
+        self.assertEqual(list(commit._list_available_modules()), modules)
+
+        manifests = commit.addons_tree_ids.manifest_ids
+        web = manifests.filtered(lambda manifest: manifest.module == 'web')
+        self.assertEqual((web.depends, web.installable, web.auto_install), ('base', True, True))
+        self.assertEqual(manifests.filtered(lambda manifest: manifest.module == 'mail').depends, 'base,web')
+        self.assertEqual(manifests.filtered(lambda manifest: manifest.module == 'broken').depends, False)
+
+        # only the changed addons path is indexed again, the manifests are shared
+        next_commit = self.make_commit('addons/web/static.txt', 'y')
+        next_commit._index_modules()
+        self.assertEqual(next_commit.addons_tree_ids.filtered(lambda tree: tree.addons_path == 'core/addons'), commit.addons_tree_ids.filtered(lambda tree: tree.addons_path == 'core/addons'))
+        self.assertNotEqual(next_commit.addons_tree_ids, commit.addons_tree_ids)
+        self.assertEqual(next_commit.addons_tree_ids.manifest_ids, manifests)
+
 @tagged('post_install', '-at_install')
 class TestCommitStatus(HttpCase):
 
@@ -65,3 +65,41 @@ class TestDockerfile(RunbotCase, HttpCase):
             file_handle_mock = file_mock.return_value.__enter__.return_value
             file_handle_mock.write.side_effect = write_side_effect
             rb_host._docker_build()
+
+    def test_dockerfile_build_once(self):
+        dockerfile = self.env['runbot.dockerfile'].create({
+            'name': 'Tests Ubuntu Focal (20.0)[Chrome 86]',
+            'to_build': True,
+        })
+        self.env['runbot.dockerfile'].search([('id', '!=', dockerfile.id)]).update({'to_build': False})
+        builder_host = self.env['runbot.host'].create({'name': 'builder.odoo.com', 'docker_image_builder': True})
+        other_host = self.env['runbot.host'].create({'name': 'runbotxxx.odoo.com'})
+        self.patchers['docker_build'].return_value = (True, None)
+
+        with patch('builtins.open', mock_open()), patch('odoo.addons.runbot.models.host.os.listdir', return_value=[]):
+            builder_host._docker_build()
+        self.patchers['docker_build'].assert_called_once()
+        self.patchers['docker_save'].assert_called_once()
+        self.assertTrue(dockerfile.image_hash)
+        hash_tag = '%s-%s' % (dockerfile.image_tag, dockerfile.image_hash[:16])
+        self.patchers['docker_remove_tags'].assert_called_once_with(dockerfile.image_tag, hash_tag)
+        self.assertEqual(dockerfile.host_image_ids.host_id, builder_host)
+        self.assertEqual(dockerfile.host_image_ids.origin, 'build')
+
+        # the other hosts load the image exported by the builder
+        self.patchers['docker_build'].reset_mock()
+        with patch('odoo.addons.runbot.models.host.Host._docker_pull_image', return_value=True) as pull_mock:
+            other_host._docker_build()
+        self.patchers['docker_build'].assert_not_called()
+        self.assertEqual(pull_mock.call_args.args[0], dockerfile.image_hash)
+        other_image = dockerfile.host_image_ids.filtered(lambda image: image.host_id == other_host)
+        self.assertEqual((other_image.image_hash, other_image.origin), (dockerfile.image_hash, 'pull'))
+        self.assertEqual(self.patchers['docker_remove_tags'].call_count, 2)
+
+        # nothing to do when the image is already present
+        self.patchers['docker_image_exists'].return_value = True
+        with patch('odoo.addons.runbot.models.host.Host._docker_pull_image') as pull_mock:
+            other_host._docker_build()
+        pull_mock.assert_not_called()
+        self.patchers['docker_build'].assert_not_called()
+        self.assertEqual(self.patchers['docker_remove_tags'].call_count, 2)
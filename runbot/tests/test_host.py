@@ -1,5 +1,7 @@
 import logging
 
+from unittest.mock import patch
+
 from .common import RunbotCase
 
 from datetime import datetime, timedelta
@@ -53,6 +55,24 @@ class TestHost(RunbotCase):
         self.start_patcher('find_patcher', 'odoo.addons.runbot.common.find', 0)
         self.start_patcher('host_bootstrap', 'odoo.addons.runbot.models.host.Host._bootstrap', None)
 
+    def test_port_lease(self):
+        self.env['ir.config_parameter'].sudo().set_param('runbot.runbot_starting_port', 2000)
+        builds = self.Build.create([{'params_id': self.server_params.id, 'host': 'test_host', 'local_state': 'testing'} for _ in range(3)])
+        with patch('odoo.addons.runbot.models.host.is_port_free', return_value=True):
+            self.assertEqual([self.test_host._lease_port(build) for build in builds[:2]], [2000, 2003])
+            builds[0].local_state = 'done'
+            self.assertEqual(self.test_host._lease_port(builds[2]), 2000, 'a released port should be leased again')
+
+        builds[1].local_state = 'done'
+        with patch('odoo.addons.runbot.models.host.is_port_free', side_effect=lambda port: port != 2004):
+            self.assertEqual(self.test_host._lease_port(builds[0]), 2006, 'a port still in use should be skipped')
+        leases = self.env['runbot.host.port'].search([('host_id', '=', self.test_host.id)])
+        self.assertEqual([(lease.port, lease.build_id) for lease in leases], [(2000, builds[2]), (2003, self.Build), (2006, builds[0])])
+
+        builds[2].host = 'other_host'
+        self.test_host._release_ports()
+        self.assertFalse(leases[0].build_id)
+
     def test_build_logs(self):
 
         build = self.Build.create({
@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from odoo.tests.common import TransactionCase
+
+from odoo.addons.runbot.models.ir_logging import IrLogging, PARTITION_SIZE, PARTITIONS_AHEAD
+
+
+class TestIrLoggingPartitions(TransactionCase):
+
+    def _log(self, **values):
+        return self.env['ir.logging'].create({
+            'level': 'INFO',
+            'type': 'runbot',
+            'name': 'odoo.runbot',
+            'message': 'a message',
+            'path': 'runbot',
+            'func': 'test',
+            'line': '0',
+            **values,
+        })
+
+    def test_partitioned(self):
+        self.env.cr.execute("SELECT relkind FROM pg_class WHERE oid = 'ir_logging'::regclass")
+        self.assertEqual(self.env.cr.fetchone()[0], 'p')
+
+        log = self._log()
+        partitions = self.env['ir.logging']._partitions()
+        self.assertTrue(any((lower or 0) <= log.id < upper for _, lower, upper in partitions))
+        self.assertGreaterEqual(
+            partitions[-1][2],
+            (log.id // PARTITION_SIZE + PARTITIONS_AHEAD + 1) * PARTITION_SIZE,
+            "partitions should be created ahead of the current id",
+        )
+
+    def test_gc_partitions(self):
+        self.env['ir.config_parameter'].set_param('runbot.logs_gc_days', 30)
+        old_log = self._log(create_date=datetime.now() - timedelta(days=3650))
+
+        self.env['ir.logging']._gc_partitions()
+        self.assertTrue(old_log.exists(), "the partition being filled should never be dropped")
+
+    def _partition_of(self, log_id):
+        self.env.cr.execute("SELECT tableoid::regclass::text FROM ir_logging WHERE id = %s", [log_id])
+        return self.env.cr.fetchone()[0]
+
+    def test_gc_expired_partitions(self):
+        self.env['ir.config_parameter'].set_param('runbot.logs_gc_days', 30)
+        old_log = self._log()
+        recent_log = self._log()
+        old_partition = self._partition_of(old_log.id)
+        [upper] = [upper for name, _, upper in self.env['ir.logging']._partitions() if name == old_partition]
+        old_date = datetime.now() - timedelta(days=3650)
+        self.env.cr.execute("UPDATE ir_logging SET create_date = %s WHERE id <= %s", [old_date, old_log.id])
+        self.env.invalidate_all()
+
+        # the partition of the logs is full, but the newest log is recent
+        with patch.object(IrLogging, '_last_id', return_value=upper):
+            self.env['ir.logging']._gc_partitions()
+        self.assertTrue(old_log.exists())
+
+        self.env.cr.execute("UPDATE ir_logging SET create_date = %s WHERE id = %s", [old_date, recent_log.id])
+        # the partition is being filled
+        with patch.object(IrLogging, '_last_id', return_value=upper - 1):
+            self.env['ir.logging']._gc_partitions()
+        self.assertTrue(old_log.exists())
+
+        with patch.object(IrLogging, '_last_id', return_value=upper):
+            self.env['ir.logging']._gc_partitions()
+        names = [name for name, _, _ in self.env['ir.logging']._partitions()]
+        self.assertNotIn(old_partition, names, "expired partitions should be dropped")
+        self.assertFalse(old_log.exists())
+        self.assertEqual(names[0], f'ir_logging_{upper // PARTITION_SIZE}', "the next partitions should be kept")
+
+    def test_default_partition(self):
+        """ Logs beyond the existing partitions are kept in the default
+        partition until their partition is created
+        """
+        last_upper = self.env['ir.logging']._partitions()[-1][2]
+        log_id = last_upper + PARTITION_SIZE // 2
+        self.env.cr.execute("""
+            INSERT INTO ir_logging (id, create_date, name, type, dbname, level, message, path, func, line)
+            VALUES (%s, now() at time zone 'UTC', 'odoo.runbot', 'runbot', 'db', 'INFO', 'beyond', 'runbot', 'test', '0')
+        """, [log_id])
+        self.assertEqual(self._partition_of(log_id), 'ir_logging_default')
+
+        with patch.object(IrLogging, '_last_id', return_value=log_id):
+            self.env['ir.logging']._create_partitions()
+        self.assertEqual(self._partition_of(log_id), f'ir_logging_{log_id // PARTITION_SIZE}')
+        self.assertGreaterEqual(
+            self.env['ir.logging']._partitions()[-1][2],
+            (log_id // PARTITION_SIZE + PARTITIONS_AHEAD + 1) * PARTITION_SIZE,
+        )
+
+    def test_reinit(self):
+        """ Updating runbot or base again keeps the partitions
+        """
+        partitions = self.env['ir.logging']._partitions()
+        for module in ('base', 'runbot'):
+            self.registry.init_models(self.env.cr, ['ir.logging'], {'module': module}, install=False)
+            self.env.cr.execute("SELECT relkind FROM pg_class WHERE oid = 'ir_logging'::regclass")
+            self.assertEqual(self.env.cr.fetchone()[0], 'p')
+            self.assertEqual(self.env['ir.logging']._partitions(), partitions)
+            self.assertTrue(self._log().exists())
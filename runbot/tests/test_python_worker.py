@@ -0,0 +1,89 @@
+import os
+import shutil
+import signal
+import tempfile
+import time
+
+from odoo.tests import common
+
+from odoo.addons.runbot.python_worker import (
+    _python_worker_run,
+    _workers,
+    python_worker_clear_state,
+    python_worker_result,
+    python_worker_state,
+    python_worker_stop,
+)
+
+
+def _failing_target(message):
+    raise ValueError(message)
+
+
+def _killed_target():
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+class TestPythonWorker(common.TransactionCase):
+    """ Runs actual workers (forked processes) with trivial targets """
+
+    def setUp(self):
+        super().setUp()
+        self.build_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.build_dir)
+        self.addCleanup(python_worker_stop, 'worker', self.build_dir)
+
+    def wait_worker(self, timeout=10):
+        start = time.time()
+        while python_worker_state('worker', self.build_dir) == 'RUNNING':
+            if time.time() - start > timeout:
+                self.fail('worker still running after %ss' % timeout)
+            time.sleep(0.05)
+        return python_worker_state('worker', self.build_dir)
+
+    def test_end(self):
+        self.assertEqual(python_worker_state('worker', self.build_dir), 'VOID')
+        _python_worker_run('worker', self.build_dir, time.sleep, (0.2,))
+        self.assertEqual(python_worker_state('worker', self.build_dir), 'RUNNING')
+        self.assertEqual(self.wait_worker(), 'END')
+        self.assertNotIn('worker', _workers, 'the finished worker should be joined')
+        self.assertEqual(python_worker_result('worker', self.build_dir), ('ok', ''))
+
+        python_worker_clear_state('worker', self.build_dir)
+        self.assertEqual(python_worker_state('worker', self.build_dir), 'VOID')
+
+    def test_ko(self):
+        _python_worker_run('worker', self.build_dir, _failing_target, ('worker failure',))
+        self.assertEqual(self.wait_worker(), 'END')
+        result, message = python_worker_result('worker', self.build_dir)
+        self.assertEqual(result, 'ko')
+        self.assertIn('worker failure', message)
+        self.assertIn('Traceback', message)
+
+    def test_ghost(self):
+        _python_worker_run('worker', self.build_dir, _killed_target)
+        self.assertEqual(self.wait_worker(), 'GHOST')
+        self.assertEqual(python_worker_result('worker', self.build_dir), ('ko', 'Python worker ended without result'))
+
+    def test_ghost_restart(self):
+        """ A worker started by a previous builder process """
+        _python_worker_run('worker', self.build_dir, time.sleep, (60,))
+        process = _workers.pop('worker')
+        self.addCleanup(process.join)
+        self.addCleanup(process.kill)
+        self.assertEqual(python_worker_state('worker', self.build_dir), 'GHOST')
+
+    def test_clear_state_running(self):
+        """ The state of a worker started after the previous one ended is kept """
+        _python_worker_run('worker', self.build_dir, time.sleep, (60,))
+        python_worker_clear_state('worker', self.build_dir)
+        self.assertEqual(python_worker_state('worker', self.build_dir), 'RUNNING')
+
+    def test_stop(self):
+        _python_worker_run('worker', self.build_dir, time.sleep, (60,))
+        process = _workers['worker']
+        self.assertEqual(python_worker_state('worker', self.build_dir), 'RUNNING')
+        python_worker_stop('worker', self.build_dir)
+        self.assertFalse(process.is_alive())
+        self.assertEqual(python_worker_state('worker', self.build_dir), 'END')
+        self.assertEqual(python_worker_result('worker', self.build_dir), ('ko', 'Python worker killed'))
@@ -41,6 +41,39 @@ class TestRepo(RunbotCaseMinimalSetup):
         self.assertEqual(remote.owner, 'somewhere')
         self.assertEqual(remote.repo_name, 'bar')
 
+    def test_trigger_impacted_modules(self):
+        manifests = {
+            'base': {'depends': [], 'installable': True, 'auto_install': False},
+            'web': {'depends': ['base'], 'installable': True, 'auto_install': True},
+            'mail': {'depends': ['web'], 'installable': True, 'auto_install': False},
+            'sale': {'depends': ['web'], 'installable': True, 'auto_install': False},
+            'sale_mail': {'depends': ['sale', 'mail'], 'installable': True, 'auto_install': True},
+            'crm': {'depends': ['mail'], 'installable': True, 'auto_install': False},
+            'stock': {'depends': ['web'], 'installable': True, 'auto_install': False},
+        }
+        trigger = self.trigger_server
+
+        modules, reason = trigger._get_impacted_modules({self.repo_server: ['addons/mail/models/mail.py']}, manifests)
+        self.assertEqual(modules, {'mail', 'crm', 'sale_mail'}, 'the modules depending on mail are impacted')
+
+        modules, reason = trigger._get_impacted_modules({self.repo_server: ['addons/sale/models/sale.py', 'addons/mail/models/mail.py']}, manifests)
+        self.assertEqual(modules, {'mail', 'crm', 'sale', 'sale_mail'})
+        self.assertEqual(reason, '2 modified modules: mail, sale')
+
+        modules, reason = trigger._get_impacted_modules({self.repo_server: ['core/addons/crm/models/crm.py']}, {
+            **manifests,
+            'mail_bot': {'depends': ['mail'], 'installable': True, 'auto_install': True},
+        })
+        self.assertEqual(modules, {'crm', 'mail_bot'}, 'auto_install modules installed with the impacted modules are impacted')
+
+        modules, reason = trigger._get_impacted_modules({self.repo_server: ['addons/mail/models/mail.py', 'core/addons/base/models/ir_model.py']}, manifests)
+        self.assertIsNone(modules)
+        self.assertEqual(reason, 'core module base is modified')
+
+        modules, reason = trigger._get_impacted_modules({self.repo_server: ['odoo/tools/misc.py']}, manifests)
+        self.assertIsNone(modules)
+        self.assertEqual(reason, 'odoo/tools/misc.py is not part of a module')
+
     def test_repo_update_batches(self):
         """ Test that when finding new refs in a repo, the missing branches
         are created and new builds are created in pending state
@@ -306,6 +339,76 @@ class TestRepo(RunbotCaseMinimalSetup):
         _test_times('runbot.repo.hooktime', '_set_hook_time', 'hook_time')
         _test_times('runbot.repo.reftime', '_set_ref_time', 'get_ref_time')
 
+    def test_hooks(self):
+        """ Hooks are coalesced per repo and ref, hooked repos are fetched and
+        only their hooked refs are listed
+        """
+        self.start_patchers()
+        repo = self.repo_server
+        repo.mode = 'hook'
+        Hook = self.env['runbot.repo.hook']
+
+        repo._enqueue_hook(self.remote_server_dev, 'master-test')
+        repo._enqueue_hook(self.remote_server_dev, 'master-test')
+        repo._enqueue_hook(self.remote_server, '1234')
+        self.assertEqual(Hook.search_count([('repo_id', '=', repo.id)]), 2)
+
+        # hooks are kept when the fetch fails
+        self.patchers['repo_update_patcher'].return_value = False
+        repo._update_batches()
+        self.assertEqual(Hook.search_count([('repo_id', '=', repo.id)]), 2)
+        self.assertFalse(repo.hook_time)
+        self.patchers['repo_update_patcher'].return_value = True
+        self.patchers['repo_update_patcher'].reset_mock()
+
+        with patch('odoo.addons.runbot.models.repo.Repo._get_refs', return_value=[]) as get_refs:
+            repo._update_batches()
+        self.patchers['repo_update_patcher'].assert_called_once_with(force=True, poll_delay=300)
+        self.assertEqual(
+            {(remote, ref) for remote, ref in get_refs.call_args.kwargs['hooks']},
+            {(self.remote_server_dev, 'master-test'), (self.remote_server, '1234')},
+        )
+        self.assertFalse(Hook.search_count([('repo_id', '=', repo.id)]))
+        self.assertTrue(repo.hook_time)
+
+        # not hooked anymore
+        self.patchers['repo_update_patcher'].reset_mock()
+        repo._update_batches()
+        self.patchers['repo_update_patcher'].assert_called_once_with(force=False, poll_delay=300)
+
+        # a hook without ref lists all refs
+        repo._enqueue_hook(self.remote_server)
+        with patch('odoo.addons.runbot.models.repo.Repo._get_refs', return_value=[]) as get_refs:
+            repo._update_batches()
+        self.assertIsNone(get_refs.call_args.kwargs['hooks'])
+
+    def test_hooks_during_update(self):
+        """ A hook received while the repository is fetched is kept for the
+        next turn, even if an identical hook is being processed
+        """
+        self.start_patchers()
+        repo = self.repo_server
+        repo.mode = 'hook'
+        Hook = self.env['runbot.repo.hook']
+        repo._enqueue_hook(self.remote_server_dev, 'master-test')
+
+        def update(*args, **kwargs):
+            repo._enqueue_hook(self.remote_server_dev, 'master-test')
+            return True
+
+        self.patchers['repo_update_patcher'].side_effect = update
+        with patch('odoo.addons.runbot.models.repo.Repo._get_refs', return_value=[]):
+            repo._update_batches()
+        hook = Hook.search([('repo_id', '=', repo.id)])
+        self.assertEqual((hook.remote_id, hook.ref), (self.remote_server_dev, 'master-test'))
+        self.assertGreater(hook.time, repo.hook_time)
+
+        self.patchers['repo_update_patcher'].side_effect = None
+        self.patchers['repo_update_patcher'].return_value = True
+        with patch('odoo.addons.runbot.models.repo.Repo._get_refs', return_value=[]):
+            repo._update_batches()
+        self.assertFalse(Hook.search_count([('repo_id', '=', repo.id)]))
+
 
 class TestGithub(TransactionCase):
 
@@ -1,5 +1,11 @@
 # -*- coding: utf-8 -*-
 import logging
+import os
+import shutil
+import signal
+import tempfile
+
+from unittest.mock import patch
 
 from .common import RunbotCase
 
@@ -12,3 +18,79 @@ class TestRunbot(RunbotCase):
         warning = self.env['runbot.runbot']._warning('Test warning message')
 
         self.assertTrue(self.env['runbot.warning'].browse(warning.id).exists())
+
+    def test_reload_nginx(self):
+        for patcher_name in ('reload_nginx', 'file_exist', 'getmtime'):
+            self.stop_patcher(patcher_name)
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.patch(type(self.Runbot), '_root', lambda runbot: root)
+        self.start_patcher('nginx_file_open', 'odoo.addons.runbot.models.runbot.file_open', new=open)
+        nginx_dir = os.path.join(root, 'nginx')
+        pid_path = os.path.join(nginx_dir, 'nginx.pid')
+        host_name = self.env['runbot.host']._get_current_name()
+        builds = self.Build.create([{
+            'params_id': self.base_params.id,
+            'host': host_name,
+            'local_state': 'running',
+            'port': 2000 + 3 * i,
+        } for i in range(3)])
+        builds[2].local_state = 'done'
+        View = type(self.env['ir.ui.view'])
+
+        def build_config_files():
+            # without the key of the rendered values
+            return sorted(file_name.rsplit('_', 1)[0] for file_name in os.listdir(os.path.join(nginx_dir, 'builds')))
+
+        with patch('odoo.addons.runbot.models.runbot.subprocess.call', return_value=0) as nginx_call:
+            self.Runbot._reload_nginx()
+            self.assertEqual(nginx_call.call_args.args[0], ['/usr/sbin/nginx', '-p', nginx_dir, '-c', 'nginx.conf'])
+        self.assertEqual(build_config_files(), [f'{build.dest}_{build.port}' for build in builds[:2]])
+        with open(os.path.join(nginx_dir, 'nginx.conf')) as f:
+            self.assertIn(f'include {nginx_dir}/builds/*.conf;', f.read())
+        with open(pid_path, 'w') as f:
+            f.write('12345')
+
+        builds[0].local_state = 'done'
+        builds[2].local_state = 'running'
+        with patch.object(View, '_render_template', autospec=True, side_effect=View._render_template) as render, \
+                patch('odoo.addons.runbot.models.runbot.os.kill') as kill:
+            self.Runbot._reload_nginx()
+            self.assertEqual(
+                [call.args[1] for call in render.call_args_list],
+                ['runbot.nginx_config', 'runbot.nginx_config'],
+                'only the config of the started build should be rendered',
+            )
+            self.assertEqual(build_config_files(), sorted(f'{build.dest}_{build.port}' for build in builds[1:]))
+            kill.assert_not_called()  # nginx was started less than 5 seconds ago
+
+            self.env['ir.config_parameter'].sudo().set_param('runbot.nginx_reload_delay', 0)
+            self.Runbot._reload_nginx()
+            kill.assert_called_once_with(12345, signal.SIGHUP)
+            self.Runbot._reload_nginx()
+            kill.assert_called_once()
+
+        def build_file_content(build):
+            [file_name] = [f for f in os.listdir(os.path.join(nginx_dir, 'builds')) if f.startswith(f'{build.dest}_')]
+            with open(os.path.join(nginx_dir, 'builds', file_name)) as f:
+                return f.read()
+
+        # the files of the running builds are rewritten when the template changes
+        self.env['ir.ui.view'].create({
+            'name': 'nginx custom build config',
+            'type': 'qweb',
+            'inherit_id': self.env.ref('runbot.nginx_config').id,
+            'arch': '<xpath expr="//t[@id=\'build_anchor\']" position="after">    # custom build config\n</xpath>',
+        })
+        with patch('odoo.addons.runbot.models.runbot.os.kill'):
+            self.Runbot._reload_nginx()
+        self.assertEqual(build_config_files(), sorted(f'{build.dest}_{build.port}' for build in builds[1:]))
+        for build in builds[1:]:
+            self.assertIn('# custom build config', build_file_content(build))
+
+        # and so is the file of a build when its access token changes
+        builds[1].access_token = 'abcdef0123456789'
+        with patch('odoo.addons.runbot.models.runbot.os.kill'):
+            self.Runbot._reload_nginx()
+        self.assertIn('-abcdef01(', build_file_content(builds[1]))
+        self.assertEqual(build_config_files(), sorted(f'{build.dest}_{build.port}' for build in builds[1:]))
@@ -555,6 +555,42 @@ class TestUpgradeFlow(RunbotCase):
         self.assertEqual(master_child.params_id.config_id, self.test_upgrade_config)
         self.assertEqual(master_child.params_id.upgrade_to_build_id.params_id.version_id.name, 'master')
 
+    def test_upgrade_references(self):
+        bundle_13 = self.build_niglty_13[('root', self.trigger_server_nightly)].params_id.create_batch_id.bundle_id
+        reference = self.env['runbot.upgrade.reference'].search([('bundle_id', '=', bundle_13.id), ('category_id', '=', self.nightly_category.id)])
+        self.assertEqual(reference.batch_id, bundle_13.with_context(category_id=self.nightly_category.id).last_done_batch)
+        self.assertEqual(
+            reference.dump_build_ids,
+            self.build_niglty_13[('demo', self.trigger_server_nightly)] | self.build_niglty_13[('no_demo', self.trigger_server_nightly)] |
+            self.build_niglty_13[('demo', self.trigger_addons_nightly)] | self.build_niglty_13[('no_demo', self.trigger_addons_nightly)]
+        )
+        source = self.build_niglty_13[('root', self.trigger_server_nightly)]
+        self.assertEqual(
+            self.env['runbot.upgrade.reference']._get_dump_builds(source),
+            {source: self.build_niglty_13[('demo', self.trigger_server_nightly)] | self.build_niglty_13[('no_demo', self.trigger_server_nightly)]}
+        )
+
+        # orphan dump builds are not used anymore
+        self.build_niglty_13[('no_demo', self.trigger_server_nightly)].orphan_result = True
+        self.assertEqual(
+            self.env['runbot.upgrade.reference']._get_dump_builds(source),
+            {source: self.build_niglty_13[('demo', self.trigger_server_nightly)]}
+        )
+        # a source rebuilt after its batch was done has no dump builds in the reference
+        rebuild = source._rebuild()
+        self.assertIn(rebuild, reference.batch_id.slot_ids.build_id)
+        self.assertEqual(self.env['runbot.upgrade.reference']._get_dump_builds(rebuild), {})
+
+        # a newer done batch replaces the reference, an older one is ignored
+        previous_batch = reference.batch_id
+        batch = bundle_13._force(self.nightly_category.id)
+        batch._prepare()
+        batch.state = 'done'
+        self.assertEqual(reference.batch_id, batch)
+        self.env['runbot.upgrade.reference']._refresh(previous_batch)
+        self.assertEqual(reference.batch_id, batch)
+        self.assertEqual(self.env['runbot.upgrade.reference']._get_batches(bundle_13, self.nightly_category.id), batch)
+
 
 class TestUpgrade(RunbotCase):
 
@@ -23,6 +23,8 @@ class LeaderClient(RunbotClient):  # Conductor, Director, Main, Maestro, Lead
             self.env.cr.commit()
             self.git_gc()
             self.env.cr.commit()
+            self.env['ir.logging']._gc_partitions()
+            self.env.cr.commit()
         return self.env['runbot.runbot']._fetch_loop_turn(self.host, self.pull_info_failures)
 
 
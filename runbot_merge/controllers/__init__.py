@@ -39,7 +39,13 @@ class MergebotController(Controller):
                              req.headers.get('X-Hub-Signature'))
                 return werkzeug.exceptions.Forbidden()
 
-        return c(env, request.jsonrequest)
+        if event == 'ping':
+            return c(env, request.jsonrequest)
+
+        # the actual handling is done asynchronously by the events crons
+        env['runbot_merge.events']._enqueue(
+            event, req.headers.get('X-Github-Delivery'), request.jsonrequest)
+        return 'Queued'
 
     def _format(self, request):
         return """<= {r.method} {r.full_path}
@@ -154,7 +160,7 @@ def handle_pr(env, event):
     if not branch:
         return "Not set up to care about {}:{}".format(r, b)
 
-    headers = request.httprequest.headers if request.httprequest else {}
+    headers = request.httprequest.headers if request else {}
     _logger.info(
         "%s: %s#%s (%s) (by %s, delivery %s by %s)",
         event['action'],
@@ -279,6 +285,9 @@ def handle_status(env, event):
                 statuses = c.statuses::jsonb || EXCLUDED.statuses::jsonb
             WHERE NOT c.statuses::jsonb @> EXCLUDED.statuses::jsonb
     """, [event['sha'], status_value])
+    if env.cr.rowcount:
+        # new or updated statuses, process them asap
+        env.ref('runbot_merge.process_updated_commits')._trigger()
 
     return 'ok'
 
@@ -25,6 +25,7 @@ class MergebotDashboard(Controller):
 
         stagings = request.env['runbot_merge.stagings'].with_context(active_test=False).sudo().search([
             ('target', '=', branch.id),
+            ('parent_id', '=', False),
             ('staged_at', '<=', until) if until else (True, '=', True),
         ], order='staged_at desc', limit=LIMIT+1)
 
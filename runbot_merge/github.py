@@ -1,4 +1,5 @@
 import collections.abc
+import concurrent.futures
 import itertools
 import json as json_
 import logging
@@ -6,10 +7,14 @@ import logging.handlers
 import os
 import pathlib
 import pprint
+import random
 import textwrap
+import threading
+import time
 import unicodedata
 
 import requests
+import requests.adapters
 import werkzeug.urls
 
 import odoo.netsvc
@@ -54,13 +59,71 @@ GH_LOG_PATTERN = """=> {method} /{self._repo}/{path}{qs}{body}
 {body2}
 ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
 """
+# ratio of successful requests whose full request / response is logged, the
+# rest only get a one-line summary
+LOG_SAMPLE_RATE = float(config.get('github_log_sample_rate') or 0.01)
+# maximum wait when rate-limited before giving up on a request
+RATE_LIMIT_MAX_WAIT = 60
+POOL_SIZE = 10
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+def _session(token):
+    """ Returns the session for ``token``, sessions are shared between
+    all :class:`GH` instances (and threads) using the same token so
+    connections get reused.
+    """
+    with _sessions_lock:
+        session = _sessions.get(token)
+        if session is None:
+            session = _sessions[token] = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount('https://', adapter)
+            session.headers['Authorization'] = 'token {}'.format(token)
+            session.headers['Accept'] = 'application/vnd.github.symmetra-preview+json'
+        return session
+
+def concurrently(calls, max_workers=POOL_SIZE):
+    """ Executes the independent ``calls`` (callables without parameters)
+    concurrently, returns the results in the same order.
+
+    The calls should only perform github requests, not touch the ORM (the
+    cursor and environment are not thread-safe). If a call fails, its
+    exception is raised once all calls are done.
+    """
+    calls = list(calls)
+    if len(calls) <= 1 or max_workers <= 1:
+        return [c() for c in calls]
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(max_workers, len(calls)),
+            thread_name_prefix='github') as executor:
+        futures = [executor.submit(c) for c in calls]
+        concurrent.futures.wait(futures)
+    return [f.result() for f in futures]
+
+def _rate_limit_wait(r):
+    """ If ``r`` is a primary or secondary rate limit response, returns how
+    long to wait before retrying, otherwise ``None``.
+    """
+    if r.status_code not in (403, 429):
+        return None
+    retry_after = r.headers.get('Retry-After')
+    if retry_after:
+        return int(retry_after)
+    if r.headers.get('X-RateLimit-Remaining') == '0':
+        reset = int(r.headers.get('X-RateLimit-Reset') or 0)
+        return max(reset - time.time(), 1)
+    if 'secondary rate limit' in r.text.lower():
+        return 60
+    return None
+
 class GH(object):
     def __init__(self, token, repo):
         self._url = 'https://api.github.com'
         self._repo = repo
-        session = self._session = requests.Session()
-        session.headers['Authorization'] = 'token {}'.format(token)
-        session.headers['Accept'] = 'application/vnd.github.symmetra-preview+json'
+        self._session = _session(token)
 
     def _log_gh(self, logger, method, path, params, json, response, level=logging.INFO):
         """ Logs a pair of request / response to github, to the specified
@@ -106,8 +169,9 @@ class GH(object):
         :type check: bool | dict[int:Exception]
         """
         path = f'/repos/{self._repo}/{path}'
-        r = self._session.request(method, self._url + path, params=params, json=json)
-        self._log_gh(_gh, method, path, params, json, r)
+        r = self._request(method, self._url + path, params=params, json=json)
+        if random.random() < LOG_SAMPLE_RATE:
+            self._log_gh(_gh, method, path, params, json, r)
         if check:
             if isinstance(check, collections.abc.Mapping):
                 exc = check.get(r.status_code)
@@ -124,8 +188,32 @@ class GH(object):
             r.raise_for_status()
         return r
 
+    def _request(self, method, url, **kw):
+        """ Performs the request, waiting and retrying if the response is a
+        rate limit, logs a summary of the exchange.
+        """
+        waited = 0
+        while True:
+            t0 = time.monotonic()
+            r = self._session.request(method, url, **kw)
+            _gh.info(
+                "%s %s -> %s %s (%.3fs, remaining=%s)",
+                method.upper(), url, r.status_code, r.reason,
+                time.monotonic() - t0,
+                r.headers.get('X-RateLimit-Remaining'),
+            )
+            delay = _rate_limit_wait(r)
+            if delay is None:
+                return r
+            if waited + delay > RATE_LIMIT_MAX_WAIT:
+                _logger.warning("%s %s: rate limited for %ss, giving up", method.upper(), url, delay)
+                return r
+            _logger.warning("%s %s: rate limited, retrying in %ss", method.upper(), url, delay)
+            time.sleep(delay)
+            waited += delay
+
     def user(self, username):
-        r = self._session.get("{}/users/{}".format(self._url, username))
+        r = self._request('get', "{}/users/{}".format(self._url, username))
         r.raise_for_status()
         return r.json()
 
@@ -361,6 +449,28 @@ class GH(object):
             if not r.links.get('next'):
                 return
 
+    def prs(self, state='open'):
+        """ Lists the repository's PRs, by pages of 100
+        """
+        for page in itertools.count(1):
+            r = self('get', 'pulls', params={'state': state, 'per_page': 100, 'page': page})
+            yield from r.json()
+            if not r.links.get('next'):
+                return
+
+    def repo_comments(self, since=None):
+        """ Lists the comments on all issues and PRs of the repository, oldest
+        first, by pages of 100
+        """
+        params = {'sort': 'created', 'direction': 'asc', 'per_page': 100}
+        if since:
+            params['since'] = since
+        for page in itertools.count(1):
+            r = self('get', 'issues/comments', params={**params, 'page': page})
+            yield from r.json()
+            if not r.links.get('next'):
+                return
+
     def commits_lazy(self, pr):
         for page in itertools.count(1):
             r = self('get', 'pulls/{}/commits'.format(pr), params={'page': page})
@@ -0,0 +1,20 @@
+def migrate(cr, version):
+    """ Create & fill the batch key column in SQL rather than have the ORM
+    compute it for every historical PR
+    """
+    cr.execute("ALTER TABLE runbot_merge_pull_requests"
+               " ADD COLUMN batch_key varchar")
+    cr.execute("""
+    UPDATE runbot_merge_pull_requests
+    SET batch_key = CASE
+        WHEN label SIMILAR TO '%:patch-[[:digit:]]+' THEN id::text
+        ELSE label
+    END
+    """)
+    cr.execute("ALTER TABLE runbot_merge_pull_requests"
+               " ADD COLUMN link_check BOOLEAN NOT NULL DEFAULT false")
+    cr.execute("""
+    UPDATE runbot_merge_pull_requests
+    SET link_check = true
+    WHERE state != 'merged' AND state != 'closed'
+    """)
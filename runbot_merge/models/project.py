@@ -35,6 +35,13 @@ class Project(models.Model):
 
     batch_limit = fields.Integer(
         default=8, group_operator=None, help="Maximum number of PRs staged together")
+    staging_concurrency = fields.Integer(
+        default=1, group_operator=None,
+        help="Maximum number of stagings running concurrently per branch. "
+             "Above 1, speculative stagings of prefixes of the staged "
+             "batches (halving each time) are created alongside the "
+             "staging, if it fails the longest successful prefix is merged."
+    )
 
     secret = fields.Char(
         help="Webhook secret. If set, will be checked against the signature "
@@ -46,31 +53,62 @@ class Project(models.Model):
     freeze_reminder = fields.Text()
 
     def _check_stagings(self, commit=False):
-        for branch in self.search([]).mapped('branch_ids').filtered('active'):
-            staging = branch.active_staging_id
-            if not staging:
-                continue
+        # only stagings which have reached a final state or timed out need to
+        # be checked, state changes of stagings trigger this
+        self.env.cr.execute("""
+        SELECT s.id
+        FROM runbot_merge_stagings s
+        JOIN runbot_merge_branch b ON b.id = s.target
+        JOIN runbot_merge_project p ON p.id = b.project_id
+        WHERE s.active
+          AND s.parent_id IS NULL
+          AND b.active
+          AND (s.state != 'pending' OR s.timeout_limit < (now() at time zone 'utc'))
+        ORDER BY p.id, b.sequence, b.name
+        """)
+        for staging in self.env['runbot_merge.stagings'].browse(id_ for [id_] in self.env.cr.fetchall()):
             try:
                 with self.env.cr.savepoint():
                     staging.check_status()
             except Exception:
                 _logger.exception("Failed to check staging for branch %r (staging %s)",
-                                  branch.name, staging)
+                                  staging.target.name, staging)
             else:
                 if commit:
                     self.env.cr.commit()
 
-    def _create_stagings(self, commit=False):
-        for branch in self.search([]).mapped('branch_ids').filtered('active'):
-            if not branch.active_staging_id:
+    def _create_stagings(self, commit=False, sweep=False):
+        """ Tries to create stagings on the branches which were flagged as
+        possibly stageable, or on all the branches during a ``sweep``.
+        """
+        branches = self.search([]).mapped('branch_ids').filtered('active')
+        if not sweep:
+            branches = branches.filtered('staging_check')
+        for branch in branches:
+            if branch.active_staging_id:
+                # the deactivation of the staging flags the branch again
+                branch.staging_check = False
+            else:
                 try:
                     with self.env.cr.savepoint():
                         branch.try_staging()
+                        # only unflag once checked, so a failure gets retried
+                        branch.staging_check = False
                 except Exception:
                     _logger.exception("Failed to create staging for branch %r", branch.name)
-                else:
-                    if commit:
-                        self.env.cr.commit()
+            if commit:
+                self.env.cr.commit()
+
+    def _speculative_sizes(self, batches):
+        """ Sizes of the speculative prefixes to stage for a staging of
+        ``batches`` batches, largest first.
+        """
+        sizes = []
+        size = batches // 2
+        while size and len(sizes) < self.staging_concurrency - 1:
+            sizes.append(size)
+            size //= 2
+        return sizes
 
     def _find_commands(self, comment):
         return re.findall(
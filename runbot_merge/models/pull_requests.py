@@ -5,6 +5,7 @@ import base64
 import collections
 import contextlib
 import datetime
+import functools
 import io
 import itertools
 import json
@@ -13,10 +14,12 @@ import os
 import pprint
 import re
 import time
+import zlib
 
 from difflib import Differ
 from itertools import takewhile
 
+import psycopg2.extras
 import requests
 import werkzeug
 from werkzeug.datastructures import Headers
@@ -214,6 +217,152 @@ All substitutions are tentatively applied sequentially to the input.
                 ('number', '=', number),
             ]).state = 'closed'
 
+    def _resync(self, numbers=None):
+        """ Bulk version of :meth:`_load_pr`: fetches the open PRs of the
+        repository (or only ``numbers`` amongst them) along with their
+        statuses, comments and reviews by pages, computes the resulting state
+        of each PR directly and applies it, rather than replaying every event
+        through the webhook handlers.
+
+        :returns: the requested ``numbers`` which were not found open (or
+                  without ``numbers`` the known open PRs which were not
+                  found), for the caller to load them individually
+        """
+        gh = self.github()
+        project = self.project_id
+        wanted = None if numbers is None else set(numbers)
+        prs = [
+            pr for pr in gh.prs()
+            if wanted is None or pr['number'] in wanted
+            if project._has_branch(pr['base']['ref'])
+        ]
+        PRs = self.env['runbot_merge.pull_requests']
+        listed = {pr['number'] for pr in prs}
+        if wanted is None:
+            # known PRs not listed were closed or retargeted to an un-managed
+            # branch, they have to be loaded individually
+            missing = PRs.search([
+                ('repository', '=', self.id),
+                ('number', 'not in', list(listed)),
+                ('state', 'not in', ('closed', 'merged')),
+            ]).mapped('number')
+        else:
+            missing = sorted(wanted - listed)
+        if not prs:
+            return missing
+        _logger.info("Resynchronising %d PRs of %s", len(prs), self.name)
+
+        # statuses of all the heads, stored in a single upsert
+        statuses = github.concurrently(
+            functools.partial(gh.statuses, pr['head']['sha'])
+            for pr in prs
+        )
+        rows = {}
+        for st in itertools.chain.from_iterable(statuses):
+            rows.setdefault(st['sha'], {})[st['context']] = {
+                'state': st['state'],
+                'target_url': st['target_url'],
+                'description': st['description'],
+            }
+        if rows:
+            psycopg2.extras.execute_values(self.env.cr._obj, """
+                INSERT INTO runbot_merge_commit AS c (sha, to_check, statuses)
+                VALUES %s
+                ON CONFLICT (sha) DO UPDATE
+                    SET to_check = true,
+                        statuses = c.statuses::jsonb || EXCLUDED.statuses::jsonb
+                    WHERE NOT c.statuses::jsonb @> EXCLUDED.statuses::jsonb
+            """, [(sha, True, json.dumps(st)) for sha, st in rows.items()])
+            self.env.ref('runbot_merge.process_updated_commits')._trigger()
+
+        numbers = {pr['number'] for pr in prs}
+        existing = {
+            p.number: p
+            for p in PRs.search([('repository', '=', self.id), ('number', 'in', list(numbers))])
+        }
+        # the commands of known PRs have already been seen, comments and
+        # reviews are only needed for the new PRs: comments for the whole
+        # repository by pages since the oldest new PR was created, reviews
+        # per PR
+        new_prs = [pr for pr in prs if pr['number'] not in existing]
+        counter = itertools.count()
+        items = collections.defaultdict(list)
+        if new_prs:
+            new_numbers = {pr['number'] for pr in new_prs}
+            for comment in gh.repo_comments(since=min(pr['created_at'] for pr in new_prs)):
+                number = int(comment['issue_url'].rsplit('/', 1)[1])
+                if number in new_numbers:
+                    items[number].append((comment['created_at'], next(counter), comment))
+        reviews = github.concurrently(
+            functools.partial(lambda n: list(gh.reviews(n)), pr['number'])
+            for pr in new_prs
+        )
+        for pr, revs in zip(new_prs, reviews):
+            items[pr['number']].extend(
+                (review['submitted_at'], next(counter), review)
+                for review in revs
+            )
+
+        # the listing lacks the commits count, fetch the full description of
+        # new PRs and of those whose head, target or state changed
+        details = [
+            pr['number'] for pr in prs
+            if pr['number'] not in existing
+            or existing[pr['number']].head != pr['head']['sha']
+            or existing[pr['number']].target.name != pr['base']['ref']
+            or existing[pr['number']].state == 'closed'
+        ]
+        details = dict(zip(details, github.concurrently(
+            functools.partial(lambda n: gh('get', f'pulls/{n}').json(), n)
+            for n in details
+        )))
+        updates = collections.defaultdict(lambda: PRs)
+        for pr in prs:
+            pr = details.get(pr['number'], pr)
+            pr_id = existing.get(pr['number'])
+            if pr_id:
+                # commands of known PRs have already been seen, only sync
+                # their attributes
+                self._resync_pr(pr_id, pr)
+                continue
+
+            pr_id = PRs._from_gh(pr, repo=self)
+            vals = pr_id._resync_commands(
+                comment for _, _, comment in sorted(items[pr['number']])
+            )
+            if vals:
+                updates[tuple(sorted(vals.items()))] |= pr_id
+        # set-based application of the computed states
+        for vals, pr_ids in updates.items():
+            pr_ids.write(dict(vals))
+
+        return missing
+
+    def _resync_pr(self, pr_id, pr):
+        """ Synchronises the known ``pr_id`` with its github description
+        ``pr``, through the webhook handlers so the PR gets unstaged and its
+        approval reset the same way.
+        """
+        event = {
+            'pull_request': pr,
+            'sender': {'login': self.project_id.github_prefix},
+        }
+        if pr_id.state == 'closed':
+            controllers.handle_pr(self.env, {**event, 'action': 'reopened'})
+        if pr_id.target.name != pr['base']['ref'] or pr_id.message != utils.make_message(pr):
+            controllers.handle_pr(self.env, {
+                **event,
+                'action': 'edited',
+                'changes': {'base': {'ref': {'from': pr_id.target.name}}},
+            })
+        if pr_id.head != pr['head']['sha']:
+            controllers.handle_pr(self.env, {**event, 'action': 'synchronize'})
+        if pr_id.draft != pr['draft']:
+            controllers.handle_pr(self.env, {
+                **event,
+                'action': 'converted_to_draft' if pr['draft'] else 'ready_for_review',
+            })
+
     def having_branch(self, branch):
         branches = self.env['runbot_merge.branch'].search
         return self.filtered(lambda r: branch in branches(ast.literal_eval(r.branch_filter)))
@@ -252,13 +401,39 @@ class Branch(models.Model):
     active = fields.Boolean(default=True)
     sequence = fields.Integer(group_operator=None)
 
+    staging_check = fields.Boolean(
+        default=True,
+        help="Something changed on the branch which might allow creating a"
+             " staging, it needs to be checked"
+    )
+
     def _auto_init(self):
         res = super(Branch, self)._auto_init()
         tools.create_unique_index(
             self._cr, 'runbot_merge_unique_branch_per_repo',
             self._table, ['name', 'project_id'])
+        self._cr.execute("""
+            CREATE INDEX IF NOT EXISTS runbot_merge_branch_staging_check
+            ON runbot_merge_branch ((1)) WHERE staging_check
+        """)
         return res
 
+    def _schedule_staging(self):
+        """ Flags the branches for checking by the staging cron, and triggers
+        it.
+        """
+        if not self:
+            return
+        # only update unflagged branches so concurrent events don't
+        # conflict on the branch rows
+        self.env.cr.execute("""
+            UPDATE runbot_merge_branch
+            SET staging_check = true
+            WHERE id = any(%s) AND NOT staging_check
+        """, [self.ids])
+        self.invalidate_recordset(['staging_check'])
+        self.env.ref('runbot_merge.staging_cron')._trigger()
+
     @api.depends('active')
     def _compute_display_name(self):
         super()._compute_display_name()
@@ -267,6 +442,8 @@ class Branch(models.Model):
 
     def write(self, vals):
         super().write(vals)
+        if vals.get('active'):
+            self._schedule_staging()
         if vals.get('active') is False:
             self.active_staging_id.cancel(
                 "Target branch deactivated by %r.",
@@ -279,10 +456,11 @@ class Branch(models.Model):
             } for pr in self.prs])
         return True
 
-    @api.depends('staging_ids.active')
+    @api.depends('staging_ids.active', 'staging_ids.parent_id')
     def _compute_active_staging(self):
         for b in self:
-            b.active_staging_id = b.with_context(active_test=True).staging_ids
+            b.active_staging_id = b.with_context(active_test=True).staging_ids\
+                .filtered(lambda s: not s.parent_id)
 
     def _ready(self):
         self.env.cr.execute("""
@@ -295,13 +473,7 @@ class Branch(models.Model):
           -- deleting branches & reusing labels)
           AND pr.state != 'merged'
           AND pr.state != 'closed'
-        GROUP BY
-            pr.target,
-            CASE
-                WHEN pr.label SIMILAR TO '%%:patch-[[:digit:]]+'
-                    THEN pr.id::text
-                ELSE pr.label
-            END
+        GROUP BY pr.target, pr.batch_key
         HAVING
             bool_or(pr.state = 'ready') or bool_or(pr.priority = 0)
         ORDER BY min(pr.priority), min(pr.id)
@@ -354,20 +526,26 @@ class Branch(models.Model):
         Batch = self.env['runbot_merge.batch']
         staged = Batch
         original_heads = {}
-        meta = {repo: {} for repo in self.project_id.repo_ids.having_branch(self)}
-        for repo, it in meta.items():
-            gh = it['gh'] = repo.github()
-            it['head'] = original_heads[repo] = gh.head(self.name)
+        meta = {repo: {'gh': repo.github()} for repo in self.project_id.repo_ids.having_branch(self)}
+        def reset_tmp(gh):
+            head = gh.head(self.name)
             # create tmp staging branch
-            gh.set_ref('tmp.{}'.format(self.name), it['head'])
+            gh.set_ref('tmp.{}'.format(self.name), head)
+            return head
+        heads = github.concurrently(
+            functools.partial(reset_tmp, it['gh']) for it in meta.values())
+        for (repo, it), head in zip(meta.items(), heads):
+            it['head'] = original_heads[repo] = head
 
         batch_limit = self.project_id.batch_limit
         first = True
+        # heads of each repo after each successfully staged batch
+        staged_heads = []
         for batch in batched_prs:
             if len(staged) >= batch_limit:
                 break
             try:
-                staged |= Batch.stage(meta, batch)
+                b = Batch.stage(meta, batch)
             except exceptions.MergeError as e:
                 pr = e.args[0]
                 _logger.exception("Failed to merge %s into staging branch", pr.display_name)
@@ -390,13 +568,41 @@ class Branch(models.Model):
                     })
             else:
                 first = False
+                if b:
+                    staged |= b
+                    staged_heads.append({repo: it['head'] for repo, it in meta.items()})
 
         if not staged:
             return
 
+        st = self._create_staging(meta, staged, staged_heads[-1], original_heads)
+        # speculatively stage prefixes of the batches concurrently, if the
+        # staging fails the longest successful prefix gets merged instead of
+        # having to go through a full CI cycle per split
+        for size in self.project_id._speculative_sizes(len(staged)):
+            self._create_staging(
+                meta, staged[:size], staged_heads[size-1], original_heads,
+                parent=st,
+            )
+
+        logger.info("Created staging %s (%s) to %s", st, ', '.join(
+            '%s[%s]' % (batch, batch.prs)
+            for batch in staged
+        ), st.target.name)
+        return st
+
+    def _create_staging(self, meta, batches, repo_heads, original_heads, parent=None):
+        """ Creates a staging of ``batches`` at ``repo_heads``, and the
+        corresponding staging branches.
+
+        If ``parent`` is provided, the staging is a speculative staging of a
+        prefix of the parent's batches, its batches remain attached to the
+        parent staging until it gets promoted.
+        """
         heads = {}
         for repo, it in meta.items():
-            tree = it['gh'].commit(it['head'])['tree']
+            head = repo_heads[repo]
+            tree = it['gh'].commit(head)['tree']
             # ensures staging branches are unique and always
             # rebuilt
             r = base64.b64encode(os.urandom(12)).decode('ascii')
@@ -407,23 +613,24 @@ class Branch(models.Model):
                     for repo, h in heads.items()
                     if not repo.endswith('^')
                 )
-            dummy_head = {'sha': it['head']}
-            if it['head'] == original_heads[repo]:
+            dummy_head = {'sha': head}
+            if parent or head == original_heads[repo]:
                 # if the repo has not been updated by the staging, create a
-                # dummy commit to force rebuild
+                # dummy commit to force rebuild, speculative stagings always
+                # need their own commits so they don't share statuses
                 dummy_head = it['gh']('post', 'git/commits', json={
                     'message': '''force rebuild
 
 uniquifier: %s
 For-Commit-Id: %s
-%s''' % (r, it['head'], trailer),
+%s''' % (r, head, trailer),
                     'tree': tree['sha'],
-                    'parents': [it['head']],
+                    'parents': [head],
                 }).json()
 
             # $repo is the head to check, $repo^ is the head to merge (they
             # might be the same)
-            heads[repo.name + '^'] = it['head']
+            heads[repo.name + '^'] = head
             heads[repo.name] = dummy_head['sha']
             self.env.cr.execute(
                 "INSERT INTO runbot_merge_commit (sha, to_check, statuses) "
@@ -433,11 +640,17 @@ For-Commit-Id: %s
             )
 
         # create actual staging object
-        st = self.env['runbot_merge.stagings'].create({
+        vals = {
             'target': self.id,
-            'batch_ids': [(4, batch.id, 0) for batch in staged],
             'heads': json.dumps(heads)
-        })
+        }
+        refname = 'staging.{}'.format(self.name)
+        if parent:
+            vals.update(parent_id=parent.id, prefix_size=len(batches))
+            refname += '.{}'.format(len(batches))
+        else:
+            vals['batch_ids'] = [(4, batch.id, 0) for batch in batches]
+        st = self.env['runbot_merge.stagings'].create(vals)
         # create staging branch from tmp
         token = self.project_id.github_token
         for r in self.project_id.repo_ids.having_branch(self):
@@ -448,7 +661,6 @@ For-Commit-Id: %s
                 self.project_id.name, r.name, self.name,
                 staging_head
             )
-            refname = 'staging.{}'.format(self.name)
             it['gh'].set_ref(refname, staging_head)
             # asserts that the new head is visible through the api
             head = it['gh'].head(refname)
@@ -475,10 +687,6 @@ For-Commit-Id: %s
                 )
                 raise TimeoutError("Staged head not updated after %d seconds" % sum(WAIT_FOR_VISIBILITY))
 
-        logger.info("Created staging %s (%s) to %s", st, ', '.join(
-            '%s[%s]' % (batch, batch.prs)
-            for batch in staged
-        ), st.target.name)
         return st
 
     def _check_visibility(self, repo, branch_name, expected_head, token):
@@ -499,6 +707,12 @@ For-Commit-Id: %s
             return False
 
 ACL = collections.namedtuple('ACL', 'is_admin is_reviewer is_author')
+# PR fields whose update may make the target branch stageable
+STAGING_FIELDS = {'state', 'priority', 'squash', 'merge_method', 'target', 'label', 'draft', 'overrides'}
+# fields impacting the linked PRs and merge method warnings
+LINK_CHECK_FIELDS = {'state', 'priority', 'label', 'target', 'squash', 'merge_method'}
+# github's default branches for web edits, PRs on them are never linked
+PATCH_LABEL = re.compile(r'.*:patch-[0-9]+')
 class PullRequests(models.Model):
     _name = _description = 'runbot_merge.pull_requests'
     _order = 'number desc'
@@ -563,6 +777,15 @@ class PullRequests(models.Model):
         default=False, help="Whether we've already warned that this (ready)"
                             " PR is linked to an other non-ready PR"
     )
+    batch_key = fields.Char(
+        compute='_compute_batch_key', store=True, index=True,
+        help="Key grouping linked PRs of a target: the label, except for "
+             "github's patch-N branches which are never linked"
+    )
+    link_check = fields.Boolean(
+        default=True, help="Whether the PR changed since the last linked PRs "
+                           "and merge method check"
+    )
 
     blocked = fields.Char(
         compute='_compute_is_blocked',
@@ -988,6 +1211,90 @@ class PullRequests(models.Model):
             msg.append('ignored ' + ignoredstr)
         return '\n'.join(msg)
 
+    def _resync_commands(self, comments):
+        """ Computes the state resulting from the commands in ``comments``
+        (issue comments and reviews, in chronological order) on a freshly
+        loaded PR without applying them or sending feedback: only approval,
+        delegation, priority, merge method and overrides are considered.
+
+        :returns: the values to write on the PR
+        """
+        comments = list(comments)
+        logins = {c['user']['login'] for c in comments}
+        partners = {
+            p.github_login: p
+            for p in self.env['res.partner'].search([('github_login', 'in', list(logins))])
+        }
+        acls = {}
+        project = self.repository.project_id
+        method_labels = dict(type(self).merge_method.selection)
+
+        reviewed_by = None
+        priority = self.priority
+        merge_method = self.merge_method
+        overrides = json.loads(self.overrides)
+        delegates = self.env['res.partner']
+        for comment in comments:
+            author = partners.get(comment['user']['login'])
+            if not author:
+                continue
+            acl = acls.get(author)
+            if acl is None:
+                acl = acls[author] = self._pr_acl(author)
+            is_admin = acl.is_admin
+            # delegations are only applied once all the commands are processed
+            is_reviewer = acl.is_reviewer or author in delegates
+            is_author = is_reviewer or acl.is_author
+            for command, param in (
+                ps
+                for m in project._find_commands(comment['body'] or '')
+                for ps in self._parse_command(m)
+            ):
+                if command == 'review':
+                    if param and is_reviewer and not self.draft and author.email:
+                        reviewed_by = author
+                    elif not param and is_author:
+                        reviewed_by = None
+                        if priority == 0:
+                            priority = 1
+                elif command == 'delegate' and is_reviewer:
+                    if param is True:
+                        delegates |= self.author
+                    else:
+                        delegates |= partners.get(param) or self.env['res.partner'].search([
+                            ('github_login', '=', param)
+                        ]) or self.env['res.partner'].create({
+                            'name': param,
+                            'github_login': param,
+                        })
+                elif command == 'priority' and is_admin:
+                    priority = param
+                elif command == 'method' and is_reviewer and param in method_labels:
+                    merge_method = param
+                elif command == 'override':
+                    overridable = author.override_rights\
+                        .filtered(lambda r: not r.repository_id or (r.repository_id == self.repository))\
+                        .mapped('context')
+                    if param in overridable:
+                        overrides[param] = {
+                            'state': 'success',
+                            'target_url': comment['html_url'],
+                            'description': f"Overridden by @{author.github_login}",
+                        }
+
+        if delegates:
+            delegates.write({'delegate_reviewer': [(4, self.id, 0)]})
+        vals = {}
+        if reviewed_by and RPLUS.get(self.state):
+            vals.update(state=RPLUS[self.state], reviewed_by=reviewed_by.id)
+        if priority != self.priority:
+            vals['priority'] = priority
+        if merge_method != self.merge_method:
+            vals['merge_method'] = merge_method
+        if overrides != json.loads(self.overrides):
+            vals['overrides'] = json.dumps(overrides)
+        return vals
+
     def _pr_acl(self, user):
         if not self:
             return ACL(False, False, False)
@@ -1039,14 +1346,20 @@ class PullRequests(models.Model):
             self._notify_ci_failed(ci)
 
     def _notify_merged(self, gh, payload):
-        deployment = gh('POST', 'deployments', json={
+        self._merge_notification(gh, payload)()
+
+    def _merge_notification(self, gh, payload):
+        """ Returns a callable creating the merge deployment of the PR, which
+        does not need the ORM (and can thus be called concurrently).
+        """
+        deployment_data = {
             'ref': self.head, 'environment': 'merge',
             'description': "Merge %s into %s" % (self.display_name, self.target.name),
             'task': 'merge',
             'auto_merge': False,
             'required_contexts': [],
-        }).json()
-        gh('POST', 'deployments/{}/statuses'.format(deployment['id']), json={
+        }
+        status_data = {
             'state': 'success',
             'target_url': 'https://github.com/{}/commit/{}'.format(
                 self.repository.name,
@@ -1055,7 +1368,11 @@ class PullRequests(models.Model):
             'description': "Merged %s in %s at %s" % (
                 self.display_name, self.target.name, payload['sha']
             )
-        })
+        }
+        def notify():
+            deployment = gh('POST', 'deployments', json=deployment_data).json()
+            gh('POST', 'deployments/{}/statuses'.format(deployment['id']), json=status_data)
+        return notify
 
     def _statuses_equivalent(self, a, b):
         """ Check if two statuses are *equivalent* meaning the description field
@@ -1085,6 +1402,20 @@ class PullRequests(models.Model):
         self._cr.execute("CREATE INDEX IF NOT EXISTS runbot_merge_pr_head "
                          "ON runbot_merge_pull_requests "
                          "USING hash (head)")
+        self._cr.execute("CREATE INDEX IF NOT EXISTS runbot_merge_pr_batch "
+                         "ON runbot_merge_pull_requests (target, batch_key) "
+                         "WHERE state != 'merged' AND state != 'closed'")
+        self._cr.execute("CREATE INDEX IF NOT EXISTS runbot_merge_pr_link_check "
+                         "ON runbot_merge_pull_requests ((1)) "
+                         "WHERE link_check")
+
+    @api.depends('label')
+    def _compute_batch_key(self):
+        for pr in self:
+            if pr.id and PATCH_LABEL.fullmatch(pr.label or ''):
+                pr.batch_key = str(pr.id)
+            else:
+                pr.batch_key = pr.label
 
     @property
     def _tagstate(self):
@@ -1097,6 +1428,7 @@ class PullRequests(models.Model):
         pr = super().create(vals)
         c = self.env['runbot_merge.commit'].search([('sha', '=', pr.head)])
         pr._validate(json.loads(c.statuses or '{}'))
+        pr.target._schedule_staging()
 
         if pr.state not in ('closed', 'merged'):
             self.env['runbot_merge.pull_requests.feedback'].create({
@@ -1144,6 +1476,9 @@ class PullRequests(models.Model):
                 for pr in self
             }
 
+        schedule = self.target if STAGING_FIELDS.intersection(vals) else self.target.browse()
+        if LINK_CHECK_FIELDS.intersection(vals):
+            vals['link_check'] = True
         w = super().write(vals)
 
         newhead = vals.get('head')
@@ -1151,6 +1486,9 @@ class PullRequests(models.Model):
             c = self.env['runbot_merge.commit'].search([('sha', '=', newhead)])
             self._validate(json.loads(c.statuses or '{}'))
 
+        if schedule:
+            (schedule | self.target)._schedule_staging()
+
         if prev:
             for pr in self:
                 old_target = prev[pr.id]['target']
@@ -1168,26 +1506,38 @@ class PullRequests(models.Model):
         """ Looks for linked PRs where at least one of the PRs is in a ready
         state and the others are not, notifies the other PRs.
 
-        :param bool commit: whether to commit the tnx after each comment
+        Only the batches of PRs which changed since the previous check are
+        examined.
+
+        :param bool commit: whether to commit the tnx once the warnings have
+                            been created
         """
+        self.env.cr.execute("""
+        SELECT id FROM runbot_merge_pull_requests
+        WHERE link_check
+        FOR UPDATE SKIP LOCKED
+        """)
+        changed = [id_ for [id_] in self.env.cr.fetchall()]
+        if not changed:
+            return
+
         # similar to Branch.try_staging's query as it's a subset of that
         # other query's behaviour
         self.env.cr.execute("""
         SELECT
           array_agg(pr.id) AS match
         FROM runbot_merge_pull_requests pr
+        JOIN (
+            SELECT DISTINCT target, batch_key
+            FROM runbot_merge_pull_requests
+            WHERE id = any(%s)
+        ) changed USING (target, batch_key)
         WHERE
           -- exclude terminal states (so there's no issue when
           -- deleting branches & reusing labels)
               pr.state != 'merged'
           AND pr.state != 'closed'
-        GROUP BY
-            pr.target,
-            CASE
-                WHEN pr.label SIMILAR TO '%%:patch-[[:digit:]]+'
-                    THEN pr.id::text
-                ELSE pr.label
-            END
+        GROUP BY pr.target, pr.batch_key
         HAVING
           -- one of the batch's PRs should be ready & not marked
               bool_or(pr.state = 'ready' AND NOT pr.link_warned)
@@ -1195,14 +1545,18 @@ class PullRequests(models.Model):
           AND bool_or(pr.state != 'ready')
           -- but ignore batches with one of the prs at p0
           AND bool_and(pr.priority != 0)
-        """)
-        for [ids] in self.env.cr.fetchall():
-            prs = self.browse(ids)
+        """, [changed])
+        batches = [self.browse(ids) for [ids] in self.env.cr.fetchall()]
+        # prefetch the whole lot at once
+        self.browse([id_ for prs in batches for id_ in prs.ids]).mapped('repository.name')
+
+        feedback = []
+        warned = self.browse()
+        for prs in batches:
             ready = prs.filtered(lambda p: p.state == 'ready')
             unready = (prs - ready).sorted(key=lambda p: (p.repository.name, p.number))
-
             for r in ready:
-                self.env['runbot_merge.pull_requests.feedback'].create({
+                feedback.append({
                     'repository': r.repository.id,
                     'pull_request': r.number,
                     'message': "{}linked pull request(s) {} not ready. Linked PRs are not staged until all of them are ready.".format(
@@ -1210,9 +1564,8 @@ class PullRequests(models.Model):
                         ', '.join(map('{0.display_name}'.format, unready))
                     )
                 })
-                r.link_warned = True
-                if commit:
-                    self.env.cr.commit()
+            warned |= ready
+        warned.write({'link_warned': True})
 
         # send feedback for multi-commit PRs without a merge_method (which
         # we've not warned yet)
@@ -1221,23 +1574,32 @@ class PullRequests(models.Model):
             for pair in type(self).merge_method.selection
             if pair[0] != 'squash'
         )
-        for r in self.search([
+        unmethodical = self.search([
+            ('id', 'in', changed),
             ('state', '=', 'ready'),
             ('squash', '=', False),
             ('merge_method', '=', False),
             ('method_warned', '=', False),
-        ]):
-            self.env['runbot_merge.pull_requests.feedback'].create({
-                'repository': r.repository.id,
-                'pull_request': r.number,
-                'message': "%sbecause this PR has multiple commits, I need to know how to merge it:\n\n%s" % (
-                    r.ping(),
-                    methods,
-                )
-            })
-            r.method_warned = True
-            if commit:
-                self.env.cr.commit()
+        ])
+        feedback.extend({
+            'repository': r.repository.id,
+            'pull_request': r.number,
+            'message': "%sbecause this PR has multiple commits, I need to know how to merge it:\n\n%s" % (
+                r.ping(),
+                methods,
+            )
+        } for r in unmethodical)
+        unmethodical.write({'method_warned': True})
+
+        self.env['runbot_merge.pull_requests.feedback'].create(feedback)
+        self.env.cr.execute("""
+        UPDATE runbot_merge_pull_requests
+        SET link_check = false
+        WHERE id = any(%s)
+        """, [changed])
+        self.invalidate_model(['link_check'])
+        if commit:
+            self.env.cr.commit()
 
     def _parse_commit_message(self, message):
         """ Parses a commit message to split out the pseudo-headers (which
@@ -1540,6 +1902,9 @@ class Tagging(models.Model):
     tags_remove = fields.Char(required=True, default='[]')
     tags_add = fields.Char(required=True, default='[]')
 
+    attempts = fields.Integer(default=0, group_operator=None)
+    retry_after = fields.Datetime(required=True, default='1900-01-01 01:01:01', index=True)
+
     def create(self, values):
         if values.pop('state_from', None):
             values['tags_remove'] = ALL_TAGS
@@ -1552,20 +1917,24 @@ class Tagging(models.Model):
         return super().create(values)
 
     def _send(self):
+        # fold all the pending changes of each PR (even those waiting for a
+        # retry) so each PR gets a single labels replacement
         # noinspection SqlResolve
         self.env.cr.execute("""
         SELECT
             t.repository as repo_id,
             t.pull_request as pr_number,
-            array_agg(t.id) as ids,
-            array_agg(t.tags_remove::json) as to_remove,
-            array_agg(t.tags_add::json) as to_add
+            array_agg(t.id ORDER BY t.id) as ids,
+            array_agg(t.tags_remove::json ORDER BY t.id) as to_remove,
+            array_agg(t.tags_add::json ORDER BY t.id) as to_add
         FROM runbot_merge_pull_requests_tagging t
         GROUP BY t.repository, t.pull_request
+        HAVING bool_and(t.retry_after <= (now() at time zone 'utc'))
         """)
         Repos = self.env['runbot_merge.repository']
         ghs = {}
-        to_remove = []
+        groups = []
+        calls = []
         for repo_id, pr, ids, remove, add in self.env.cr.fetchall():
             repo = Repos.browse(repo_id)
 
@@ -1583,16 +1952,57 @@ class Tagging(models.Model):
                 tags_add.difference_update(minus)
                 tags_add.update(plus)
 
-            try:
-                gh.change_tags(pr, tags_remove, tags_add)
-            except Exception:
-                _logger.exception(
-                    "Error while trying to change the tags of %s#%s from %s to %s",
-                    repo.name, pr, remove, add,
-                )
+            groups.append(self.browse(ids))
+            calls.append(_catching(
+                functools.partial(gh.change_tags, pr, tags_remove, tags_add),
+                "Error while trying to change the tags of %s#%s from %s to %s",
+                repo.name, pr, remove, add,
+            ))
+
+        to_remove = self.browse()
+        for tags, ok in zip(groups, github.concurrently(calls)):
+            if ok:
+                to_remove |= tags
             else:
-                to_remove.extend(ids)
-        self.browse(to_remove).unlink()
+                tags._retry_later()
+        to_remove.unlink()
+
+    def _retry_later(self):
+        _retry_later(self)
+
+def _catching(call, message, *args):
+    """ Wraps ``call`` so it returns whether it succeeded, logging the
+    failure with ``message`` (formatted with ``args``).
+    """
+    def wrapper():
+        try:
+            call()
+        except Exception:
+            _logger.exception(message, *args)
+            return False
+        return True
+    return wrapper
+
+# number of failures after which queued github calls are dropped
+MAX_ATTEMPTS = 10
+def _retry_later(records):
+    """ Pushes back the next attempt of failed ``records`` (of a queue
+    model with ``attempts`` and ``retry_after`` fields) with an exponential
+    backoff, or drops them after too many failures.
+    """
+    now = datetime.datetime.now()
+    for r in records:
+        if r.attempts + 1 >= MAX_ATTEMPTS:
+            _logger.error("Dropping %s after %d failures", r, r.attempts + 1)
+            r.unlink()
+            continue
+        r.write({
+            'attempts': r.attempts + 1,
+            'retry_after': now + min(
+                datetime.timedelta(minutes=2 ** r.attempts),
+                datetime.timedelta(days=1),
+            ),
+        })
 
 class Feedback(models.Model):
     """ Queue of feedback comments to send to PR users
@@ -1612,47 +2022,102 @@ class Feedback(models.Model):
         help="Token field (from repo's project) to use to post messages"
     )
 
+    attempts = fields.Integer(default=0, group_operator=None)
+    retry_after = fields.Datetime(required=True, default='1900-01-01 01:01:01', index=True)
+
     def _send(self):
+        """ Sends the pending feedback, the feedback of different PRs is sent
+        concurrently, the feedback of each PR is sent in order and stops at
+        the first failure (the rest of the PR's feedback is sent on the
+        next run).
+        """
         ghs = {}
-        to_remove = []
-        for f in self.search([]):
+        per_pr = collections.defaultdict(list)
+        now = fields.Datetime.now()
+        for f in self.search([], order='id'):
+            key = (f.repository, f.pull_request)
+            # don't skip ahead of a failed feedback of the same PR
+            if f.retry_after > now or (per_pr[key] and per_pr[key][-1] is None):
+                per_pr[key].append(None)
+                continue
+
             repo = f.repository
             gh = ghs.get((repo, f.token_field))
             if not gh:
                 gh = ghs[(repo, f.token_field)] = repo.github(f.token_field)
 
             try:
-                message = f.message
-                with contextlib.suppress(json.JSONDecodeError):
-                    data = json.loads(message or '')
-                    message = data.get('message')
-
-                    if data.get('base'):
-                        gh('PATCH', f'pulls/{f.pull_request}', json={'base': data['base']})
-
-                    if f.close:
-                        pr_to_notify = self.env['runbot_merge.pull_requests'].search([
-                            ('repository', '=', repo.id),
-                            ('number', '=', f.pull_request),
-                        ])
-                        if pr_to_notify:
-                            pr_to_notify._notify_merged(gh, data)
-
-                if f.close:
-                    gh.close(f.pull_request)
-
-                if message:
-                    gh.comment(f.pull_request, message)
+                call = f._prepare_send(gh)
             except Exception:
-                _logger.exception(
-                    "Error while trying to %s %s#%s (%s)",
-                    'close' if f.close else 'send a comment to',
-                    repo.name, f.pull_request,
-                    utils.shorten(f.message, 200)
-                )
-            else:
-                to_remove.append(f.id)
-        self.browse(to_remove).unlink()
+                _logger.exception("Error while preparing feedback %s", f)
+                per_pr[key].append(None)
+                f._retry_later()
+                continue
+            per_pr[key].append((f, _catching(
+                call,
+                "Error while trying to %s %s#%s (%s)",
+                'close' if f.close else 'send a comment to',
+                repo.name, f.pull_request,
+                utils.shorten(f.message, 200)
+            )))
+
+        def send(items):
+            done = []
+            for item in items:
+                if item is None:
+                    break
+                f, call = item
+                if not call():
+                    return done, f
+                done.append(f)
+            return done, None
+
+        to_remove = self.browse()
+        for done, failed in github.concurrently(
+                functools.partial(send, items)
+                for items in per_pr.values()
+                if items[0] is not None
+        ):
+            to_remove = to_remove.union(*done)
+            if failed:
+                failed._retry_later()
+        to_remove.unlink()
+
+    def _prepare_send(self, gh):
+        """ Returns a callable performing the github calls of the feedback,
+        everything requiring the ORM is done beforehand.
+        """
+        calls = []
+        message = self.message
+        with contextlib.suppress(json.JSONDecodeError):
+            data = json.loads(message or '')
+            message = data.get('message')
+
+            if data.get('base'):
+                calls.append(functools.partial(
+                    gh, 'PATCH', f'pulls/{self.pull_request}', json={'base': data['base']}))
+
+            if self.close:
+                pr_to_notify = self.env['runbot_merge.pull_requests'].search([
+                    ('repository', '=', self.repository.id),
+                    ('number', '=', self.pull_request),
+                ])
+                if pr_to_notify:
+                    calls.append(pr_to_notify._merge_notification(gh, data))
+
+        if self.close:
+            calls.append(functools.partial(gh.close, self.pull_request))
+
+        if message:
+            calls.append(functools.partial(gh.comment, self.pull_request, message))
+
+        def send():
+            for call in calls:
+                call()
+        return send
+
+    def _retry_later(self):
+        _retry_later(self)
 
 class Commit(models.Model):
     """Represents a commit onto which statuses might be posted,
@@ -1668,11 +2133,14 @@ class Commit(models.Model):
     def create(self, values):
         values['to_check'] = True
         r = super(Commit, self).create(values)
+        self.env.ref('runbot_merge.process_updated_commits')._trigger()
         return r
 
     def write(self, values):
         values.setdefault('to_check', True)
         r = super(Commit, self).write(values)
+        if values['to_check']:
+            self.env.ref('runbot_merge.process_updated_commits')._trigger()
         return r
 
     def _notify(self):
@@ -1748,10 +2216,35 @@ class Stagings(models.Model):
     statuses = fields.Binary(compute='_compute_statuses')
     statuses_cache = fields.Text()
 
+    parent_id = fields.Many2one(
+        'runbot_merge.stagings', index=True,
+        help="Staging of which this is a speculative staging (of a prefix of"
+             " the batches)"
+    )
+    speculative_ids = fields.One2many(
+        'runbot_merge.stagings', 'parent_id',
+        context={'active_test': False},
+    )
+    prefix_size = fields.Integer(
+        group_operator=None,
+        help="Number of batches of the parent staging included in this"
+             " speculative staging"
+    )
+
     def write(self, vals):
         # don't allow updating the statuses_cache
         vals.pop('statuses_cache', None)
 
+        if vals.get('active') is False:
+            # once a staging is done, its speculative stagings are moot
+            self.speculative_ids.filtered('active').cancel(
+                "parent staging %s deactivated", self.ids,
+            )
+            # speculative (or promoted) stagings have their own refs
+            self.filtered(lambda s: s.active and s.prefix_size)._delete_refs()
+            # and the branch can be staged again
+            self.target._schedule_staging()
+
         if 'state' not in vals:
             return super().write(vals)
 
@@ -1762,6 +2255,8 @@ class Stagings(models.Model):
                 super(Stagings, staging).write({
                     'statuses_cache': json.dumps(staging.statuses)
                 })
+                if staging.active:
+                    self.env.ref('runbot_merge.merge_cron')._trigger()
 
         return True
 
@@ -2044,8 +2539,56 @@ class Stagings(models.Model):
                 self.batch_ids.write({'active': False})
                 self.write({'active': False})
         elif self.state == 'failure' or self.is_timed_out():
+            for speculative in self.speculative_ids.filtered('active').sorted('prefix_size', reverse=True):
+                if speculative.state == 'success':
+                    self._promote(speculative)
+                    return
+                if speculative.state == 'pending' and not speculative.is_timed_out():
+                    # a longer prefix may still succeed, wait for it
+                    logger.info("Staging %s failed, waiting on speculative staging %s", self, speculative)
+                    return
             self.try_splitting()
 
+    def _promote(self, speculative):
+        """ Replaces the failed staging by its (successful) ``speculative``
+        prefix: the prefix's batches get moved to the speculative staging
+        which is then merged, the rest is split off to be re-staged.
+        """
+        prefix = self.batch_ids[:speculative.prefix_size]
+        rest = self.batch_ids - prefix
+        _logger.info(
+            "Staging %s failed, promoting speculative staging %s (%s), splitting off %s",
+            self, speculative, prefix, rest,
+        )
+        if rest:
+            self.env['runbot_merge.split'].create({
+                'target': self.target.id,
+                'batch_ids': [(4, batch.id, 0) for batch in rest],
+            })
+            rest.write({'active': False})
+        prefix.write({'staging_id': speculative.id})
+        speculative.parent_id = False
+        self.write({
+            'active': False,
+            'state': 'failure',
+            'reason': "superseded by speculative staging %s" % speculative.id,
+        })
+        speculative.check_status()
+
+    def _delete_refs(self):
+        """ Removes the ``staging.<branch>.<size>`` refs of speculative
+        stagings, otherwise they would pile up in the repositories.
+        """
+        for staging in self:
+            refname = 'staging.{}.{}'.format(staging.target.name, staging.prefix_size)
+            for repo in staging.target.project_id.repo_ids.having_branch(staging.target):
+                r = repo.github()('delete', 'git/refs/heads/{}'.format(refname), check=False)
+                if r.status_code not in (204, 404, 422):
+                    _logger.warning(
+                        "Failed to delete %s of %s (%s): %s",
+                        refname, repo.name, r.status_code, r.text,
+                    )
+
     def is_timed_out(self):
         return fields.Datetime.from_string(self.timeout_limit) < datetime.datetime.now()
 
@@ -2074,11 +2617,13 @@ class Stagings(models.Model):
         repo_name = None
         tmp_target = 'tmp.' + self.target.name
         # first force-push the current targets to all tmps
-        for repo_name in staging_heads.keys():
-            if repo_name.endswith('^'):
-                continue
-            g = gh[repo_name]
+        def reset_tmp(g):
             g.set_ref(tmp_target, g.head(self.target.name))
+        github.concurrently(
+            functools.partial(reset_tmp, gh[repo_name])
+            for repo_name in staging_heads.keys()
+            if not repo_name.endswith('^')
+        )
         # then attempt to FF the tmp to the staging
         for repo_name, head in staging_heads.items():
             if repo_name.endswith('^'):
@@ -2241,6 +2786,10 @@ Please check and re-approve.
 
 UNCHECKABLE = ['merge_method', 'overrides', 'draft']
 
+# number of pending fetches of a repository above which it gets resynchronised
+# in bulk
+RESYNC_THRESHOLD = 20
+
 class FetchJob(models.Model):
     _name = _description = 'runbot_merge.fetch_job'
 
@@ -2252,6 +2801,27 @@ class FetchJob(models.Model):
         """
         :param bool commit: commit after each fetch has been executed
         """
+        # repositories with lots of PRs to fetch (e.g. after an outage) are
+        # resynchronised in bulk, the rest is loaded PR by PR
+        self.env.cr.execute("""
+            SELECT repository, array_agg(id)
+            FROM runbot_merge_fetch_job
+            WHERE active
+            GROUP BY repository
+            HAVING count(*) >= %s
+        """, [RESYNC_THRESHOLD])
+        for repo_id, ids in self.env.cr.fetchall():
+            jobs = self.browse(ids)
+            try:
+                with self.env.cr.savepoint():
+                    missing = jobs.repository._resync(set(jobs.mapped('number')))
+            except Exception:
+                _logger.exception("Failed to resync PRs of %s, loading them individually", jobs.repository.name)
+            else:
+                jobs.filtered(lambda j: j.number not in missing).active = False
+            if commit:
+                self.env.cr.commit()
+
         while True:
             f = self.search([], limit=1)
             if not f:
@@ -2270,6 +2840,124 @@ class FetchJob(models.Model):
             if commit:
                 self.env.cr.commit()
 
+# number of workers processing the webhook events, each worker has its own cron
+EVENT_WORKERS = 2
+EVENT_CRONS = ['runbot_merge.process_events', 'runbot_merge.process_events_worker']
+EVENT_BATCH = 100
+# number of failures after which an event is set aside
+EVENT_MAX_ATTEMPTS = 5
+
+class Events(models.Model):
+    """ Inbox of github webhook events: the controller only stores them, they
+    are processed asynchronously by the event crons.
+
+    Events are partitioned between workers by key (the PR for PR, comment &
+    review events, the commit for statuses), so each PR's or commit's events
+    are always processed in order.
+
+    A failed event is retried on the following runs (the later events of its
+    key waiting for it), until it's failed ``EVENT_MAX_ATTEMPTS`` times at
+    which point it's set aside as ``failed`` for inspection.
+    """
+    _name = _description = 'runbot_merge.events'
+    _order = 'id'
+
+    event = fields.Char(required=True)
+    delivery = fields.Char(help="Github delivery id")
+    key = fields.Char(required=True)
+    worker = fields.Integer(required=True, group_operator=None)
+    payload = fields.Text(required=True)
+    attempts = fields.Integer(default=0, group_operator=None)
+    failed = fields.Boolean(help="Failed too many times, not processed anymore")
+    error = fields.Text(help="Error of the last attempt")
+
+    def _auto_init(self):
+        res = super()._auto_init()
+        self._cr.execute("""
+            CREATE INDEX IF NOT EXISTS runbot_merge_events_worker
+            ON runbot_merge_events (worker, id)
+        """)
+        return res
+
+    @api.model
+    def _enqueue(self, event, delivery, payload):
+        key = self._key(event, payload)
+        worker = zlib.crc32(key.encode()) % EVENT_WORKERS
+        self.env.cr.execute("""
+        INSERT INTO runbot_merge_events (event, delivery, key, worker, payload, attempts, failed, create_date)
+        VALUES (%s, %s, %s, %s, %s, 0, false, now() at time zone 'utc')
+        """, [event, delivery, key, worker, json.dumps(payload)])
+        self.env.ref(EVENT_CRONS[worker])._trigger()
+
+    @api.model
+    def _key(self, event, payload):
+        repo = payload['repository']['full_name']
+        if event == 'status':
+            return payload['sha']
+        if event in ('pull_request', 'pull_request_review'):
+            return f"{repo}#{payload['pull_request']['number']}"
+        if event == 'issue_comment':
+            return f"{repo}#{payload['issue']['number']}"
+        return repo
+
+    def _process(self, worker=0, commit=False):
+        """ Handles the pending events of ``worker``, oldest first.
+
+        A status superseded by a later status of the same context on the same
+        commit is redundant and skipped.
+        """
+        last = 0
+        # keys of the events which failed during this run
+        blocked = set()
+        while True:
+            self.env.cr.execute("""
+            SELECT id, event, delivery, key, attempts, payload
+            FROM runbot_merge_events
+            WHERE worker = %s AND id > %s AND NOT failed
+            ORDER BY id
+            LIMIT %s
+            """, [worker, last, EVENT_BATCH])
+            rows = self.env.cr.fetchall()
+            if not rows:
+                return
+            last = rows[-1][0]
+
+            events = [
+                (id_, event, delivery, key, attempts, json.loads(payload))
+                for id_, event, delivery, key, attempts, payload in rows
+            ]
+            latest = {
+                (payload['sha'], payload['context']): id_
+                for id_, event, _, key, _, payload in events
+                if event == 'status' and key not in blocked
+            }
+            done = []
+            for id_, event, delivery, key, attempts, payload in events:
+                if key in blocked:
+                    continue
+                if event == 'status' and latest[payload['sha'], payload['context']] != id_:
+                    _logger.debug("Skipping superseded status %s", delivery)
+                    done.append(id_)
+                    continue
+
+                try:
+                    with self.env.cr.savepoint():
+                        controllers.EVENTS[event](self.env, payload)
+                except Exception as e:
+                    _logger.exception("Failed to handle %s event %s (attempt %d)", event, delivery, attempts + 1)
+                    blocked.add(key)
+                    self.browse(id_).write({
+                        'attempts': attempts + 1,
+                        'failed': attempts + 1 >= EVENT_MAX_ATTEMPTS,
+                        'error': str(e),
+                    })
+                else:
+                    done.append(id_)
+
+            self.browse(done).unlink()
+            if commit:
+                self.env.cr.commit()
+
 # The commit (and PR) statuses was originally a map of ``{context:state}``
 # however it turns out to clarify error messages it'd be useful to have
 # a bit more information e.g. a link to the CI's build info on failure and
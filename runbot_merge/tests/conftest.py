@@ -17,6 +17,9 @@ def page(port):
 @pytest.fixture
 def default_crons():
     return [
+        # env['runbot_merge.events']._process()
+        'runbot_merge.process_events',
+        'runbot_merge.process_events_worker',
         # env['runbot_merge.project']._check_fetch()
         'runbot_merge.fetch_prs_cron',
         # env['runbot_merge.commit']._notify()
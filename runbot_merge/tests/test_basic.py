@@ -435,6 +435,37 @@ def test_staging_concurrent(env, repo, config):
     ])
     assert pr2.staging_id
 
+def test_staging_check(env, repo, config):
+    """ The staging cron only checks the branches flagged by an event which
+    may allow creating a staging, the sweep checks all of them
+    """
+    with repo:
+        m = repo.make_commit(None, 'initial', None, tree={'a': 'some content'})
+        repo.make_ref('heads/master', m)
+
+        c = repo.make_commit(m, 'replace file contents', None, tree={'a': 'some other content'})
+        pr = repo.make_pr(title="gibberish", body="blahblah", target='master', head=c)
+        repo.post_status(c, 'success', 'legal/cla')
+        repo.post_status(c, 'success', 'ci/runbot')
+    env.run_crons()
+    branch = env['runbot_merge.branch'].search([('name', '=', 'master')])
+    assert not branch.staging_check, "the branch should have been checked"
+
+    with repo:
+        pr.post_comment('hansen r+', config['role_reviewer']['token'])
+    env.run_crons('runbot_merge.process_events', 'runbot_merge.process_events_worker', 'runbot_merge.process_updated_commits')
+    pr_id = to_pr(env, pr)
+    assert pr_id.state == 'ready'
+    assert branch.staging_check, "the PR getting ready should flag its branch"
+
+    # event lost somehow
+    branch.staging_check = False
+    env.run_crons('runbot_merge.staging_cron')
+    assert not pr_id.staging_id, "an unflagged branch should not be checked"
+    env.run_crons('runbot_merge.staging_sweep_cron')
+    assert pr_id.staging_id, "the sweep should check all the branches"
+    assert not branch.staging_check
+
 def test_staging_conflict_first(env, repo, users, config, page):
     """ If the first batch of a staging triggers a conflict, the PR should be
     marked as in error
@@ -2920,6 +2951,45 @@ class TestBatching(object):
         env.run_crons('runbot_merge.process_updated_commits', 'runbot_merge.merge_cron', 'runbot_merge.staging_cron')
         assert pr2.state == 'merged'
 
+    def test_staging_speculative(self, env, repo, config):
+        """ with a concurrency above 1, prefixes of the staging are staged
+        alongside it, and the longest successful prefix gets merged if the
+        staging fails
+        """
+        env['runbot_merge.project'].search([]).staging_concurrency = 2
+        with repo:
+            m = repo.make_commit(None, 'initial', None, tree={'a': 'some content'})
+            repo.make_ref('heads/master', m)
+
+            pr1 = self._pr(repo, 'PR1', [{'a': 'AAA'}, {'b': 'BBB'}], user=config['role_user']['token'], reviewer=config['role_reviewer']['token'])
+            pr2 = self._pr(repo, 'PR2', [{'a': 'some content', 'c': 'CCC'}, {'d': 'DDD'}], user=config['role_user']['token'], reviewer=config['role_reviewer']['token'])
+        env.run_crons()
+
+        st = env['runbot_merge.stagings'].search([('parent_id', '=', False)])
+        assert len(st.batch_ids) == 2
+        assert len(st.speculative_ids) == 1
+        assert st.speculative_ids.prefix_size == 1
+        assert not st.speculative_ids.batch_ids
+
+        pr1 = env['runbot_merge.pull_requests'].search([('number', '=', pr1.number)])
+        pr2 = env['runbot_merge.pull_requests'].search([('number', '=', pr2.number)])
+        with repo:
+            repo.post_status('heads/staging.master', 'failure', 'ci/runbot')
+            repo.post_status('heads/staging.master', 'success', 'legal/cla')
+            repo.post_status('heads/staging.master.1', 'success', 'ci/runbot')
+            repo.post_status('heads/staging.master.1', 'success', 'legal/cla')
+        env.run_crons()
+
+        assert st.state == 'failure'
+        assert pr1.state == 'merged'
+        assert repo.commit('heads/master').id == json.loads(pr1.commits_map)['']
+        # the rest got split off and restaged
+        assert pr2.state == 'ready'
+        assert pr2.staging_id and pr2.staging_id != st
+        # the ref of the promoted staging is removed once it's done
+        with pytest.raises(AssertionError):
+            repo.get_ref('heads/staging.master.1')
+
 class TestReviewing(object):
     def test_reviewer_rights(self, env, repo, users, config):
         """Only users with review rights will have their r+ (and other
@@ -3266,6 +3336,53 @@ class TestUnknownPR:
             seen(env, pr, users),
         ]
 
+    def test_resync_bulk(self, env, repo, users, config):
+        """ With lots of PRs to fetch the repository gets resynchronised in
+        bulk: unknown PRs are created in the state resulting from their
+        statuses and commands, known PRs are updated the same way webhooks
+        would have
+        """
+        from odoo.addons.runbot_merge.models.pull_requests import RESYNC_THRESHOLD
+        with repo:
+            [m] = repo.make_commits(None, Commit('initial', tree={'m': 'm'}), ref='heads/master')
+            [a] = repo.make_commits(m, Commit('first', tree={'a': '1'}), ref='heads/a')
+            pr_a = repo.make_pr(title='title', body='body', target='master', head='a')
+            repo.post_status(a, 'success', 'legal/cla')
+            repo.post_status(a, 'success', 'ci/runbot')
+            pr_a.post_comment('hansen r+', config['role_reviewer']['token'])
+        env.run_crons()
+        pr_a_id = to_pr(env, pr_a)
+        staging = pr_a_id.staging_id
+        assert staging
+
+        # lose the webhooks
+        hooks, repo._hooks = repo._hooks, None
+        with repo:
+            [a2] = repo.make_commits(a, Commit('second', tree={'a': '2'}), ref='heads/a')
+            [b] = repo.make_commits(m, Commit('other', tree={'b': '1'}), ref='heads/b')
+            pr_b = repo.make_pr(title='title b', body='body b', target='master', head='b')
+            repo.post_status(b, 'success', 'legal/cla')
+            repo.post_status(b, 'success', 'ci/runbot')
+            pr_b.post_comment('hansen r+', config['role_reviewer']['token'])
+        repo._hooks = hooks
+        env['runbot_merge.events'].search([]).unlink()
+
+        Fetch = env['runbot_merge.fetch_job']
+        repo_id = env['runbot_merge.repository'].search([('name', '=', repo.name)])
+        for n in [pr_a.number, pr_b.number, *range(1000, 1000 + RESYNC_THRESHOLD)]:
+            Fetch.create({'repository': repo_id.id, 'number': n})
+        env.run_crons('runbot_merge.fetch_prs_cron')
+        assert not Fetch.search([('repository', '=', repo_id.id)])
+
+        assert pr_a_id.head == a2
+        assert pr_a_id.state == 'opened', "the approval should be reset by the update"
+        assert not pr_a_id.staging_id
+        assert not staging.active, "the staging should be cancelled by the update"
+
+        pr_b_id = to_pr(env, pr_b)
+        assert pr_b_id.state == 'ready'
+        assert pr_b_id.reviewed_by.github_login == users['reviewer']
+
     def test_rplus_unmanaged(self, env, repo, users, config):
         """ r+ on an unmanaged target should notify about
         """
@@ -0,0 +1,94 @@
+""" Benchmarks of the mergebot's crons on large databases, do not require
+github (the PRs are created directly).
+
+They are slow to set up, so only run when ``MERGEBOT_BENCHMARKS`` is set in
+the environment.
+"""
+import os
+import time
+
+import pytest
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get('MERGEBOT_BENCHMARKS'),
+    reason="benchmarks are only run if MERGEBOT_BENCHMARKS is set",
+)
+
+HISTORY = 20000
+BATCH = 1000
+# maximum durations (in seconds) of the linked PRs check, with and without
+# changed PRs
+MAX_CHECK = 5.0
+MAX_IDLE = 1.0
+
+@pytest.fixture
+def bench_project(env):
+    return env['runbot_merge.project'].create({
+        'name': 'odoo',
+        'github_token': 'x',
+        'github_prefix': 'hansen',
+        'branch_ids': [(0, 0, {'name': 'master'})],
+        'repo_ids': [(0, 0, {'name': 'odoo/odoo'}), (0, 0, {'name': 'odoo/enterprise'})],
+    })
+
+def test_linked_prs_statuses(env, bench_project):
+    """ With lots of historical PRs the linked PRs check should only look at
+    the PRs which changed since its last run
+    """
+    branch = bench_project.branch_ids
+    odoo, enterprise = bench_project.repo_ids
+    PRs = env['runbot_merge.pull_requests']
+
+    for start in range(0, HISTORY, BATCH):
+        PRs.create([{
+            'number': n,
+            'repository': (odoo if n % 2 else enterprise).id,
+            'target': branch.id,
+            'label': f'dev:branch-{n // 2}',
+            'head': f'{n:040x}',
+            'message': f'PR {n}',
+            'state': 'merged' if n % 3 else 'closed',
+        } for n in range(start + 1, start + BATCH + 1)])
+
+    # a few open batches, one of which is half-ready, plus a multi-commit PR
+    # without merge method
+    live = PRs.create([{
+        'number': HISTORY + n,
+        'repository': (odoo if n % 2 else enterprise).id,
+        'target': branch.id,
+        'label': f'dev:live-{n // 2}',
+        'head': f'{HISTORY + n:040x}',
+        'message': f'PR {HISTORY + n}',
+        'squash': True,
+    } for n in range(1, 11)])
+    ready, unready = PRs.search([('label', '=', 'dev:live-1')], order='number')
+    ready.state = 'ready'
+    unmethodical = PRs.search([('label', '=', 'dev:live-3')], order='number')[0]
+    unmethodical.write({'state': 'ready', 'squash': False})
+
+    Feedback = env['runbot_merge.pull_requests.feedback']
+    feedback_before = Feedback.search_count([])
+
+    first = check_linked_prs(env)
+    assert first < MAX_CHECK, f"linked PRs check on {HISTORY + len(live)} PRs took {first:.3f}s"
+    assert ready.link_warned
+    assert not unready.link_warned
+    assert unmethodical.method_warned
+    assert Feedback.search_count([]) - feedback_before == 3, \
+        "warnings for the half-ready batch and the unmethodical PR (which is" \
+        " also half-ready)"
+    assert not PRs.search_count([('link_check', '=', True)])
+
+    # nothing changed, nothing to examine
+    second = check_linked_prs(env)
+    assert Feedback.search_count([]) - feedback_before == 3
+    assert second < MAX_IDLE, f"idle linked PRs check took {second:.3f}s"
+
+def check_linked_prs(env):
+    """ Runs the linked PRs cron directly (without :meth:`Environment.run_crons`'s
+    sleep), returns its duration
+    """
+    _, cron_id = env('ir.model.data', 'check_object_reference', 'runbot_merge', 'check_linked_prs_status')
+    start = time.time()
+    env('ir.cron', 'method_direct_trigger', [cron_id])
+    return time.time() - start
@@ -0,0 +1,107 @@
+""" Checks the queueing and processing of the webhook events, does not
+require github (the events are sent directly to the hooks controller).
+"""
+import json
+import uuid
+
+import pytest
+import requests
+
+from odoo.addons.runbot_merge.models.pull_requests import EVENT_MAX_ATTEMPTS
+
+REPO = 'owner/repo'
+
+@pytest.fixture
+def send(port):
+    def send(event, payload):
+        r = requests.post(
+            f'http://localhost:{port}/runbot_merge/hooks',
+            json={**payload, 'repository': {'full_name': REPO}},
+            headers={
+                'X-Github-Event': event,
+                'X-Github-Delivery': str(uuid.uuid4()),
+            },
+        )
+        r.raise_for_status()
+    return send
+
+def status(sha, context, state, **kw):
+    return {
+        'sha': sha,
+        'context': context,
+        'state': state,
+        'target_url': None,
+        'description': None,
+        **kw,
+    }
+
+def state(env, sha, context):
+    c = env['runbot_merge.commit'].search([('sha', '=', sha)])
+    return json.loads(c.statuses or '{}').get(context, {}).get('state')
+
+def test_enqueue(env, send):
+    """ Events are only stored by the controller, events with the same key
+    are handled by the same worker
+    """
+    sha = '1' * 40
+    send('status', status(sha, 'ci', 'pending'))
+    send('status', status(sha, 'lint', 'success'))
+
+    events = env['runbot_merge.events'].search([])
+    assert len(events) == 2
+    assert set(events.mapped('key')) == {sha}
+    assert len(set(events.mapped('worker'))) == 1
+    assert not state(env, sha, 'lint')
+
+    env.process_hooks()
+    assert not env['runbot_merge.events'].search([])
+    assert state(env, sha, 'ci') == 'pending'
+    assert state(env, sha, 'lint') == 'success'
+
+def test_superseded_status(env, send):
+    """ A status followed by a status of the same context on the same commit
+    is not handled, the broken status would fail otherwise
+    """
+    sha = '2' * 40
+    broken = status(sha, 'ci', 'pending')
+    del broken['description']
+    send('status', broken)
+    send('status', status(sha, 'ci', 'success'))
+
+    env.process_hooks()
+    assert not env['runbot_merge.events'].search([])
+    assert state(env, sha, 'ci') == 'success'
+
+def test_failure(env, send):
+    """ A failed event is kept and retried, the following events of its key
+    wait for it until it's set aside
+    """
+    sha, other = '3' * 40, '4' * 40
+    broken = status(sha, 'ci', 'pending')
+    del broken['description']
+    send('status', broken)
+    send('status', status(sha, 'lint', 'success'))
+    send('status', status(other, 'ci', 'success'))
+
+    env.process_hooks()
+    Events = env['runbot_merge.events']
+    failed = Events.search([('key', '=', sha)], order='id', limit=1)
+    assert failed.attempts == 1
+    assert not failed.failed
+    assert 'description' in failed.error
+    assert len(Events.search([('key', '=', sha)])) == 2, \
+        "the event following the failed one should wait"
+    assert not state(env, sha, 'lint')
+    assert not Events.search([('key', '=', other)]), \
+        "events of other keys should not be blocked"
+    assert state(env, other, 'ci') == 'success'
+
+    for _ in range(EVENT_MAX_ATTEMPTS - 1):
+        env.process_hooks()
+    assert failed.attempts == EVENT_MAX_ATTEMPTS
+    assert failed.failed
+
+    env.process_hooks()
+    assert Events.search([('key', '=', sha)]) == failed, \
+        "the following event should be handled once the failed one is set aside"
+    assert state(env, sha, 'lint') == 'success'
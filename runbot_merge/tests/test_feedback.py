@@ -0,0 +1,122 @@
+""" Checks the delivery of the feedback and tagging queues: folding of the
+label changes, retries of the failed deliveries, dropping them after too many
+attempts.
+
+Failures are triggered by sending to a PR which does not exist.
+"""
+import datetime
+
+import pytest
+
+from utils import Commit, to_pr
+from odoo.addons.runbot_merge.models.pull_requests import MAX_ATTEMPTS
+
+MISSING_PR = 999999
+FMT = '%Y-%m-%d %H:%M:%S'
+
+@pytest.fixture
+def repo(env, project, make_repo, users, setreviewers):
+    r = make_repo('repo')
+    project.write({'repo_ids': [(0, 0, {
+        'name': r.name,
+        'group_id': False,
+        'required_statuses': 'legal/cla,ci/runbot'
+    })]})
+    setreviewers(*project.repo_ids)
+    return r
+
+@pytest.fixture
+def pr(env, repo):
+    with repo:
+        [m] = repo.make_commits(None, Commit('initial', tree={'a': '0'}), ref='heads/master')
+        repo.make_commits(m, Commit('change', tree={'a': '1'}), ref='heads/change')
+        pr = repo.make_pr(title='title', body='body', target='master', head='change')
+    env.run_crons()
+    return pr
+
+def test_tagging_folded(env, repo, pr):
+    """ All the pending label changes of a PR are folded into a single update
+    """
+    with repo:
+        pr.labels.add('foo')
+    pr_id = to_pr(env, pr)
+    Tagging = env['runbot_merge.pull_requests.tagging']
+    Tagging.create({
+        'repository': pr_id.repository.id,
+        'pull_request': pr.number,
+        'tags_remove': ['foo'],
+        'tags_add': ['bar'],
+    })
+    Tagging.create({
+        'repository': pr_id.repository.id,
+        'pull_request': pr.number,
+        'tags_remove': ['bar'],
+        'tags_add': ['baz'],
+    })
+    env.run_crons('runbot_merge.labels_cron')
+
+    assert 'baz' in pr.labels
+    assert 'foo' not in pr.labels
+    assert 'bar' not in pr.labels
+    assert not Tagging.search([('pull_request', '=', pr.number)])
+
+def test_tagging_retry(env, repo, pr):
+    """ A failed label update is retried later, and dropped after too many
+    failures
+    """
+    pr_id = to_pr(env, pr)
+    tagging = env['runbot_merge.pull_requests.tagging'].create({
+        'repository': pr_id.repository.id,
+        'pull_request': MISSING_PR,
+        'tags_add': ['foo'],
+    })
+    env.run_crons('runbot_merge.labels_cron')
+    assert tagging.exists()
+    assert tagging.attempts == 1
+    assert tagging.retry_after > datetime.datetime.utcnow().strftime(FMT)
+
+    tagging.write({'attempts': MAX_ATTEMPTS - 1, 'retry_after': '1900-01-01 01:01:01'})
+    env.run_crons('runbot_merge.labels_cron')
+    assert not tagging.exists()
+
+def test_feedback_retry(env, repo, pr):
+    """ A failed feedback is retried once its delay expired, the feedback
+    queued after it for the same PR waits for it
+    """
+    pr_id = to_pr(env, pr)
+    Feedback = env['runbot_merge.pull_requests.feedback']
+    first = Feedback.create({
+        'repository': pr_id.repository.id,
+        'pull_request': MISSING_PR,
+        'message': 'first',
+    })
+    second = Feedback.create({
+        'repository': pr_id.repository.id,
+        'pull_request': MISSING_PR,
+        'message': 'second',
+    })
+    env.run_crons('runbot_merge.feedback_cron')
+    assert first.attempts == 1
+    assert first.retry_after > datetime.datetime.utcnow().strftime(FMT)
+    assert second.exists() and second.attempts == 0, \
+        "the feedback should not skip ahead of the failed one"
+
+    env.run_crons('runbot_merge.feedback_cron')
+    assert first.attempts == 1, "the feedback should not be retried before its delay"
+
+    # github is back
+    (first | second).write({'pull_request': pr.number, 'retry_after': '1900-01-01 01:01:01'})
+    env.run_crons('runbot_merge.feedback_cron')
+    assert not (first | second).exists()
+    assert [body for _, body in pr.comments][-2:] == ['first', 'second']
+
+def test_feedback_dropped(env, repo, pr):
+    pr_id = to_pr(env, pr)
+    feedback = env['runbot_merge.pull_requests.feedback'].create({
+        'repository': pr_id.repository.id,
+        'pull_request': MISSING_PR,
+        'message': 'nope',
+        'attempts': MAX_ATTEMPTS - 1,
+    })
+    env.run_crons('runbot_merge.feedback_cron')
+    assert not feedback.exists(), "the feedback should be dropped after too many failures"
@@ -0,0 +1,73 @@
+""" Unit tests of the github client helpers, do not require github or a
+server.
+"""
+import threading
+from unittest import mock
+
+import pytest
+import requests
+
+from odoo.addons.runbot_merge import github
+
+def response(status_code, headers=None, body=b''):
+    r = requests.Response()
+    r.status_code = status_code
+    r.headers.update(headers or {})
+    r._content = body
+    r.encoding = 'utf-8'
+    return r
+
+@pytest.mark.parametrize('r, delay', [
+    (response(200), None),
+    (response(404), None),
+    (response(403, body=b'{"message": "Resource not accessible"}'), None),
+    (response(403, {'Retry-After': '30'}), 30),
+    (response(429, {'Retry-After': '5'}), 5),
+    (response(403, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '1000042'}), 42),
+    # reset already passed
+    (response(403, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '999990'}), 1),
+    (response(403, {'X-RateLimit-Remaining': '12'}, b'{"message": "You have exceeded a secondary rate limit."}'), 60),
+])
+def test_rate_limit_wait(r, delay):
+    with mock.patch.object(github.time, 'time', return_value=1000000):
+        assert github._rate_limit_wait(r) == delay
+
+def test_request_rate_limited():
+    """ Rate limited requests are retried after the delay, unless it's too long
+    """
+    gh = github.GH('token', 'owner/repo')
+    with mock.patch.object(gh, '_session') as session, \
+         mock.patch.object(github.time, 'sleep') as sleep:
+        session.request.side_effect = [response(429, {'Retry-After': '3'}), response(200)]
+        assert gh._request('get', 'https://api.github.com/rate_limit').status_code == 200
+        sleep.assert_called_once_with(3)
+
+        sleep.reset_mock()
+        session.request.side_effect = [response(429, {'Retry-After': str(github.RATE_LIMIT_MAX_WAIT + 1)})]
+        assert gh._request('get', 'https://api.github.com/rate_limit').status_code == 429
+        sleep.assert_not_called()
+
+def test_session_per_token():
+    assert github._session('a') is github._session('a')
+    assert github._session('a') is not github._session('b')
+    assert github._session('b').headers['Authorization'] == 'token b'
+
+def test_concurrently():
+    threads = set()
+    def call(n):
+        threads.add(threading.get_ident())
+        return n * 2
+    assert github.concurrently(lambda n=n: call(n) for n in range(5)) == [0, 2, 4, 6, 8]
+    assert threading.get_ident() not in threads, "calls should be run by the workers"
+
+def test_concurrently_error():
+    """ The error of a call is raised once all the calls are done
+    """
+    done = []
+    def fail():
+        raise requests.HTTPError("nope")
+    def succeed(n):
+        done.append(n)
+    with pytest.raises(requests.HTTPError, match="nope"):
+        github.concurrently([fail, *(lambda n=n: succeed(n) for n in range(4))])
+    assert sorted(done) == [0, 1, 2, 3]
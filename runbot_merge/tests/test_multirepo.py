@@ -943,6 +943,7 @@ class TestSubstitutions:
                     'sender': {'login': 'pytest'}
                 }
             )
+            env.process_hooks()
             pr = env['runbot_merge.pull_requests'].search([
                 ('repository', '=', r.id),
                 ('number', '=', pr_number)